@@ -8,12 +8,14 @@
 # @Modified By: thepoy
 
 import socketserver
+import hashlib
 import json
 import re
+import threading
 
 from http.server import BaseHTTPRequestHandler
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from tests import IMAGES_DIR
 from requests_toolbelt.multipart import decoder
 
@@ -58,6 +60,18 @@ class Handler(BaseHTTPRequestHandler):
 
         self.wfile.write(path.open("rb").read())
 
+    def do_HEAD(self):
+        path = Path("." + self.path)
+
+        if not path.exists():
+            self.send_error(404)
+
+            return
+
+        self.send_response(200)
+
+        self.set_headers("image/png", path.stat().st_size)
+
     def do_POST(self):
         length = int(self.headers["content-length"])
         body = self.rfile.read(length)
@@ -98,6 +112,87 @@ class Handler(BaseHTTPRequestHandler):
         return
 
 
+class GithubHandler(BaseHTTPRequestHandler):
+    """GitHub Git Data API 的本地替身，只实现批量上传用到的接口。"""
+
+    server: "GithubServer"
+
+    def send_json(self, status: int, data: Dict[str, Any]):
+        body = json.dumps(data).encode()
+
+        self.send_response(status)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self) -> Dict[str, Any]:
+        length = int(self.headers["content-length"])
+        return json.loads(self.rfile.read(length))
+
+    def record(self):
+        with self.server.lock:
+            self.server.calls.append((self.command, self.path))
+
+    def do_GET(self):
+        self.record()
+
+        if self.path.endswith("/git/ref/heads/main"):
+            self.send_json(200, {"object": {"sha": self.server.head}})
+        elif "/git/commits/" in self.path:
+            self.send_json(200, {"tree": {"sha": "tree-" + self.path.split("/")[-1]}})
+        else:
+            self.send_json(404, {"message": "Not Found"})
+
+    def do_POST(self):
+        self.record()
+
+        data = self.read_json()
+        sha = hashlib.sha1(json.dumps(data).encode()).hexdigest()
+
+        if self.path.endswith("/git/blobs"):
+            with self.server.lock:
+                self.server.blobs[sha] = data["content"]
+        elif self.path.endswith("/git/trees"):
+            with self.server.lock:
+                self.server.trees[sha] = data
+        elif not self.path.endswith("/git/commits"):
+            self.send_json(404, {"message": "Not Found"})
+            return
+
+        self.send_json(201, {"sha": sha})
+
+    def do_PATCH(self):
+        self.record()
+
+        if not self.path.endswith("/git/refs/heads/main"):
+            self.send_json(404, {"message": "Not Found"})
+            return
+
+        self.server.head = self.read_json()["sha"]
+        self.send_json(200, {"object": {"sha": self.server.head}})
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+
+class GithubServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__((HOST, 0), GithubHandler)
+
+        self.lock = threading.Lock()
+        self.head = "0" * 40
+        self.calls: List[Tuple[str, str]] = []
+        self.blobs: Dict[str, str] = {}
+        self.trees: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def url(self) -> str:
+        return "http://%s:%d" % self.server_address
+
+
 def check_server():
     import socket
 
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import os
+import pytest
+
+from pathlib import Path
+from up2b.up2b_lib.artifacts import ArtifactStore
+from up2b.up2b_lib.utils import use_work_dir
+
+
+def produce(tmp_path: Path, name: str, size: int) -> Path:
+    path = tmp_path / name
+    path.write_bytes(b"0" * size)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path: Path):
+    path = tmp_path / "work"
+    path.mkdir()
+    with use_work_dir(path):
+        yield path
+
+
+def stored(store: ArtifactStore, key: str) -> Path:
+    entry = store._entry(key)
+    return entry / os.listdir(entry)[0]
+
+
+class TestArtifactStore:
+    def test_put_and_get(self, tmp_path: Path, work_dir: Path):
+        store = ArtifactStore(tmp_path / "store", 1024)
+        key = store.key("md5", "compress", {"format": "webp", "max_size": 10})
+        assert key != store.key("md5", "compress", {"format": "jpeg", "max_size": 10})
+        assert store.get(key) is None
+
+        produced = produce(tmp_path, "a.webp", 100)
+        assert store.put(key, produced) == produced
+
+        got = store.get(key)
+        assert got is not None
+        assert got.name == "a.webp"
+        assert got.read_bytes() == produced.read_bytes()
+        # 返回的是当前批次临时目录中的文件，而不是缓存中的文件
+        assert got.parent.parent == work_dir
+
+    def test_evict_least_recently_used(self, tmp_path: Path):
+        store = ArtifactStore(tmp_path / "store", 350)
+
+        for i in range(3):
+            store.put(str(i), produce(tmp_path, "%d.jpg" % i, 100))
+            # 保证修改时间不同
+            os.utime(stored(store, str(i)), (i, i))
+
+        store.get("0")
+        store.put("3", produce(tmp_path, "3.jpg", 100))
+
+        assert store.get("1") is None
+        assert store.get("0") is not None
+        assert store.get("2") is not None
+        assert store.size() == 300
+
+    def test_evicted_artifact_still_readable(self, tmp_path: Path):
+        store = ArtifactStore(tmp_path / "store", 150)
+
+        store.put("0", produce(tmp_path, "0.jpg", 100))
+        got = store.get("0")
+        assert got is not None
+        os.utime(stored(store, "0"), (0, 0))
+
+        # 其他图片保存后淘汰了 "0"，已取出的文件仍可上传
+        store.put("1", produce(tmp_path, "1.jpg", 100))
+        assert store.get("0") is None
+        assert got.read_bytes() == b"0" * 100
+
+    def test_put_does_not_rescan(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        store = ArtifactStore(tmp_path / "store", 1000)
+
+        scans = []
+        entries = store._entries
+        monkeypatch.setattr(store, "_entries", lambda: scans.append(1) or entries())
+
+        for i in range(5):
+            store.put(str(i), produce(tmp_path, "%d.jpg" % i, 100))
+
+        assert len(scans) == 1
+        assert store.size() == 500
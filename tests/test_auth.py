@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import time
+import threading
+
+from up2b.up2b_lib.auth import TokenRefresher
+
+
+class TestTokenRefresher:
+    def test_single_flight(self):
+        refresher = TokenRefresher(None)
+        calls = []
+
+        def update():
+            time.sleep(0.05)
+            calls.append(1)
+
+        # 所有请求都使用同一个 token 发送后被拒绝的
+        generation = refresher.generation
+        threads = [
+            threading.Thread(target=refresher.refresh, args=(generation, update))
+            for _ in range(8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(calls) == 1
+        assert refresher.generation == generation + 1
+
+    def test_refresh_if_expired(self):
+        calls = []
+
+        refresher = TokenRefresher(60, time.time())
+        assert not refresher.refresh_if_expired(lambda: calls.append(1))
+
+        refresher = TokenRefresher(60, time.time() - 61)
+        assert refresher.refresh_if_expired(lambda: calls.append(1))
+        assert not refresher.refresh_if_expired(lambda: calls.append(1))
+        assert len(calls) == 1
+
+        assert not TokenRefresher(None, 0).expired()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import os
+import pytest
+import sqlite3
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from up2b.up2b_lib import cache as cache_module
+from up2b.up2b_lib.cache import SCHEMA_VERSION, Cache, file_digest, file_md5
+from up2b.up2b_lib.custom_types import ImageStream
+
+
+@pytest.fixture
+def database(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    db = tmp_path / "cache.db"
+    monkeypatch.setattr(cache_module, "CACHE_DATABASE", db)
+    return db
+
+
+class TestCache:
+    def test_file_hash_persisted(
+        self, database: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        image = tmp_path / "a.png"
+        image.write_bytes(b"a" * 4096)
+
+        c = Cache()
+        digest = c.file_hash(image)
+        assert digest == file_md5(image)
+        c.commit()
+
+        def unexpected(*_: object) -> str:
+            raise AssertionError("unchanged file should not be rehashed")
+
+        monkeypatch.setattr(cache_module, "file_digest", unexpected)
+        assert Cache().file_hash(image) == digest
+
+        monkeypatch.undo()
+        monkeypatch.setattr(cache_module, "CACHE_DATABASE", database)
+
+        image.write_bytes(b"b" * 4096)
+        os.utime(image, ns=(0, 1))
+        assert Cache().file_hash(image) == file_md5(image) != digest
+
+    def test_migrate_md5_rows(self, database: Path, tmp_path: Path):
+        image = tmp_path / "a.png"
+        image.write_bytes(b"a" * 4096)
+
+        # 旧版本的数据库结构
+        conn = sqlite3.connect(database)
+        conn.execute("""
+            CREATE TABLE cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+                hash CHAR(128) NOT NULL,
+                image_bed TEXT NOT NULL,
+                url TEXT NOT NULL UNIQUE
+            );
+            """)
+        conn.execute(
+            "INSERT INTO cache (url, hash, image_bed) VALUES (?, ?, ?);",
+            ("https://example.com/a.png", file_md5(image), "sm.ms"),
+        )
+        conn.commit()
+        conn.close()
+
+        c = Cache(algorithm="blake2b")
+        url, digest, ok = c.check_cache_of_image_bed(image, "sm.ms")
+        assert ok and url == "https://example.com/a.png"
+        assert digest == file_digest(image, "blake2b")
+
+        # 命中后记录升级为新算法的摘要
+        assert c.fetchone("SELECT hash, algorithm FROM cache;") == (
+            digest,
+            "blake2b",
+        )
+        assert c.fetchone("PRAGMA user_version;")[0] == SCHEMA_VERSION
+
+    def test_legacy_lookup_only_while_legacy_rows_exist(
+        self, database: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        old, new = tmp_path / "old.png", tmp_path / "new.png"
+        old.write_bytes(b"a" * 4096)
+        new.write_bytes(b"b" * 4096)
+
+        c = Cache()
+        c.save(file_md5(old), "sm.ms", "https://example.com/old.png")
+        c.commit()
+
+        hashed = []
+
+        def digest(filepath: Path, algorithm: str = "md5") -> str:
+            hashed.append((filepath.name, algorithm))
+            return file_digest(filepath, algorithm)
+
+        monkeypatch.setattr(cache_module, "file_digest", digest)
+
+        c = Cache(algorithm="blake2b")
+
+        # 其他图床没有旧记录，不计算旧算法的摘要
+        assert not c.check_cache_of_image_bed(new, "github.com")[2]
+        assert hashed == [("new.png", "blake2b")]
+
+        # 升级最后一条旧记录后，新图片只计算一次摘要
+        assert c.check_cache_of_image_bed(old, "sm.ms")[2]
+        hashed.clear()
+        newer = tmp_path / "newer.png"
+        newer.write_bytes(b"c" * 4096)
+        assert not c.check_cache_of_image_bed(newer, "sm.ms")[2]
+        assert hashed == [("newer.png", "blake2b")]
+
+    def test_file_hashes(self, database: Path, tmp_path: Path):
+        images = []
+        for i in range(5):
+            image = tmp_path / ("%d.png" % i)
+            image.write_bytes(bytes([i]) * (i + 1) * 1024)
+            images.append(image)
+
+        assert Cache().file_hashes(images) == [file_md5(p) for p in images]
+
+    def test_lookup_many(self, database: Path, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(cache_module, "SQLITE_MAX_PARAMS", 3)
+
+        c = Cache()
+        for i in range(10):
+            c.save("hash%d" % i, "sm.ms" if i % 2 else "github.com", "url%d" % i)
+
+        digests = ["hash%d" % i for i in range(12)]
+        assert c.lookup_many(digests) == {"hash%d" % i: "url%d" % i for i in range(10)}
+        assert c.lookup_many(digests, "sm.ms") == {
+            "hash%d" % i: "url%d" % i for i in range(1, 10, 2)
+        }
+
+    def test_check_cache_of_images(self, database: Path, tmp_path: Path):
+        images = []
+        for i in range(3):
+            image = tmp_path / ("%d.png" % i)
+            image.write_bytes(bytes([i]) * 1024)
+            images.append(image)
+
+        c = Cache()
+        c.save(file_md5(images[1]), "sm.ms", "url1")
+
+        assert c.check_cache_of_images(images, "sm.ms") == [
+            ("", file_md5(images[0]), False),
+            ("url1", file_md5(images[1]), True),
+            ("", file_md5(images[2]), False),
+        ]
+
+    def test_write_behind(self, database: Path):
+        c = Cache()
+        c.save("hash", "sm.ms", "url")
+
+        # 提交前当前实例可以查询到，其他连接查询不到
+        assert c.lookup_many(["hash"]) == {"hash": "url"}
+
+        c.flush()
+        assert Cache(database).lookup_many(["hash"], "sm.ms") == {"hash": "url"}
+
+    def test_concurrent_save(self, database: Path):
+        c = Cache()
+
+        def save(i: int):
+            c.save("hash%d" % i, "sm.ms", "url%d" % i)
+            return c.fetchone("PRAGMA journal_mode;")[0]
+
+        with ThreadPoolExecutor(8) as executor:
+            modes = set(executor.map(save, range(100)))
+
+        assert modes == {"wal"}
+
+        c.close()
+        assert Cache(database).fetchone("SELECT COUNT(*) FROM cache;") == (100,)
+
+    def test_memo_invalidated_on_save(self, database: Path):
+        c = Cache()
+        assert c.is_exists("hash", "sm.ms") is None
+        assert c.is_exists("hash") is None
+
+        c.save("hash", "sm.ms", "url")
+        assert c.is_exists("hash", "sm.ms") == "url"
+        assert c.is_exists("hash") == "url"
+        assert c.memo_stats()["urls"]["hits"] == 2
+
+    def test_find_similar(self, database: Path):
+        c = Cache()
+        c.remember_phash("hash", 0b1011)
+        c.save("hash", "sm.ms", "url")
+
+        # 提交前后都能查询到
+        assert c.find_similar(0b1001, "sm.ms", 1) == "url"
+        assert c.find_similar(0b1001, "imgse.com", 1) is None
+
+        c.flush()
+        other = Cache(database)
+        assert other.find_similar(0b1011, "sm.ms", 0) == "url"
+        assert other.find_similar(0b0100, "sm.ms", 2) is None
+        assert other.fetchone("SELECT phash FROM cache;") == ("%016x" % 0b1011,)
+
+    def test_stream_cache(self, database: Path, tmp_path: Path):
+        image = tmp_path / "a.png"
+        image.write_bytes(b"a" * 4096)
+
+        c = Cache()
+        c.save(file_md5(image), "sm.ms", "url")
+
+        stream = ImageStream("a.png", memoryview(image.read_bytes()), "png")
+        assert c.check_cache_of_image_bed(stream, "sm.ms") == (
+            "url",
+            file_md5(image),
+            True,
+        )
+        assert stream.digests == {"md5": file_md5(image)}
+        assert c.check_cache_of_images([stream, image], "sm.ms")[0][2]
+
+    def test_stats(self, database: Path):
+        c = Cache()
+        c.save("hash1", "sm.ms", "url1")
+        c.save("hash2", "sm.ms", "url2")
+        c.save("hash3", "imgse.com", "url3")
+        c.record_stats(hits=3, misses=1, saved_bytes=1024)
+        c.record_stats(hits=1)
+
+        stats = c.stats()
+        assert stats.rows == {"imgse.com": 1, "sm.ms": 2}
+        assert (stats.hits, stats.misses, stats.saved_bytes) == (4, 1, 1024)
+        assert stats.hit_ratio == 0.8
+        assert stats.size > 0
+
+        assert c.find_by_url("url3") == ("hash3", "imgse.com", "md5")
+        assert c.find_by_hash("hash1") == [("sm.ms", "url1")]
+
+    def test_dump_load(self, database: Path, tmp_path: Path):
+        c = Cache()
+        c.remember_phash("hash1", 1)
+        c.save("hash1", "sm.ms", "url1")
+        c.save("hash2", "sm.ms", "url2")
+
+        export = tmp_path / "cache.ndjson"
+        with export.open("w") as f:
+            assert c.dump(f) == 2
+
+        other = Cache(tmp_path / "other.db")
+        other.save("hash2", "sm.ms", "url2")
+        with export.open("a") as f:
+            f.write("not json\n")
+
+        with export.open() as f:
+            assert other.load(f) == (1, 2)
+
+        assert other.find_by_url("url1") == ("hash1", "sm.ms", "md5")
+        assert other.find_similar(1, "sm.ms", 0) == "url1"
+
+    def test_flush_retries_when_locked(
+        self, database: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.setattr(cache_module, "CACHE_BUSY_TIMEOUT", 0.05)
+
+        c = Cache()
+        c.save("first", "sm.ms", "first")
+        c.commit()
+
+        # 其他进程持有写锁
+        other = sqlite3.connect(database, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE;")
+
+        c.save("hash", "sm.ms", "url")
+        assert not c.flush()
+
+        # 提交失败的记录仍在队列中，可以查询到
+        assert c.is_exists("hash", "sm.ms") == "url"
+
+        other.execute("COMMIT;")
+        other.close()
+
+        assert c.flush()
+        assert c.fetchone("SELECT url FROM cache WHERE hash = ?;", "hash") == ("url",)
@@ -1,5 +1,10 @@
+import pytest
+
 from pathlib import Path
+from tests import IMAGES
+from up2b.up2b_lib import offload
 from up2b.up2b_lib.compress import Compressor
+from up2b.up2b_lib.custom_types import CompressedFormat, ImageStream, OptimizePolicy
 
 
 class TestCompress:
@@ -7,3 +12,265 @@ class TestCompress:
         compressor = Compressor(2 * 1024 * 1024)
         compressed_path = compressor(Path("/Users/thepoy/Downloads/day.jpg"))
         assert isinstance(compressed_path, Path)
+
+    def test_compress_in_process(self):
+        compressor = Compressor(50 * 1024, CompressedFormat.WEBP)
+        stream = ImageStream("stream.jpeg", IMAGES[1].read_bytes(), "jpeg")
+
+        compressed_path = offload.compress(compressor, stream, 1)
+        assert isinstance(compressed_path, Path)
+        assert compressed_path.name == "stream.webp"
+        assert compressed_path.stat().st_size <= 50 * 1024
+
+    def test_compress_same_name(self, tmp_path: Path):
+        from concurrent.futures import ThreadPoolExecutor
+
+        # 不同目录中的同名图片
+        sources = []
+        for i in (0, 1):
+            (tmp_path / str(i)).mkdir()
+            source = tmp_path / str(i) / "image.png"
+            source.write_bytes(IMAGES[i].read_bytes())
+            sources.append(source)
+
+        compressor = Compressor(50 * 1024, CompressedFormat.WEBP)
+        with ThreadPoolExecutor(2) as pool:
+            outputs = list(pool.map(compressor, sources))
+
+        assert outputs[0] != outputs[1]
+        assert outputs[0].read_bytes() != outputs[1].read_bytes()
+
+    def test_compress_bounded_attempts(self):
+        from PIL import Image
+
+        with Image.open(IMAGES[1]) as img:
+            img.load()
+            raw = img.copy()
+
+        for max_size in (200 * 1024, 50 * 1024, 5 * 1024):
+            compressor = Compressor(max_size, CompressedFormat.WEBP)
+            result = compressor.compress_to_bytes(raw.copy())
+
+            assert result.size <= max_size
+            assert 1 <= result.attempts <= compressor.max_attempts
+
+        # 最低质量仍超出大小时缩小尺寸
+        assert result.scale < 1
+
+    def test_decode_at_planned_size(self, tmp_path: Path):
+        from PIL import Image
+
+        source = tmp_path / "large.jpeg"
+        with Image.open(IMAGES[1]) as img:
+            img.convert("RGB").resize((2160, 2160)).save(source, quality=95)
+
+        raw_size = source.stat().st_size
+        compressor = Compressor(raw_size // 64, CompressedFormat.JPEG)
+        assert compressor.plan_scale(raw_size) == pytest.approx(0.25, rel=1e-3)
+
+        with Image.open(source) as img:
+            # JPEG 在解码时按 DCT 缩小
+            assert compressor._decode(img, 0.25).size == (540, 540)
+
+        with Image.open(source) as img:
+            result = compressor.compress_to_bytes(img, raw_size)
+
+        assert result.size <= compressor.max_size
+        assert result.scale <= 0.25
+
+    def test_compress_animation(self, tmp_path: Path):
+        from PIL import Image
+
+        with Image.open(IMAGES[1]) as img:
+            base = img.convert("RGB").resize((400, 400))
+
+        frames = []
+        for i in range(20):
+            # 每两帧相同
+            frame = base.rotate(i // 2 * 10)
+            frames.append(frame)
+
+        source = tmp_path / "animated.gif"
+        frames[0].save(
+            source, save_all=True, append_images=frames[1:], duration=50, loop=0
+        )
+
+        max_size = source.stat().st_size // 10
+        compressed = Compressor(max_size, CompressedFormat.JPEG)(source)
+
+        assert isinstance(compressed, Path)
+        assert compressed.suffix == ".webp"
+        assert compressed.stat().st_size <= max_size
+
+        with Image.open(compressed) as img:
+            assert img.is_animated
+            assert img.n_frames <= 10
+
+            total = 0
+            for i in range(img.n_frames):
+                img.seek(i)
+                img.load()
+                total += img.info["duration"]
+
+            # 合并、删除帧后总时长不变
+            assert total == 20 * 50
+
+        # 图床不允许 webp 时动图保持原样
+        compressor = Compressor(max_size, CompressedFormat.JPEG, animation=False)
+        assert compressor(source) == source
+
+    def test_compress_animation_memory_bound(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        from PIL import Image
+        from up2b.up2b_lib import animation
+
+        with Image.open(IMAGES[1]) as img:
+            base = img.convert("RGB").resize((200, 200))
+
+        source = tmp_path / "long.gif"
+        frames = [base.rotate(i * 10) for i in range(12)]
+        frames[0].save(
+            source, save_all=True, append_images=frames[1:], duration=50, loop=0
+        )
+
+        # 编码时传给 Pillow 的所有帧实际占用的字节数
+        materialized = []
+        save = Image.Image.save
+
+        def spy(self, fp, format=None, **params):
+            if params.get("save_all"):
+                append = list(params["append_images"])
+                materialized.append(
+                    sum(
+                        im.width * im.height * len(im.getbands())
+                        for im in [self] + append
+                    )
+                )
+                params["append_images"] = append
+            return save(self, fp, format, **params)
+
+        monkeypatch.setattr(Image.Image, "save", spy)
+
+        # 只够保存 3 帧原尺寸的 RGBA
+        budget = 200 * 200 * 4 * 3
+        monkeypatch.setattr(animation, "ANIMATION_MAX_FRAME_BYTES", budget)
+
+        max_size = source.stat().st_size // 4
+        compressed = Compressor(max_size, CompressedFormat.JPEG)(source)
+
+        assert isinstance(compressed, Path)
+        assert compressed.suffix == ".webp"
+        assert materialized
+        assert max(materialized) <= budget
+
+        # 缩小、减少颜色、隔帧删除后仍超出时只压缩第一帧
+        materialized.clear()
+        monkeypatch.setattr(animation, "ANIMATION_MAX_FRAME_BYTES", 1024)
+
+        compressed = Compressor(max_size, CompressedFormat.JPEG)(source)
+
+        assert isinstance(compressed, Path)
+        assert compressed.suffix == ".jpeg"
+        assert not materialized
+        with Image.open(compressed) as img:
+            assert not getattr(img, "is_animated", False)
+
+    def test_best_format(self, tmp_path: Path):
+        from PIL import Image, ImageDraw
+
+        # 颜色很少的截图以调色板 png 保存时最小
+        source = tmp_path / "screenshot.png"
+        img = Image.new("RGB", (1600, 1200), "white")
+        draw = ImageDraw.Draw(img)
+        for i in range(0, 1200, 40):
+            draw.rectangle((40, i, 40 + i, i + 20), fill=(i % 256, 80, 160))
+            draw.text((1000, i), "up2b %d" % i, fill="black")
+        img.save(source, compress_level=0)
+
+        max_size = source.stat().st_size // 20
+        compressor = Compressor(
+            max_size,
+            CompressedFormat.JPEG,
+            formats=(CompressedFormat.JPEG, CompressedFormat.PNG),
+        )
+
+        with Image.open(source) as img:
+            result = compressor.compress_to_bytes(img)
+
+        assert result.size <= max_size
+        assert result.format == CompressedFormat.PNG
+        assert result.scale == 1
+
+        compressed = compressor(source)
+        assert isinstance(compressed, Path)
+        assert compressed.suffix == ".png"
+
+    def test_optimize(self, tmp_path: Path):
+        from PIL import Image
+
+        source = tmp_path / "photo.png"
+        with Image.open(IMAGES[1]) as img:
+            photo = img.convert("RGB").resize((600, 400))
+
+        exif = Image.Exif()
+        # 顺时针旋转 90 度显示
+        exif[0x0112] = 6
+        photo.save(source, exif=exif, compress_level=0)
+
+        raw_size = source.stat().st_size
+        max_size = raw_size * 2
+
+        # 未开启优化时不压缩未超出大小的图片
+        assert Compressor(max_size, CompressedFormat.WEBP)(source) == source
+
+        compressor = Compressor(
+            max_size, CompressedFormat.WEBP, optimize=OptimizePolicy.RATIO
+        )
+        compressed = compressor(source)
+        assert isinstance(compressed, Path)
+        assert compressed.suffix == ".webp"
+        assert compressed.stat().st_size <= raw_size * (1 - compressor.min_saving)
+
+        with Image.open(compressed) as img:
+            # 按 exif 中的方向旋转后不再保留 exif
+            assert img.size == (400, 600)
+            assert not img.getexif()
+
+        # 节省的空间小于阈值时使用原图
+        compressor = Compressor(
+            max_size,
+            CompressedFormat.WEBP,
+            optimize=OptimizePolicy.SIZE,
+            min_saving=raw_size,
+        )
+        assert compressor(source) == source
+
+    def test_best_format_threads_do_not_share_image(
+        self, monkeypatch: pytest.MonkeyPatch
+    ):
+        from PIL import Image
+
+        with Image.open(IMAGES[1]) as img:
+            raw = img.convert("RGB").resize((160, 160))
+
+        # 有损与无损 webp 都直接保存解码后的图片，不会先转换或缩小
+        compressor = Compressor(
+            10 * 1024 * 1024, CompressedFormat.WEBP, formats=(CompressedFormat.WEBP,)
+        )
+
+        searched = []
+        search = Compressor._search
+
+        def record(self, img, original, name):
+            searched.append(img)
+            return search(self, img, original, name)
+
+        monkeypatch.setattr(Compressor, "_search", record)
+
+        # Pillow 保存时在图片对象上记录编码参数，多个线程不能同时保存同一张图片
+        result = compressor.compress_to_bytes(raw)
+        assert len(searched) == 2
+        assert searched[0] is not searched[1]
+        assert all(img is not raw for img in searched)
+        assert result.encoder == "webp"
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import json
+
+from base64 import b64decode
+from tests import IMAGES
+from up2b.up2b_lib.custom_types import ImageStream
+from up2b.up2b_lib.file import Base64JSONBody
+
+
+class TestBase64JSONBody:
+    def test_path(self):
+        body = Base64JSONBody(IMAGES[1], {"message": "up2b - 2.jpeg"})
+
+        data = b"".join(body)
+        assert len(data) == len(body)
+
+        decoded = json.loads(data)
+        assert decoded["message"] == "up2b - 2.jpeg"
+        assert b64decode(decoded["content"]) == IMAGES[1].read_bytes()
+
+    def test_read_stream_in_blocks(self):
+        raw = bytes(range(256)) * 1000
+        body = Base64JSONBody(ImageStream("s.png", raw, "png"), {})
+
+        blocks = []
+        while True:
+            block = body.read(8192)
+            if not block:
+                break
+
+            blocks.append(block)
+
+        assert b64decode(json.loads(b"".join(blocks))["content"]) == raw
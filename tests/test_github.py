@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import threading
+
+from base64 import b64decode
+from tests import IMAGES
+from tests.server import GithubServer
+from up2b.up2b_lib.constants import ImageBedCode
+from up2b.up2b_lib.custom_types import Config
+from up2b.up2b_lib.up2b_api.github import Github
+
+
+class TestGithubBatch:
+    def test_upload_in_one_commit(self):
+        server = GithubServer()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        auth_info = {
+            "token": "token",
+            "username": "up2b",
+            "repo": "images",
+            "folder": "md",
+        }
+        ib = Github(
+            ignore_cache=True,
+            conf=Config(ImageBedCode.GITHUB, {ImageBedCode.GITHUB: auth_info}),
+        )
+        ib.api_url = server.url
+
+        try:
+            urls = ib.upload_images(*IMAGES, to_console=False, jobs=3, batch=True)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert len(urls) == len(IMAGES)
+        assert len(set(urls)) == len(IMAGES)
+        for url, image in zip(urls, IMAGES):
+            assert isinstance(url, str)
+            assert url.startswith("https://cdn.jsdelivr.net/gh/up2b/images/md/")
+            assert url.endswith(image.suffix)
+
+        assert sorted(b64decode(c) for c in server.blobs.values()) == sorted(
+            image.read_bytes() for image in IMAGES
+        )
+
+        # 每张图片一个 blob，外加读取分支、读取提交、创建 tree、创建提交、更新分支
+        methods = [call[0] for call in server.calls]
+        assert methods.count("POST") == len(IMAGES) + 2
+        assert methods.count("GET") == 2
+        assert methods.count("PATCH") == 1
+
+        (tree,) = server.trees.values()
+        assert len(tree["tree"]) == len(IMAGES)
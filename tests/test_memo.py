@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+from up2b.up2b_lib.memo import MISSING, LRUCache
+
+
+class TestLRUCache:
+    def test_evict_least_recently_used(self):
+        memo = LRUCache(2)
+        memo.put("a", 1)
+        memo.put("b", None)
+        assert memo.get("a") == 1
+
+        memo.put("c", 3)
+        assert memo.get("b") is MISSING
+        assert memo.get("a") == 1
+        assert len(memo) == 2
+
+    def test_ttl(self):
+        now = [0.0]
+        memo = LRUCache(10, ttl=5)
+        memo.clock = lambda: now[0]
+
+        memo.put("a", 1)
+        now[0] = 4.9
+        assert memo.get("a") == 1
+        now[0] = 5
+        assert memo.get("a") is MISSING
+
+    def test_stats(self):
+        memo = LRUCache(10)
+        memo.put("a", 1)
+        memo.get("a")
+        memo.get("b")
+        memo.invalidate("a")
+        assert memo.get("a") is MISSING
+        assert memo.stats() == {"size": 0, "hits": 1, "misses": 2}
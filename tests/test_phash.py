@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import random
+
+from pathlib import Path
+from PIL import Image
+from up2b.up2b_lib.phash import BKTree, dhash, hamming
+
+
+class TestPhash:
+    def test_dhash_reencoded(self, tmp_path: Path):
+        png = Path(__file__).parent / "images" / "1.png"
+
+        jpeg = tmp_path / "1.jpeg"
+        with Image.open(png) as img:
+            img.convert("RGB").save(jpeg, quality=60)
+
+        assert hamming(dhash(png), dhash(jpeg)) <= 4
+
+    def test_bktree(self):
+        rng = random.Random(0)
+        values = [rng.getrandbits(64) for _ in range(2000)]
+
+        tree = BKTree()
+        for i, v in enumerate(values):
+            tree.add(v, i)
+
+        target = values[100] ^ 0b101
+        expected = sorted(
+            (hamming(target, v), i)
+            for i, v in enumerate(values)
+            if hamming(target, v) <= 6
+        )
+
+        result = tree.search(target, 6)
+        assert sorted(result) == expected
+        assert result[0] == (2, 100)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import sys
+import time
+import pytest
+
+from up2b.up2b_lib.pipeline import Done, Pipeline, Stage
+
+
+def slow_double(n: int) -> int:
+    # 越小的数处理得越慢，用于检查结果是否仍按输入顺序返回
+    time.sleep(0.01 * (10 - n))
+    return n * 2
+
+
+def skip_odd(n: int):
+    if n % 2:
+        return Done(-n)
+
+    return n
+
+
+class TestPipeline:
+    def test_keep_order(self):
+        pipeline = Pipeline(
+            [Stage("double", slow_double, 4), Stage("inc", lambda n: n + 1, 2)]
+        )
+        assert pipeline.run(range(10)) == [n * 2 + 1 for n in range(10)]
+
+    def test_done_skips_following_stages(self):
+        pipeline = Pipeline([Stage("skip", skip_odd), Stage("inc", lambda n: n + 1)])
+        assert pipeline.run([1, 2, 3, 4]) == [-1, 3, -3, 5]
+
+    def test_raise_after_all_items_processed(self):
+        processed = []
+
+        def fail_on_two(n: int) -> int:
+            if n == 2:
+                raise ValueError(n)
+            return n
+
+        pipeline = Pipeline(
+            [Stage("fail", fail_on_two, 2), Stage("record", processed.append)],
+            queue_size=1,
+        )
+        with pytest.raises(ValueError):
+            pipeline.run([1, 2, 3, 4])
+
+        assert sorted(processed) == [1, 3, 4]
+
+    def test_errors_as_results(self):
+        def fail_on_two(n: int) -> int:
+            if n == 2:
+                raise ValueError(n)
+            return n
+
+        pipeline = Pipeline(
+            [Stage("fail", fail_on_two, 2), Stage("inc", lambda n: n + 1)],
+            on_error=lambda item, e: "error %d: %s" % (item, e),
+        )
+        assert pipeline.run([1, 2, 3]) == [2, "error 2: 2", 4]
+
+    def test_system_exit_does_not_hang(self):
+        processed = []
+
+        def exit_on_two(n: int) -> int:
+            if n == 2:
+                sys.exit(1)
+            return n
+
+        pipeline = Pipeline(
+            [Stage("exit", exit_on_two), Stage("record", processed.append)],
+            queue_size=1,
+            on_error=lambda item, e: e,
+        )
+        with pytest.raises(SystemExit):
+            pipeline.run([1, 2, 3])
+
+        assert processed == [1, 3]
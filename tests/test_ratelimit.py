@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import time
+import pytest
+import requests
+
+from up2b.up2b_lib.ratelimit import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+def make_bucket(rate: float, burst: int) -> TokenBucket:
+    clock = FakeClock()
+    bucket = TokenBucket(rate, burst)
+    bucket.clock = clock
+    bucket.sleep = clock.sleep
+    bucket._updated_at = clock.now
+    return bucket
+
+
+class TestTokenBucket:
+    def test_rate(self):
+        bucket = make_bucket(2, 3)
+        for _ in range(3 + 10):
+            bucket.acquire()
+
+        # 突发的 3 个请求不需要等待，之后每秒 2 个
+        assert bucket.clock() == 5
+
+    def test_pause(self):
+        bucket = make_bucket(10, 1)
+        bucket.pause(30)
+        bucket.acquire()
+        assert bucket.clock() >= 30
+
+    def test_observe_headers(self):
+        bucket = make_bucket(10, 1)
+
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.headers["X-RateLimit-Remaining"] = "100"
+        resp.headers["X-RateLimit-Reset"] = str(time.time() + 1000)
+        bucket.observe(resp)
+        assert bucket.rate == pytest.approx(0.1, rel=0.01)
+
+        resp.headers["X-RateLimit-Remaining"] = "0"
+        bucket.observe(resp)
+        bucket.acquire()
+        assert bucket.clock() > 990
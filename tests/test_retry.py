@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import pytest
+import requests
+
+from typing import Dict, List, Optional
+from up2b.up2b_lib.retry import (
+    AUTH,
+    RetryBudget,
+    RetryPolicy,
+    RetryRule,
+    SERVER,
+    batch_budget,
+    current_budget,
+)
+
+
+def make_response(status_code: int, headers: Optional[Dict[str, str]] = None):
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp.headers.update(headers or {})
+    return resp
+
+
+class FakeServer:
+    def __init__(self, responses: List):
+        self.responses = responses
+        self.calls = 0
+
+    def __call__(self) -> requests.Response:
+        r = self.responses[min(self.calls, len(self.responses) - 1)]
+        self.calls += 1
+        if isinstance(r, Exception):
+            raise r
+        return r
+
+
+@pytest.fixture
+def policy():
+    p = RetryPolicy()
+    p.delays = []
+    p.sleep = p.delays.append
+    return p
+
+
+class TestRetryPolicy:
+    def test_retry_server_error(self, policy: RetryPolicy):
+        send = FakeServer([make_response(503), make_response(200)])
+        assert policy.call(send).status_code == 200
+        assert send.calls == 2
+
+    def test_give_up_after_retries(self, policy: RetryPolicy):
+        send = FakeServer([make_response(502)])
+        assert policy.call(send).status_code == 502
+        assert send.calls == policy.rules[SERVER].retries + 1
+
+    def test_retry_after(self, policy: RetryPolicy):
+        send = FakeServer(
+            [make_response(429, {"Retry-After": "7"}), make_response(200)]
+        )
+        policy.call(send)
+        assert policy.delays == [7]
+
+    def test_connection_error(self, policy: RetryPolicy):
+        send = FakeServer(
+            [requests.exceptions.ConnectionError("reset"), make_response(200)]
+        )
+        assert policy.call(send).status_code == 200
+
+        send = FakeServer([ValueError("bug")])
+        with pytest.raises(ValueError):
+            policy.call(send)
+        assert send.calls == 1
+
+    def test_retry_if(self, policy: RetryPolicy):
+        refreshed: List[str] = []
+        send = FakeServer([make_response(400), make_response(200)])
+        resp = policy.call(
+            send,
+            lambda r: AUTH if r.status_code == 400 else None,
+            refreshed.append,
+        )
+        assert resp.status_code == 200
+        assert refreshed == [AUTH]
+
+    def test_budget(self, policy: RetryPolicy):
+        policy.rules[SERVER] = RetryRule(10, 0)
+        budget = RetryBudget(2)
+        send = FakeServer([make_response(500)])
+        policy.call(send, budget=budget)
+        assert send.calls == 3
+        assert budget.remaining == 0
+
+    def test_batch_budget_scope(self):
+        import asyncio
+
+        assert current_budget() is None
+
+        with batch_budget(5) as budget:
+            assert current_budget() is budget
+            assert budget.remaining == 5
+
+        # 批次结束后的请求不再使用已耗尽的预算
+        assert current_budget() is None
+
+        async def batch(count: int) -> int:
+            with batch_budget(count):
+                await asyncio.sleep(0.01)
+                budget = current_budget()
+                assert budget is not None
+                return budget.remaining
+
+        async def main():
+            return await asyncio.gather(batch(4), batch(8))
+
+        # 同时进行的批次不会覆盖彼此的预算
+        assert asyncio.run(main()) == [4, 8]
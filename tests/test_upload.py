@@ -10,6 +10,7 @@
 import sys
 import os
 import json
+import asyncio
 import mimetypes
 import time
 import requests
@@ -135,3 +136,44 @@ class TestUpload:
     def test_check_images(self):
         with pytest.raises(OverSizeError):
             self.ib._check_images_valid(IMAGES)
+
+
+class ConcurrentImageBed(ImageBed):
+    max_size = 10 * 1024 * 1024
+    max_jobs = 3
+
+    def check_login(self):
+        pass
+
+    def upload_image(self, image_path: ImagePath) -> Union[str, UploadErrorResponse]:
+        # 越靠前的图片上传得越慢，用于检查结果是否仍按输入顺序返回
+        time.sleep(0.05 * (len(IMAGES) - IMAGES.index(image_path)))
+        return image_path.name
+
+
+class TestConcurrentUpload:
+    ib = ConcurrentImageBed()
+
+    def test_upload_images_keep_order(self):
+        urls = self.ib.upload_images(*IMAGES, to_console=False, jobs=8)
+        assert urls == [image.name for image in IMAGES]
+
+    def test_aupload_images_keep_order(self):
+        urls = asyncio.run(self.ib.aupload_images(*IMAGES, jobs=8))
+        assert urls == [image.name for image in IMAGES]
+
+
+def test_animation_needs_webp():
+    from up2b.up2b_lib.errors import UnsupportedType
+    from up2b.up2b_lib.up2b_api.imgtu import Imgtu
+
+    gif = IMAGES[0].with_suffix(".gif")
+
+    # imgtu 不允许 webp，无法压缩动图
+    imgtu = Imgtu(auto_compress=True)
+    with pytest.raises(UnsupportedType):
+        imgtu._check_images_valid((gif,))
+    assert imgtu.compressor is not None and not imgtu.compressor.animation
+
+    ib = ImageBed(auto_compress=True)
+    ib._check_images_valid((gif,))
@@ -31,9 +31,31 @@ class TestUtils:
         path = utils.check_path(
             "https://raw.githubusercontent.com/thep0y/image-bed/main/test/1647607453268.jpg"
         )
-        assert CACHE_PATH / "1647607453268.jpg" == path
+        assert isinstance(path, Path)
+        assert path.name == "1647607453268.jpg"
+        assert path.parent.parent == CACHE_PATH
 
         path = utils.check_path(
             "https://raw.githubusercontent.com/thep0y/image-bed/main/test/test.jpg"
         )
         assert isinstance(path, DownloadErrorResponse)
+
+    def test_batch_work_dir(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        assert utils.work_dir() == CACHE_PATH
+
+        with utils.batch_work_dir() as outer:
+            assert outer.parent == CACHE_PATH
+            with utils.batch_work_dir() as inner:
+                assert inner.parent == outer
+
+            # 内层批次结束时只删除自己的目录
+            assert not inner.exists() and outer.exists()
+
+            with ThreadPoolExecutor(2) as pool:
+                assert pool.submit(utils.in_context(utils.work_dir)).result() == outer
+                assert pool.submit(utils.work_dir).result() == CACHE_PATH
+
+        assert not outer.exists()
+        assert utils.work_dir() == CACHE_PATH
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import pytest
+import socketserver
+import threading
+
+from pathlib import Path
+from up2b.up2b_lib import cache as cache_module
+from up2b.up2b_lib.cache import Cache
+from up2b.up2b_lib.verify import verify_cache
+from tests import BASE_DIR
+from tests.server import HOST, Handler
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server_url(monkeypatch: pytest.MonkeyPatch):
+    # Handler 以当前目录为根目录
+    monkeypatch.chdir(BASE_DIR)
+    monkeypatch.setattr(Handler, "log_message", lambda *args: None)
+
+    server = Server((HOST, 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    yield "http://%s:%d" % server.server_address
+
+    server.shutdown()
+    server.server_close()
+
+
+class TestVerify:
+    def test_verify_cache(
+        self, server_url: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.setattr(cache_module, "CACHE_DATABASE", tmp_path / "cache.db")
+
+        c = Cache()
+        alive = ["/images/1.png", "/images/2.jpeg", "/images/3.jpeg"]
+        dead = ["/images/missing-%d.png" % i for i in range(20)]
+        for i, path in enumerate(alive + dead):
+            c.save("hash%d" % i, "sm.ms", server_url + path)
+
+        result = verify_cache(c, jobs=8, timeout=5, prune=False, quiet=True)
+        assert (result.total, result.alive, result.pruned) == (23, 3, 0)
+        assert sorted(result.dead) == sorted(server_url + p for p in dead)
+        assert c.count() == 23
+
+        result = verify_cache(c, jobs=8, timeout=5, quiet=True)
+        assert result.pruned == 20
+        assert c.count() == 3
+        assert c.is_exists("hash3", "sm.ms") is None
+        assert c.is_exists("hash0", "sm.ms") == server_url + alive[0]
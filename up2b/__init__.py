@@ -6,23 +6,24 @@ import sys
 import json
 import click
 
-from typing import Any, Dict, Optional, Tuple, Type, Union
+from typing import IO, Any, Dict, Optional, Tuple, Type, Union
 from pathlib import Path
 from colort import colorize, ForegroundColor, BackgroundColor
-from up2b.up2b_lib.custom_types import WaterMarkConfig
-from up2b.up2b_lib.up2b_api import choose_image_bed
+from up2b.up2b_lib.custom_types import OptimizePolicy, WaterMarkConfig
+from up2b.up2b_lib.up2b_api import Base, choose_image_bed
 from up2b.up2b_lib.up2b_api.sm import SM
 from up2b.up2b_lib.up2b_api.imgtu import Imgtu
 from up2b.up2b_lib.up2b_api.github import Github
 from up2b.up2b_lib.up2b_api.imgtg import Imgtg
 from up2b.up2b_lib.constants import (
     CACHE_PATH,
+    CACHE_VERIFY_JOBS,
     CONFIG_FILE,
     IMAGE_BEDS_HELP_MESSAGE,
     IMAGE_BEDS_NAME,
     ImageBedCode,
 )
-from up2b.up2b_lib.utils import check_paths, read_conf
+from up2b.up2b_lib.utils import batch_work_dir, check_paths, read_conf
 from up2b.up2b_lib.log import logger
 from up2b.version import __version__  # Automatically create version.py after building
 
@@ -188,6 +189,50 @@ def login_git(access_token: str, username: str, repository: str, path: str):
     help="静默模式。开启后不显示上传进度",
 )
 @click.option("-t", "--timeout", type=float, help="上传图片的超时时间")
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    show_default=True,
+    default=1,
+    help="同时上传的图片数量，不会超过当前图床允许的最大并发数",
+)
+@click.option(
+    "-p",
+    "--processes",
+    type=click.IntRange(min=0),
+    show_default=True,
+    default=0,
+    help="在多少个子进程中压缩图片、添加水印，0 表示在当前进程中处理",
+)
+@click.option(
+    "-s",
+    "--similar",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="缓存中没有同样的图片时，查询看起来相同的图片（如重新编码、修改元数据后的图片），需要安装 pillow",
+)
+@click.option(
+    "-bf",
+    "--best-format",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="压缩时尝试图床允许的所有格式，保留体积最小的结果，需要与 --auto-compress 一起使用",
+)
+@click.option(
+    "-o",
+    "--optimize",
+    type=click.Choice([p.value for p in OptimizePolicy]),
+    help="未超出大小限制的图片也重新压缩并去除元数据，size：节省的空间不小于阈值（KB）时使用压缩后的图片，ratio：节省的比例不小于阈值时使用压缩后的图片",
+)
+@click.option(
+    "-ms",
+    "--min-saving",
+    type=click.FloatRange(min=0),
+    help="--optimize 的阈值，size 默认为 100（KB），ratio 默认为 0.1",
+)
 def upload(
     image_paths: Tuple[str],
     add_watermark: bool,
@@ -195,18 +240,35 @@ def upload(
     ignore_cache: bool,
     timeout: float,
     quiet: bool,
+    jobs: int,
+    processes: int,
+    similar: bool,
+    best_format: bool,
+    optimize: Optional[str],
+    min_saving: Optional[float],
 ):
+    policy = OptimizePolicy(optimize) if optimize else None
+    if policy == OptimizePolicy.SIZE and min_saving is not None:
+        min_saving *= 1024
+
     ib = _read_image_bed(
         add_watermark=add_watermark,
         auto_compress=auto_compress,
         ignore_cache=ignore_cache,
         timeout=timeout,
         quiet=quiet,
+        processes=processes,
+        similar=similar,
+        best_format=best_format,
+        optimize=policy,
+        min_saving=min_saving,
     )
 
-    paths = check_paths(image_paths)
+    # 下载的在线图片也放在本批次的临时目录中，上传完成后删除
+    with batch_work_dir():
+        paths = check_paths(image_paths)
 
-    ib.upload_images(*paths)
+        ib.upload_images(*paths, jobs=jobs)
 
 
 @cli.command(
@@ -223,6 +285,131 @@ def add_cache(image_path: Path, url: str):
     ib.cache.add(image_path, url, IMAGE_BEDS_NAME[ib.image_bed_code])
 
 
+@cli.group(help="管理图片链接缓存")
+@click.help_option("-h", "--help", help="显示本帮助信息")
+def cache():
+    pass
+
+
+@cache.command(
+    short_help="检查缓存的图片链接",
+    help="并发检查所有缓存的图片链接是否仍可访问，删除已失效（404、410）的记录并重建数据库。",
+)
+@click.help_option("-h", "--help", help="显示本帮助信息")
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    show_default=True,
+    default=CACHE_VERIFY_JOBS,
+    help="同时检查的链接数量",
+)
+@click.option("-t", "--timeout", type=float, help="每个请求的超时时间")
+@click.option(
+    "-n",
+    "--dry-run",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="只列出失效的链接，不删除",
+)
+@click.option(
+    "-q",
+    "--quiet",
+    is_flag=True,
+    show_default=True,
+    default=False,
+    help="静默模式。开启后不显示检查进度",
+)
+def verify(jobs: int, timeout: Optional[float], dry_run: bool, quiet: bool):
+    from up2b.up2b_lib.verify import verify_cache
+
+    result = verify_cache(Base.cache, jobs, timeout, not dry_run, quiet)
+
+    for url in result.dead:
+        echo(colorize("dead", ForegroundColor.RED), url)
+
+    for url in result.unknown:
+        echo(colorize("unknown", ForegroundColor.YELLOW), url)
+
+    echo(
+        "total: %d, alive: %d, dead: %d, unknown: %d, pruned: %d"
+        % (
+            result.total,
+            result.alive,
+            len(result.dead),
+            len(result.unknown),
+            result.pruned,
+        )
+    )
+
+
+@cache.command(help="显示缓存的记录数量、数据库大小与命中率")
+@click.help_option("-h", "--help", help="显示本帮助信息")
+def stats():
+    result = Base.cache.stats()
+
+    for image_bed, count in result.rows.items():
+        echo("%s: %d" % (image_bed, count))
+
+    echo("database size: %.2fM" % (result.size / 1024 / 1024))
+    echo(
+        "hits: %d, misses: %d, hit ratio: %.1f%%"
+        % (result.hits, result.misses, result.hit_ratio * 100)
+    )
+    echo("bytes not uploaded: %.2fM" % (result.saved_bytes / 1024 / 1024))
+
+
+@cache.command(
+    short_help="查询图片或链接的缓存",
+    help="TARGET 为图片路径时列出所有图床中此图片的链接，否则作为链接反查其摘要与图床。",
+)
+@click.help_option("-h", "--help", help="显示本帮助信息")
+@click.argument("target", type=str)
+def lookup(target: str):
+    path = Path(target)
+    if path.is_file():
+        md5 = Base.cache.image_hash(path)
+        rows = Base.cache.find_by_hash(md5)
+        if not rows:
+            logger.fatal("缓存中没有此图片", md5=md5)
+
+        for image_bed, url in rows:
+            echo("%s: %s" % (image_bed, url))
+
+        return
+
+    row = Base.cache.find_by_url(target)
+    if not row:
+        logger.fatal("缓存中没有此链接", url=target)
+
+    echo("hash: %s\nimage bed: %s\nalgorithm: %s" % row)
+
+
+@cache.command(
+    name="export",
+    short_help="导出缓存",
+    help="以 NDJSON 格式（每行一条 JSON 记录）导出所有缓存记录，OUTPUT 默认为标准输出。",
+)
+@click.help_option("-h", "--help", help="显示本帮助信息")
+@click.argument("output", type=click.File("w", encoding="utf-8"), default="-")
+def export_cache(output: IO[str]):
+    count = Base.cache.dump(output)
+    logger.info("已导出缓存", count=count)
+
+
+@cache.command(
+    name="import",
+    short_help="导入缓存",
+    help="导入 `cache export` 导出的 NDJSON 记录，与已有记录重复的记录会被跳过，INPUT 为 - 时读取标准输入。",
+)
+@click.help_option("-h", "--help", help="显示本帮助信息")
+@click.argument("input", type=click.File("r", encoding="utf-8"))
+def import_cache(input: IO[str]):
+    imported, skipped = Base.cache.load(input)
+    logger.info("已导入缓存", imported=imported, skipped=skipped)
+
+
 @cli.command(
     short_help="配置文字水印",
     help="""
@@ -284,6 +471,11 @@ def _read_image_bed(
     ignore_cache: bool = False,
     timeout: Optional[float] = None,
     quiet: bool = False,
+    processes: int = 0,
+    similar: bool = False,
+    best_format: bool = False,
+    optimize: Optional[OptimizePolicy] = None,
+    min_saving: Optional[float] = None,
 ) -> Union[SM, Imgtu, Imgtg, Github]:
     conf = read_conf()
 
@@ -302,6 +494,11 @@ def _read_image_bed(
             ignore_cache=ignore_cache,
             timeout=timeout,
             quiet=quiet,
+            processes=processes,
+            similar=similar,
+            best_format=best_format,
+            optimize=optimize,
+            min_saving=min_saving,
             conf=conf,
         )
     except ValueError:
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+from PIL import Image
+
+import hashlib
+
+from io import BytesIO
+from typing import List, Optional, Tuple
+from up2b.up2b_lib.constants import (
+    ANIMATION_MAX_FRAME_BYTES,
+    ANIMATION_MAX_FRAME_STEP,
+    ANIMATION_MIN_SCALE,
+    ANIMATION_QUALITY,
+    COMPRESS_MIN_QUALITY,
+)
+from up2b.up2b_lib.custom_types import CompressResult
+from up2b.up2b_lib.log import child_logger
+
+logger = child_logger(__name__)
+
+# 减少颜色时保留的颜色数
+REDUCED_COLORS = 64
+
+
+def unique_frames(img: Image.Image) -> List[Tuple[int, int]]:
+    """逐帧比较，将连续的相同帧合并为一帧。
+
+    :returns: 每个不重复的帧的序号与显示时长（毫秒）
+    """
+    frames: List[Tuple[int, int]] = []
+    last = None
+    for index in range(img.n_frames):
+        img.seek(index)
+        duration = int(img.info.get("duration") or 100)
+
+        digest = hashlib.md5(img.convert("RGBA").tobytes()).digest()
+        if digest == last:
+            frames[-1] = (frames[-1][0], frames[-1][1] + duration)
+        else:
+            frames.append((index, duration))
+            last = digest
+
+    return frames
+
+
+def _drop_frames(frames: List[Tuple[int, int]], step: int) -> List[Tuple[int, int]]:
+    """每 ``step`` 帧保留一帧，被删除的帧的时长加到保留的帧上。"""
+    kept: List[Tuple[int, int]] = []
+    for i, (index, duration) in enumerate(frames):
+        if i % step == 0:
+            kept.append((index, duration))
+        else:
+            kept[-1] = (kept[-1][0], kept[-1][1] + duration)
+
+    return kept
+
+
+def _max_scale(img: Image.Image, frames: int, colors: Optional[int]) -> float:
+    """所有帧占用的内存不超过 ``ANIMATION_MAX_FRAME_BYTES`` 时可用的最大比例。
+
+    减少颜色后的帧以调色板模式保存，每个像素 1 字节，否则为 RGBA 的 4 字节。
+    """
+    width, height = img.size
+    total = width * height * frames * (1 if colors else 4)
+    return min(1.0, (ANIMATION_MAX_FRAME_BYTES / total) ** 0.5)
+
+
+def encode(
+    img: Image.Image,
+    frames: List[Tuple[int, int]],
+    quality: int,
+    scale: float,
+    colors: Optional[int] = None,
+) -> BytesIO:
+    """将动图的指定帧编码为 webp 动图。
+
+    :param frames: 要保留的帧的序号与时长
+    :param scale: 相对于原图的比例
+    :param colors: 减少到的颜色数，为 None 时不减少
+    """
+    width, height = img.size
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+
+    def get_frame(n: int) -> Image.Image:
+        img.seek(frames[n][0])
+        frame = img.convert("RGBA")
+
+        if frame.size != size:
+            frame = frame.resize(size, Image.LANCZOS, reducing_gap=2.0)
+
+        if colors:
+            # 保持调色板模式，编码器写入每一帧时才转换为 RGBA
+            frame = frame.quantize(colors, Image.FASTOCTREE)
+
+        return frame
+
+    # Pillow 会将 append_images 转换为列表，所有帧同时驻留在内存中，
+    # 因此逐帧读取并缩小、减少颜色，内存中只有处理后的帧，其大小由 _max_scale 限制
+    sequence = (get_frame(n) for n in range(len(frames)))
+    first = next(sequence)
+
+    img_io = BytesIO()
+    first.save(
+        img_io,
+        "webp",
+        save_all=True,
+        append_images=sequence,
+        duration=[duration for _, duration in frames],
+        loop=img.info.get("loop", 0),
+        quality=quality,
+    )
+    return img_io
+
+
+def compress_animation(
+    img: Image.Image, max_size: int, max_attempts: int
+) -> Optional[CompressResult]:
+    """将 gif、apng、webp 动图压缩为不超过 ``max_size`` 的 webp 动图。
+
+    先合并连续的相同帧，再依次降低质量与颜色数、隔帧删除、缩小尺寸，
+    根据上一次的大小估算下一次的参数。每次编码都逐帧从原图读取。
+
+    :returns: 减少颜色、隔帧删除并缩小到 ``ANIMATION_MIN_SCALE`` 后，
+        所有帧占用的内存仍超出 ``ANIMATION_MAX_FRAME_BYTES`` 时返回 None
+    """
+    frames = unique_frames(img)
+
+    logger.debug("unique frames", total=img.n_frames, unique=len(frames))
+
+    fewest = _drop_frames(frames, ANIMATION_MAX_FRAME_STEP)
+    if _max_scale(img, len(fewest), REDUCED_COLORS) < ANIMATION_MIN_SCALE:
+        logger.debug(
+            "too many pixels to encode the animation",
+            size=img.size,
+            frames=len(fewest),
+            max_bytes=ANIMATION_MAX_FRAME_BYTES,
+        )
+        return None
+
+    attempts = 0
+    best: Optional[CompressResult] = None
+    smallest: Optional[CompressResult] = None
+
+    quality, scale, step, colors = ANIMATION_QUALITY, 1.0, 1, None
+    while attempts < max_attempts:
+        kept = _drop_frames(frames, step)
+
+        limit = _max_scale(img, len(kept), colors)
+        if limit < ANIMATION_MIN_SCALE:
+            # 以当前的帧数与颜色数编码占用的内存过多，直接减少颜色并隔帧删除
+            quality, colors = COMPRESS_MIN_QUALITY, REDUCED_COLORS
+            step = ANIMATION_MAX_FRAME_STEP
+            kept = fewest
+            limit = _max_scale(img, len(kept), colors)
+
+        scale = min(scale, limit)
+
+        attempts += 1
+        result = CompressResult(
+            encode(img, kept, quality, scale, colors), quality, scale, frames=len(kept)
+        )
+        size = result.size
+
+        logger.trace(
+            "animation encoded",
+            attempt=attempts,
+            quality=quality,
+            scale=scale,
+            frames=len(kept),
+            colors=colors,
+            size=size,
+        )
+
+        if smallest is None or size < smallest.size:
+            smallest = result
+
+        if size <= max_size:
+            best = result
+            break
+
+        ratio = max_size / size * 0.9
+        if quality > COMPRESS_MIN_QUALITY:
+            # 先降低画质，动图中的颜色通常不多，同时减少颜色数
+            quality, colors = COMPRESS_MIN_QUALITY, REDUCED_COLORS
+            continue
+
+        if ratio < 0.5 and step < ANIMATION_MAX_FRAME_STEP and len(kept) > 2:
+            # 帧间差异变大，体积不会随帧数等比例减少
+            step *= 2
+            ratio *= 1.6
+
+        if ratio < 1:
+            scale *= ratio**0.5
+
+    result = best or smallest
+    assert result is not None
+    result.attempts = attempts
+
+    if best is None:
+        logger.warning(
+            "无法在限定的编码次数内压缩到目标大小",
+            attempts=attempts,
+            size=result.size,
+            max_size=max_size,
+        )
+
+    return result
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+from up2b.up2b_lib.constants import (
+    ARTIFACTS_EVICT_RATIO,
+    ARTIFACTS_MAX_SIZE,
+    ARTIFACTS_PATH,
+)
+from up2b.up2b_lib.log import child_logger
+from up2b.up2b_lib.utils import output_path
+
+logger = child_logger(__name__)
+
+# 压缩、水印的实现改变时修改此版本号，使旧的结果失效
+ARTIFACT_VERSION = 3
+
+
+def _link(src: Path, dst: Path):
+    """创建硬链接，不在同一文件系统中时复制。"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class ArtifactStore:
+    """压缩、添加水印后的图片的缓存。
+
+    以原图的摘要和处理参数计算键，同一张图片用同样的参数处理时直接使用上次的结果，
+    更换图床上传或重试失败的批次时不必再次处理。每个结果保存在以键命名的目录中，
+    保留处理后的文件名。总大小超过 ``max_size`` 时删除最久未使用的结果。
+
+    缓存中的结果随时可能被淘汰，包括共享此目录的其他进程，因此 ``get`` 与 ``put``
+    返回的都是当前批次临时目录中的链接，上传完成前不会被删除。
+
+    :param root: 保存目录
+    :param max_size: 最大总字节数
+    """
+
+    def __init__(self, root: Path = ARTIFACTS_PATH, max_size: int = ARTIFACTS_MAX_SIZE):
+        self.root = root
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # 总字节数在内存中累计，第一次淘汰时扫描目录得到
+        self._size: Optional[int] = None
+
+    @staticmethod
+    def key(digest: str, transform: str, params: Any) -> str:
+        """
+        :param digest: 原图的摘要
+        :param transform: 处理方式，如 ``compress``
+        :param params: 影响处理结果的所有参数
+        """
+        data = json.dumps(
+            [ARTIFACT_VERSION, digest, transform, params],
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def _entry(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def get(self, key: str) -> Optional[Path]:
+        entry = self._entry(key)
+        try:
+            files = os.listdir(entry)
+        except FileNotFoundError:
+            return None
+
+        if not files:
+            return None
+
+        path = entry / files[0]
+        checkout = output_path(path.name)
+
+        try:
+            # 修改时间即最近使用时间
+            os.utime(path)
+            _link(path, checkout)
+        except FileNotFoundError:
+            # 已被淘汰
+            return None
+
+        logger.debug("artifact hit", key=key, path=path, checkout=checkout)
+
+        return checkout
+
+    def put(self, key: str, produced: Path) -> Path:
+        """保存当前批次临时目录中处理后的文件，返回的仍是 ``produced``。"""
+        entry = self._entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+
+        # 先写入临时目录再重命名，其他线程或进程不会读到不完整的文件
+        tmp = Path(tempfile.mkdtemp(dir=entry.parent, prefix=".tmp-"))
+        _link(produced, tmp / produced.name)
+        size = produced.stat().st_size
+
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # 其他线程已经保存了同样的结果
+            shutil.rmtree(tmp, ignore_errors=True)
+        else:
+            with self._lock:
+                if self._size is not None:
+                    self._size += size
+
+        self.evict()
+
+        return produced
+
+    def _entries(self) -> List[Tuple[float, int, Path]]:
+        entries: List[Tuple[float, int, Path]] = []
+        if not self.root.exists():
+            return entries
+
+        for prefix in os.scandir(self.root):
+            if not prefix.is_dir():
+                continue
+
+            for entry in os.scandir(prefix.path):
+                if entry.name.startswith(".tmp-") or not entry.is_dir():
+                    continue
+
+                for f in os.scandir(entry.path):
+                    st = f.stat()
+                    entries.append((st.st_mtime, st.st_size, Path(entry.path)))
+
+        return entries
+
+    def size(self) -> int:
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+
+            return self._size
+
+    def evict(self):
+        """总大小超过 ``max_size`` 时删除最久未使用的结果，直到不超过
+        ``max_size`` 的 ``ARTIFACTS_EVICT_RATIO``。
+
+        只有累计的总大小超出时才扫描目录，同时用扫描结果校正其他进程保存、删除的结果。
+        """
+        with self._lock:
+            if self._size is not None and self._size <= self.max_size:
+                return
+
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+
+            if total > self.max_size:
+                target = self.max_size * ARTIFACTS_EVICT_RATIO
+                for _, size, path in sorted(entries, key=lambda e: e[0]):
+                    if total <= target:
+                        break
+
+                    shutil.rmtree(path, ignore_errors=True)
+                    total -= size
+
+                    logger.debug("artifact evicted", path=path, size=size)
+
+            self._size = total
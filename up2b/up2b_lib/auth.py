@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import time
+import threading
+
+from typing import Callable, Optional
+from up2b.up2b_lib.log import child_logger
+
+logger = child_logger(__name__)
+
+# 保存在认证信息中的 token 获取时间
+TOKEN_TIME_KEY = "token_time"
+
+
+class TokenRefresher:
+    """合并并发请求的 token 刷新。
+
+    多个请求同时发现 token 过期时，只有第一个请求刷新 token，其他请求等待刷新完成后
+    直接使用新 token 重试，不会重复请求图床或重复写入配置文件。
+
+    :param max_age: token 的有效时长（秒），超过后在发送请求前主动刷新，为 None 时不主动刷新
+    :param refreshed_at: token 的获取时间，未知时从当前时间开始计算
+    """
+
+    def __init__(self, max_age: Optional[float], refreshed_at: Optional[float] = None):
+        self.max_age = max_age
+        self.refreshed_at = time.time() if refreshed_at is None else refreshed_at
+        # 每刷新一次加 1，用于判断请求使用的 token 是否已被其他线程刷新
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    def expired(self) -> bool:
+        return (
+            self.max_age is not None and time.time() - self.refreshed_at >= self.max_age
+        )
+
+    def _refresh(self, update: Callable[[], None]):
+        update()
+        self.refreshed_at = time.time()
+        self.generation += 1
+
+    def refresh(self, generation: int, update: Callable[[], None]) -> bool:
+        """刷新 token。
+
+        :param generation: 失败的请求发送时的 ``generation``
+        :param update: 获取新 token 的函数
+        :returns: 是否由本次调用刷新
+        """
+        with self._lock:
+            if generation != self.generation:
+                logger.debug("token has been refreshed by another request")
+                return False
+
+            logger.warning(
+                "`auth_token` has expired, the program will try to update `auth_token` automatically"
+            )
+            self._refresh(update)
+            return True
+
+    def refresh_if_expired(self, update: Callable[[], None]) -> bool:
+        if not self.expired():
+            return False
+
+        with self._lock:
+            # 等待锁期间其他线程可能已经刷新
+            if not self.expired():
+                return False
+
+            logger.info("token is about to expire, refreshing", max_age=self.max_age)
+            self._refresh(update)
+            return True
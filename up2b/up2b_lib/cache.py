@@ -1,55 +1,206 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
 
+import os
+import json
+import time
+import atexit
 import sqlite3
 import hashlib
-
-from up2b.up2b_lib.constants import CACHE_DATABASE, PYTHON_VERSION
-
-if PYTHON_VERSION >= (3, 9):
-    from functools import cache
-else:
-    from functools import lru_cache
-
-    cache = lru_cache(maxsize=None)
-
-from typing import Any, Optional, Tuple
+import weakref
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from up2b.up2b_lib.constants import (
+    CACHE_BUSY_TIMEOUT,
+    CACHE_COMMIT_INTERVAL,
+    CACHE_COMMIT_ROWS,
+    CACHE_DATABASE,
+    CACHE_MEMO_SIZE,
+    CACHE_MEMO_TTL,
+    CACHE_VERIFY_BATCH,
+    CACHE_WRITE_RETRIES,
+    DEFAULT_HASH_ALGORITHM,
+    HASH_ALGORITHMS,
+    HASH_BUFFER_SIZE,
+    PIPELINE_CPU_WORKERS,
+    PYTHON_VERSION,
+)
+
+from typing import (
+    TYPE_CHECKING,
+    IO,
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
 from pathlib import Path
+from up2b.up2b_lib.custom_types import CacheStats, ImageStream, ImageType
 from up2b.up2b_lib.log import child_logger
+from up2b.up2b_lib.memo import MISSING, LRUCache
+from up2b.up2b_lib.utils import hash_algorithm_in_env
 
+if TYPE_CHECKING:
+    from up2b.up2b_lib.phash import BKTree
 
 logger = child_logger(__name__)
 
 
-@cache
-def file_md5(filepath: Path) -> str:
-    h = hashlib.md5()
+# 一条语句中参数数量的上限，旧版本 sqlite 的限制为 999
+SQLITE_MAX_PARAMS = 900
+
+# 数据库结构的版本，保存在 PRAGMA user_version 中
+SCHEMA_VERSION = 2
 
+# 导出、导入的记录中的字段
+EXPORT_FIELDS = ("hash", "image_bed", "url", "algorithm", "phash")
+
+
+def file_digest(filepath: Path, algorithm: str = "md5") -> str:
+    """计算文件的摘要，使用大缓冲区读取，计算时会释放 GIL。"""
     with filepath.open("rb") as f:
+        if PYTHON_VERSION >= (3, 11):
+            return hashlib.file_digest(f, algorithm).hexdigest()
+
+        h = hashlib.new(algorithm)
+        buffer = bytearray(HASH_BUFFER_SIZE)
+        view = memoryview(buffer)
         while True:
-            data = f.read(1024)
-            if not data:
+            size = f.readinto(buffer)
+            if not size:
                 break
 
-            h.update(data)
+            h.update(view[:size])
 
-    return h.hexdigest()
+        return h.hexdigest()
 
 
-class Cache:
-    def __init__(self) -> None:
-        self.conn = sqlite3.connect(CACHE_DATABASE)
+def file_md5(filepath: Path) -> str:
+    return file_digest(filepath, "md5")
+
 
-        self.create_table()
+def stream_digest(image: ImageStream, algorithm: str = "md5") -> str:
+    """计算图片流的摘要，结果保存在图片流对象中，同一个对象只计算一次。"""
+    digest = image.digests.get(algorithm)
+    if digest is None:
+        digest = hashlib.new(algorithm, image.stream).hexdigest()
+        image.digests[algorithm] = digest
 
-    def create_table(self):
-        c = self.conn.cursor()
+    return digest
+
+
+_instances: "weakref.WeakSet[Cache]" = weakref.WeakSet()
+
+
+@atexit.register
+def flush_all():
+    """退出前提交所有缓存实例中尚未写入的记录。"""
+    for c in list(_instances):
+        c.close()
+
+
+class Cache:
+    """图片链接缓存。
+
+    - 数据库使用 WAL 模式，多个 up2b 进程可以同时读写
+    - 每个线程使用自己的连接读取，首次使用时才连接数据库
+    - 写入的记录先放入队列，由后台线程按时间或数量合并到一个事务中提交，
+      提交前的记录仍能被查询到，程序退出时提交剩余的记录
+
+    :param database: 数据库路径，默认为 ``CACHE_DATABASE``
+    :param algorithm: 计算图片摘要的算法，默认读取环境变量 UP2B_HASH_ALGORITHM
+    """
+
+    def __init__(
+        self, database: Optional[Path] = None, algorithm: Optional[str] = None
+    ) -> None:
+        self.database = database or CACHE_DATABASE
+        self.algorithm = algorithm or hash_algorithm_in_env()
+
+        # 保证查询后写入的操作不会被其他线程打断
+        self.lock = threading.RLock()
+
+        self._local = threading.local()
+        self._connections: Dict[int, sqlite3.Connection] = {}
+        self._connections_lock = threading.Lock()
+        self._initialized = False
+
+        # 等待提交的写入语句与尚未提交的记录
+        self._queue: List[
+            Tuple[str, Tuple[Any, ...], Optional[Tuple[Any, ...]], Any]
+        ] = []
+        self._pending: Dict[Tuple[Any, ...], Any] = {}
+        self._cond = threading.Condition()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_conn: Optional[sqlite3.Connection] = None
+        self._write_lock = threading.Lock()
+        # 连续提交失败的次数
+        self._failures = 0
+
+        # 内存中的查询结果。其他进程可能修改数据库，所以链接有有效期，
+        # 摘要会与文件的 stat 信息比较，不需要有效期
+        self.urls = LRUCache(CACHE_MEMO_SIZE, CACHE_MEMO_TTL)
+        self.hashes = LRUCache(CACHE_MEMO_SIZE)
+
+        # 待上传图片的感知哈希，保存缓存时一并写入。每个图床的 BK 树首次查询时从数据库加载
+        self._phashes: Dict[str, int] = {}
+        self._trees: Dict[str, "BKTree"] = {}
+        self._trees_lock = threading.Lock()
+
+        # 每个图床仍有记录的其他摘要算法，键为 None 时不限图床。首次查询时从数据库读取，
+        # 升级、导入记录后重新读取，没有旧记录后不再计算其他算法的摘要
+        self._legacy: Dict[Optional[str], List[str]] = {}
+
+        _instances.add(self)
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level 为 None 时不会隐式开启事务，写入事务由 flush 显式开启
+        conn = sqlite3.connect(
+            self.database,
+            timeout=CACHE_BUSY_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.execute("PRAGMA synchronous = NORMAL;")
+        return conn
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """当前线程的连接。"""
+        conn: Optional[sqlite3.Connection] = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+
+        conn = self._connect()
+        with self._connections_lock:
+            if not self._initialized:
+                self.create_table(conn)
+                self._initialized = True
+
+            # 关闭已退出的线程留下的连接
+            alive = {t.ident for t in threading.enumerate()}
+            for ident in [i for i in self._connections if i not in alive]:
+                self._connections.pop(ident).close()
+
+            self._connections[threading.get_ident()] = conn
+
+        self._local.conn = conn
+        return conn
+
+    def create_table(self, c: sqlite3.Connection):
         sql = """
         CREATE TABLE IF NOT EXISTS cache (
             id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
             hash CHAR(128) NOT NULL,
             image_bed TEXT NOT NULL,
-            url TEXT NOT NULL UNIQUE
+            url TEXT NOT NULL UNIQUE,
+            algorithm TEXT NOT NULL DEFAULT 'md5',
+            phash CHAR(16)
         );
         """
         c.execute(sql)
@@ -58,76 +209,413 @@ class Cache:
                 ON cache (hash, image_bed);
         """
         c.execute(sql)
-        self.commit()
 
-    @cache
+        self.migrate(c)
+
+        sql = """
+            CREATE INDEX IF NOT EXISTS idx_algorithm ON cache (algorithm);
+        """
+        c.execute(sql)
+
+        # 文件的 stat 信息与摘要，文件未修改时不必重新读取计算
+        sql = """
+        CREATE TABLE IF NOT EXISTS file_hash (
+            path TEXT NOT NULL,
+            algorithm TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            hash CHAR(128) NOT NULL,
+            PRIMARY KEY (path, algorithm)
+        );
+        """
+        c.execute(sql)
+
+        # 累计的查询次数等统计数据
+        sql = """
+        CREATE TABLE IF NOT EXISTS stats (
+            name TEXT PRIMARY KEY NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0
+        );
+        """
+        c.execute(sql)
+
+    def migrate(self, c: sqlite3.Connection):
+        # 多个进程可能同时启动，在写事务中重新读取版本号
+        c.execute("BEGIN IMMEDIATE;")
+        try:
+            version = c.execute("PRAGMA user_version;").fetchone()[0]
+            if version < SCHEMA_VERSION:
+                self._migrate(c, version)
+        except BaseException:
+            c.execute("ROLLBACK;")
+            raise
+
+        c.execute("COMMIT;")
+
+    def _migrate(self, c: sqlite3.Connection, version: int):
+        if version < 1:
+            columns = [row[1] for row in c.execute("PRAGMA table_info(cache);")]
+            if "algorithm" not in columns:
+                # 旧版本只使用 md5
+                c.execute(
+                    "ALTER TABLE cache ADD COLUMN algorithm TEXT NOT NULL DEFAULT 'md5';"
+                )
+
+            # file_hash 中只有可以重新计算的摘要，直接按新结构重建
+            c.execute("DROP TABLE IF EXISTS file_hash;")
+
+        if version < 2:
+            columns = [row[1] for row in c.execute("PRAGMA table_info(cache);")]
+            if "phash" not in columns:
+                # 旧记录没有感知哈希，不参与相似图片查询
+                c.execute("ALTER TABLE cache ADD COLUMN phash CHAR(16);")
+
+        c.execute("PRAGMA user_version = %d;" % SCHEMA_VERSION)
+
+        logger.debug("cache database migrated", old=version, new=SCHEMA_VERSION)
+
+    def file_hash(self, filepath: Path, algorithm: Optional[str] = None) -> str:
+        """计算文件的摘要。
+
+        以文件的绝对路径、大小、修改时间和 inode 为键保存在数据库中，文件未修改时只需
+        ``stat()`` 一次，不会重新读取整个文件。
+        """
+        algorithm = algorithm or self.algorithm
+        path = str(filepath.absolute())
+        st = filepath.stat()
+
+        key = ("file_hash", path, algorithm)
+        row = self.hashes.get(key)
+        if row is MISSING:
+            row = self._pending.get(key) or self.fetchone(
+                """
+                SELECT size, mtime_ns, inode, hash FROM file_hash
+                WHERE path = ? AND algorithm = ?;
+                """,
+                path,
+                algorithm,
+            )
+
+        if row and tuple(row[:3]) == (st.st_size, st.st_mtime_ns, st.st_ino):
+            self.hashes.put(key, tuple(row))
+            return row[3]
+
+        digest = file_digest(filepath, algorithm)
+
+        row = (st.st_size, st.st_mtime_ns, st.st_ino, digest)
+        self.hashes.put(key, row)
+        self.write(
+            """
+            INSERT OR REPLACE INTO file_hash
+                (path, algorithm, size, mtime_ns, inode, hash)
+                VALUES (?, ?, ?, ?, ?, ?);
+            """,
+            (path, algorithm) + row,
+            key,
+            row,
+        )
+
+        return digest
+
+    def image_hash(self, image: ImageType, algorithm: Optional[str] = None) -> str:
+        """计算图片文件或图片流的摘要。"""
+        if isinstance(image, ImageStream):
+            return stream_digest(image, algorithm or self.algorithm)
+
+        return self.file_hash(image, algorithm)
+
+    def file_hashes(
+        self, paths: Sequence[ImageType], workers: int = PIPELINE_CPU_WORKERS
+    ) -> List[str]:
+        """在多个线程中计算一批图片的摘要，按输入顺序返回。"""
+        if len(paths) <= 1:
+            return [self.image_hash(p) for p in paths]
+
+        with ThreadPoolExecutor(min(workers, len(paths))) as executor:
+            return list(executor.map(self.image_hash, paths))
+
+    def _legacy_algorithms(self, image_bed: Optional[str]) -> List[str]:
+        algorithms = self._legacy.get(image_bed)
+        if algorithms is None:
+            algorithms = []
+            for algorithm in HASH_ALGORITHMS:
+                if algorithm == self.algorithm:
+                    continue
+
+                if image_bed:
+                    found = self.fetchone(
+                        """
+                        SELECT 1 FROM cache
+                        WHERE algorithm = ? AND image_bed = ? LIMIT 1;
+                        """,
+                        algorithm,
+                        image_bed,
+                    )
+                else:
+                    found = self.fetchone(
+                        "SELECT 1 FROM cache WHERE algorithm = ? LIMIT 1;", algorithm
+                    )
+
+                if found:
+                    algorithms.append(algorithm)
+
+            self._legacy[image_bed] = algorithms
+
+        return algorithms
+
+    def _find_legacy(
+        self, filepath: ImageType, image_bed: Optional[str]
+    ) -> Optional[str]:
+        """用其他算法的摘要查询缓存，查询到时将缓存记录升级为当前算法的摘要。
+
+        只在此图床还有其他算法的记录时计算其他算法的摘要。
+        """
+        for algorithm in self._legacy_algorithms(image_bed):
+            legacy = self.image_hash(filepath, algorithm)
+            url = self.is_exists(legacy, image_bed)
+            if not url:
+                continue
+
+            digest = self.image_hash(filepath)
+            self.execute(
+                "UPDATE OR IGNORE cache SET hash = ?, algorithm = ? WHERE hash = ?;",
+                digest,
+                self.algorithm,
+                legacy,
+            )
+            # 当前算法的摘要已有记录时旧记录不会被升级，删除后旧记录才能全部消失
+            self.execute(
+                "DELETE FROM cache WHERE hash = ? AND algorithm = ?;", legacy, algorithm
+            )
+            self._legacy.clear()
+            self.urls.clear()
+            with self._trees_lock:
+                self._trees.clear()
+
+            logger.debug(
+                "cache record upgraded", old=algorithm, new=self.algorithm, url=url
+            )
+
+            return url
+
+        return None
+
+    def _pending_url(self, md5: str, image_bed: Optional[str]) -> Optional[str]:
+        if image_bed:
+            return self._pending.get(("cache", md5, image_bed))
+
+        for key, url in list(self._pending.items()):
+            if key[0] == "cache" and key[1] == md5:
+                return url
+
+        return None
+
+    def _remember(self, md5: str, image_bed: str, url: str):
+        self.urls.put((md5, image_bed), url)
+        # 不限图床的查询结果可能是之前缓存的 None
+        self.urls.invalidate((md5, None))
+
     def is_exists(self, md5: str, image_bed: Optional[str] = None) -> Optional[str]:
+        url = self.urls.get((md5, image_bed))
+        if url is MISSING:
+            url = self._is_exists(md5, image_bed)
+            self.urls.put((md5, image_bed), url)
+
+        return url
+
+    def _is_exists(self, md5: str, image_bed: Optional[str]) -> Optional[str]:
+        url = self._pending_url(md5, image_bed)
+        if url:
+            return url
+
         if image_bed:
             sql = """
                 SELECT url FROM cache
                 WHERE hash = ? AND image_bed = ?;
             """
 
-            c = self.execute(sql, md5, image_bed)
+            result = self.fetchone(sql, md5, image_bed)
         else:
             sql = """
                 SELECT url FROM cache WHERE hash = ?;
             """
 
-            c = self.execute(sql, md5)
+            result = self.fetchone(sql, md5)
 
-        result = c.fetchone()
         if not result:
             return None
 
         return result[0]
 
-    @cache
+    def lookup_many(
+        self, digests: Sequence[str], image_bed: Optional[str] = None
+    ) -> Dict[str, str]:
+        """一次查询多个摘要对应的图片链接。
+
+        :param digests: 图片摘要
+        :param image_bed: 图床名，为 None 时查询所有图床
+        :returns: 已缓存的摘要与图片链接
+        """
+        unique = list(dict.fromkeys(digests))
+        result: Dict[str, str] = {}
+
+        # 每条语句的参数数量不能超过 sqlite 的限制
+        for start in range(0, len(unique), SQLITE_MAX_PARAMS):
+            chunk = unique[start : start + SQLITE_MAX_PARAMS]
+            sql = "SELECT hash, url FROM cache WHERE hash IN (%s)" % ", ".join(
+                "?" * len(chunk)
+            )
+            params: List[str] = list(chunk)
+            if image_bed:
+                sql += " AND image_bed = ?"
+                params.append(image_bed)
+
+            for digest, url in self.fetchall(sql + ";", *params):
+                result.setdefault(digest, url)
+
+        # 尚未提交的记录
+        if self._pending:
+            wanted = set(unique)
+            for key, url in list(self._pending.items()):
+                if key[0] != "cache" or key[1] not in wanted:
+                    continue
+
+                if image_bed is None or key[2] == image_bed:
+                    result.setdefault(key[1], url)
+
+        return result
+
+    def check_cache_of_images(
+        self, filepaths: Sequence[ImageType], image_bed: str
+    ) -> List[Tuple[str, str, bool]]:
+        """批量精准查询指定图床中是否缓存过图片，结果与 ``check_cache_of_image_bed`` 相同。
+
+        在多个线程中计算摘要，再用一条语句查询所有摘要。
+        """
+        digests = self.file_hashes(filepaths)
+        found = self.lookup_many(digests, image_bed)
+
+        result: List[Tuple[str, str, bool]] = []
+        for filepath, digest in zip(filepaths, digests):
+            url = found.get(digest) or self._find_legacy(filepath, image_bed)
+            result.append((url, digest, True) if url else ("", digest, False))
+
+        return result
+
     def check_cache_of_image_bed(
-        self, filepath: Path, image_bed: str
+        self, filepath: ImageType, image_bed: str
     ) -> Tuple[str, str, bool]:
         """精准查询指定图床中是否缓存过图片
 
-        :param filepath: 图片真实路径或缓存路径
-        :type filepath: Path
+        :param filepath: 图片真实路径、缓存路径或图片流
+        :type filepath: ImageType
         :param image_bed: 图床名
         :type image_bed: str
         :returns: 缓存的图片链接或文件 md5
         :rtype: Tuple[str,str, bool]
         """
 
-        md5 = file_md5(filepath)
+        md5 = self.image_hash(filepath)
 
         logger.debug("the md5 of the file is calculated", file=filepath, md5=md5)
 
-        url = self.is_exists(md5, image_bed)
+        url = self.is_exists(md5, image_bed) or self._find_legacy(filepath, image_bed)
         if url:
             return (url, md5, True)
 
         return ("", md5, False)
 
-    @cache
-    def chech_cache(self, filepath: Path) -> Tuple[str, str, bool]:
+    def chech_cache(self, filepath: ImageType) -> Tuple[str, str, bool]:
         """模糊查询图片缓存。
 
         不论任何在图床中上传过图片，只要查询到即返回已上传的图片链接。
-        :param filepath: 图片真实路径或缓存路径
-        :type filepath: Path
+        :param filepath: 图片真实路径、缓存路径或图片流
+        :type filepath: ImageType
         :returns: 缓存的图片链接或文件 md5
         :rtype: Tuple[str, str, bool]
         """
 
-        md5 = file_md5(filepath)
+        md5 = self.image_hash(filepath)
 
         logger.debug("the md5 of the file is calculated", file=filepath, md5=md5)
 
-        url = self.is_exists(md5)
+        url = self.is_exists(md5) or self._find_legacy(filepath, None)
         if url:
             return (url, md5, True)
 
         return ("", md5, False)
 
+    def _tree(self, image_bed: str) -> "BKTree":
+        with self._trees_lock:
+            tree = self._trees.get(image_bed)
+            if tree is not None:
+                return tree
+
+            from up2b.up2b_lib.phash import BKTree
+
+            tree = BKTree()
+            for md5, phash in self.fetchall(
+                "SELECT hash, phash FROM cache WHERE image_bed = ? AND phash IS NOT NULL;",
+                image_bed,
+            ):
+                tree.add(int(phash, 16), md5)
+
+            # 尚未提交的记录
+            for key, value in list(self._pending.items()):
+                if key[0] == "phash" and key[1] == image_bed:
+                    tree.add(value[1], value[0])
+
+            logger.debug("phash index loaded", image_bed=image_bed, size=len(tree))
+
+            self._trees[image_bed] = tree
+            return tree
+
+    def remember_phash(self, md5: str, phash: int):
+        """记录待上传图片的感知哈希，上传成功后由 ``save`` 写入数据库。"""
+        with self.lock:
+            self._phashes[md5] = phash
+
+    def find_similar(
+        self, phash: int, image_bed: str, max_distance: int
+    ) -> Optional[str]:
+        """查询指定图床中与感知哈希最接近的已上传图片。
+
+        :param phash: 图片的感知哈希
+        :param image_bed: 图床名
+        :param max_distance: 允许的最大汉明距离
+        :returns: 距离不超过 ``max_distance`` 的图片中最接近的一张的链接
+        """
+        for distance, md5 in self._tree(image_bed).search(phash, max_distance):
+            url = self.is_exists(md5, image_bed)
+            if url:
+                logger.debug("similar image found", distance=distance, url=url)
+                return url
+
+        return None
+
+    def _save_phash(self, md5: str, image_bed: str):
+        phash = self._phashes.pop(md5, None)
+        if phash is None:
+            return
+
+        self.write(
+            "UPDATE cache SET phash = ? WHERE hash = ? AND image_bed = ?;",
+            ("%016x" % phash, md5, image_bed),
+            ("phash", image_bed, md5),
+            (md5, phash),
+        )
+
+        with self._trees_lock:
+            tree = self._trees.get(image_bed)
+            if tree is not None:
+                tree.add(phash, md5)
+
     def save(self, md5: str, image_bed: str, url: str, force: bool = False):
+        with self.lock:
+            return self._save(md5, image_bed, url, force)
+
+    def _save(self, md5: str, image_bed: str, url: str, force: bool):
         exists = self.is_exists(md5, image_bed)
 
         if exists:
@@ -136,44 +624,395 @@ class Cache:
                     UPDATE cache SET url = ? WHERE hash = ? AND image_bed = ?;
                 """
 
-                return self.execute(sql, url, md5, image_bed)
+                self.write(sql, (url, md5, image_bed), ("cache", md5, image_bed), url)
+                self._remember(md5, image_bed, url)
+                self._save_phash(md5, image_bed)
+                return
 
             logger.warning("图片已存在且未开启强制更新，图片链接不会保存")
+            self._save_phash(md5, image_bed)
         else:
             sql = """
-                INSERT INTO cache (url, hash, image_bed) VALUES (?, ?, ?);
+                INSERT INTO cache (url, hash, image_bed, algorithm)
+                    VALUES (?, ?, ?, ?);
             """
 
-            self.execute(sql, url, md5, image_bed)
+            self.write(
+                sql,
+                (url, md5, image_bed, self.algorithm),
+                ("cache", md5, image_bed),
+                url,
+            )
+            self._remember(md5, image_bed, url)
+            self._save_phash(md5, image_bed)
 
             logger.info("cached", md5=md5, url=url)
 
             return
 
     def add(self, image_path: Path, url: str, image_bed: str):
-        md5 = file_md5(image_path)
+        md5 = self.file_hash(image_path)
         exists = self.is_exists(md5, image_bed)
         if exists:
             logger.warning("缓存中已有此图片，无需重复添加")
             return
 
         sql = """
-            INSERT INTO cache (url, hash, image_bed) VALUES (?, ?, ?);
+            INSERT INTO cache (url, hash, image_bed, algorithm) VALUES (?, ?, ?, ?);
         """
-        self.execute(sql, url, md5, image_bed)
+        self.write(
+            sql,
+            (url, md5, image_bed, self.algorithm),
+            ("cache", md5, image_bed),
+            url,
+        )
+        self._remember(md5, image_bed, url)
 
         logger.info("已手动添加缓存", image=image_path, url=url, image_bed=image_bed)
 
-    def execute(self, sql: str, *params: Any):
-        c = self.conn.cursor()
-        return c.execute(sql, params)
+    def count(self) -> int:
+        self.flush()
+        return self.fetchone("SELECT COUNT(*) FROM cache;")[0]  # type: ignore
+
+    def _iter_rows(
+        self, columns: Sequence[str], batch: int
+    ) -> Iterator[List[Tuple[Any, ...]]]:
+        self.flush()
+
+        sql = "SELECT id, %s FROM cache WHERE id > ? ORDER BY id LIMIT ?;" % ", ".join(
+            columns
+        )
+
+        last = 0
+        while True:
+            rows = self.fetchall(sql, last, batch)
+            if not rows:
+                return
+
+            yield rows
+            last = rows[-1][0]
+
+    def iter_urls(self, batch: int = 1000) -> Iterator[List[Tuple[int, str]]]:
+        """按 id 顺序分批读取所有记录的 id 与图片链接。"""
+        return self._iter_rows(("url",), batch)  # type: ignore
+
+    def find_by_hash(self, md5: str) -> List[Tuple[str, str]]:
+        """查询所有图床中摘要对应的图床名与图片链接。"""
+        self.flush()
+        return self.fetchall(
+            "SELECT image_bed, url FROM cache WHERE hash = ? ORDER BY id;", md5
+        )  # type: ignore
+
+    def find_by_url(self, url: str) -> Optional[Tuple[str, str, str]]:
+        """根据图片链接反查摘要、图床名与摘要算法。"""
+        self.flush()
+        # url 列有 UNIQUE 约束，sqlite 已为其自动创建索引
+        return self.fetchone(
+            "SELECT hash, image_bed, algorithm FROM cache WHERE url = ?;", url
+        )  # type: ignore
+
+    def record_stats(self, **counters: int):
+        """累加统计数据，如 ``record_stats(hits=1, saved_bytes=1024)``。"""
+        for name, value in counters.items():
+            if not value:
+                continue
+
+            self.write(
+                "INSERT OR IGNORE INTO stats (name, value) VALUES (?, 0);", (name,)
+            )
+            self.write(
+                "UPDATE stats SET value = value + ? WHERE name = ?;", (value, name)
+            )
+
+    def stats(self) -> CacheStats:
+        self.flush()
+
+        rows = dict(
+            self.fetchall(
+                "SELECT image_bed, COUNT(*) FROM cache GROUP BY image_bed ORDER BY image_bed;"
+            )
+        )
+        counters = dict(self.fetchall("SELECT name, value FROM stats;"))
+
+        size = 0
+        for suffix in ("", "-wal"):
+            try:
+                size += os.path.getsize(str(self.database) + suffix)
+            except OSError:
+                pass
+
+        return CacheStats(
+            rows,
+            size,
+            counters.get("hits", 0),
+            counters.get("misses", 0),
+            counters.get("saved_bytes", 0),
+        )
+
+    def dump(self, fp: IO[str]) -> int:
+        """以 NDJSON 格式逐行导出所有记录，返回导出的记录数。"""
+        count = 0
+        for rows in self._iter_rows(EXPORT_FIELDS, CACHE_VERIFY_BATCH):
+            for row in rows:
+                fp.write(
+                    json.dumps(dict(zip(EXPORT_FIELDS, row[1:])), ensure_ascii=False)
+                )
+                fp.write("\n")
+
+            count += len(rows)
+
+        return count
+
+    def load(self, fp: IO[str]) -> Tuple[int, int]:
+        """逐行导入 ``dump`` 导出的记录。
+
+        与已有记录的摘要或链接重复的记录不会导入。
+
+        :returns: 导入的记录数与跳过的记录数
+        """
+        self.flush()
+
+        sql = "INSERT OR IGNORE INTO cache (%s) VALUES (%s);" % (
+            ", ".join(EXPORT_FIELDS),
+            ", ".join("?" * len(EXPORT_FIELDS)),
+        )
+
+        total = imported = 0
+        batch: List[Tuple[Any, ...]] = []
+
+        def insert():
+            nonlocal imported
+
+            conn = self.conn
+            changes = conn.total_changes
+            conn.execute("BEGIN IMMEDIATE;")
+            try:
+                conn.executemany(sql, batch)
+            except BaseException:
+                conn.execute("ROLLBACK;")
+                raise
+
+            conn.execute("COMMIT;")
+            imported += conn.total_changes - changes
+            batch.clear()
+
+        with self.lock:
+            for lineno, line in enumerate(fp, 1):
+                if not line.strip():
+                    continue
+
+                total += 1
+                try:
+                    record = json.loads(line)
+                    row = (
+                        str(record["hash"]),
+                        str(record["image_bed"]),
+                        str(record["url"]),
+                        record.get("algorithm") or DEFAULT_HASH_ALGORITHM,
+                        record.get("phash"),
+                    )
+                except (ValueError, TypeError, KeyError) as e:
+                    logger.warning("无效的缓存记录，已跳过", line=lineno, error=e)
+                    continue
+
+                if row[3] not in HASH_ALGORITHMS:
+                    logger.warning(
+                        "未知的摘要算法，已跳过", line=lineno, algorithm=row[3]
+                    )
+                    continue
+
+                batch.append(row)
+                if len(batch) >= CACHE_VERIFY_BATCH:
+                    insert()
+
+            if batch:
+                insert()
+
+            # 导入的记录可能使用其他算法
+            self._legacy.clear()
+            self.urls.clear()
+            with self._trees_lock:
+                self._trees.clear()
+
+        logger.debug("cache records loaded", total=total, imported=imported)
+
+        return imported, total - imported
+
+    def delete(self, ids: Sequence[int]) -> int:
+        """在一个事务中删除指定 id 的记录，返回删除的记录数。"""
+        self.flush()
+
+        deleted = 0
+        with self.lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE;")
+            try:
+                for start in range(0, len(ids), SQLITE_MAX_PARAMS):
+                    chunk = ids[start : start + SQLITE_MAX_PARAMS]
+                    cursor = conn.execute(
+                        "DELETE FROM cache WHERE id IN (%s);"
+                        % ", ".join("?" * len(chunk)),
+                        chunk,
+                    )
+                    deleted += cursor.rowcount
+            except BaseException:
+                conn.execute("ROLLBACK;")
+                raise
+
+            conn.execute("COMMIT;")
+
+            self.urls.clear()
+            with self._trees_lock:
+                self._trees.clear()
+
+        logger.debug("cache records deleted", count=deleted)
+
+        return deleted
+
+    def vacuum(self):
+        """重建数据库文件，释放删除记录后的空闲空间。"""
+        self.flush()
+        self.execute("VACUUM;")
+
+    def execute(self, sql: str, *params: Any) -> sqlite3.Cursor:
+        """在当前线程的连接中执行语句，写入语句会立即提交。"""
+        return self.conn.execute(sql, params)
+
+    def fetchone(self, sql: str, *params: Any) -> Optional[Tuple[Any, ...]]:
+        return self.execute(sql, *params).fetchone()
+
+    def fetchall(self, sql: str, *params: Any) -> List[Tuple[Any, ...]]:
+        return self.execute(sql, *params).fetchall()
+
+    def write(
+        self,
+        sql: str,
+        params: Tuple[Any, ...],
+        key: Optional[Tuple[Any, ...]] = None,
+        value: Any = None,
+    ):
+        """将写入语句放入队列，由后台线程提交。
+
+        :param key: 写入的记录的键，提交前查询时通过此键读取 ``value``
+        """
+        with self._cond:
+            self._queue.append((sql, params, key, value))
+            if key is not None:
+                self._pending[key] = value
+
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_loop, name="up2b-cache-writer", daemon=True
+                )
+                self._writer.start()
+
+            self._cond.notify()
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+
+                # 等待更多的写入，合并到同一个事务中提交
+                deadline = time.monotonic() + CACHE_COMMIT_INTERVAL
+                while len(self._queue) < CACHE_COMMIT_ROWS:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+
+                    self._cond.wait(remaining)
+
+            if not self.flush():
+                # 数据库被其他进程长时间锁定，等待一段时间后再重试
+                time.sleep(CACHE_COMMIT_INTERVAL * self._failures)
+
+    def flush(self, drop_on_error: bool = False) -> bool:
+        """立即提交队列中的所有写入。
+
+        提交失败时（如其他进程锁定数据库超过 ``CACHE_BUSY_TIMEOUT``）记录放回队列，
+        提交前仍能被查询到，下次提交时重试。连续失败 ``CACHE_WRITE_RETRIES`` 次
+        或 ``drop_on_error`` 为 True 时才丢弃。
+
+        :returns: 是否已提交
+        """
+        with self._write_lock:
+            with self._cond:
+                batch, self._queue = self._queue, []
+
+            if not batch:
+                return True
+
+            conn = None
+            try:
+                if self._writer_conn is None:
+                    # 确保数据表已创建
+                    self.conn
+                    self._writer_conn = self._connect()
+
+                conn = self._writer_conn
+                conn.execute("BEGIN IMMEDIATE;")
+                for sql, params, _, _ in batch:
+                    try:
+                        conn.execute(sql, params)
+                    except sqlite3.IntegrityError as e:
+                        logger.warning("缓存记录冲突，已跳过", error=e)
+                conn.execute("COMMIT;")
+
+                logger.trace("cache committed", rows=len(batch))
+            except sqlite3.Error as e:
+                if conn is not None and conn.in_transaction:
+                    conn.execute("ROLLBACK;")
+
+                self._failures += 1
+                if not drop_on_error and self._failures < CACHE_WRITE_RETRIES:
+                    logger.warning(
+                        "写入缓存失败，稍后重试",
+                        error=e,
+                        rows=len(batch),
+                        failures=self._failures,
+                    )
+
+                    # 放回队列头部，保持写入的顺序
+                    with self._cond:
+                        self._queue[:0] = batch
+                    return False
+
+                logger.error(
+                    "写入缓存失败，已丢弃",
+                    error=e,
+                    rows=len(batch),
+                    failures=self._failures,
+                )
+
+            self._failures = 0
+
+            with self._cond:
+                for _, _, key, value in batch:
+                    if key is not None and self._pending.get(key) == value:
+                        del self._pending[key]
+
+            return True
 
     def commit(self):
-        self.conn.commit()
+        self.flush()
 
-    def close(self):
-        self.conn.close()
+    def memo_stats(self) -> Dict[str, Dict[str, int]]:
+        """内存缓存的大小与命中次数。"""
+        return {"urls": self.urls.stats(), "hashes": self.hashes.stats()}
 
-    def __del__(self):
-        self.commit()
-        self.close()
+    def close(self):
+        """提交剩余的写入并关闭所有连接，之后再次使用时会重新连接。"""
+        # 关闭后无法再重试，提交失败的记录只能丢弃
+        self.flush(drop_on_error=True)
+
+        with self._connections_lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+            self._local = threading.local()
+
+        with self._write_lock:
+            if self._writer_conn is not None:
+                self._writer_conn.close()
+                self._writer_conn = None
@@ -2,75 +2,413 @@
 # -*- coding:utf-8 -*-
 
 try:
-    from PIL import Image
+    from PIL import Image, ImageOps
 except ModuleNotFoundError:
     raise Exception(
         "you have enabled the automatic image compression feature, but [ pillow ] is not installed, please execute `pip install pillow` before enabling this feature"
     )
 
 import os
+import math
 
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from io import BytesIO
 from pathlib import Path
-from up2b.up2b_lib.custom_types import ImageType, CompressedFormat
-from up2b.up2b_lib.constants import CACHE_PATH
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from up2b.up2b_lib.animation import compress_animation
+from up2b.up2b_lib.custom_types import (
+    CompressResult,
+    ImageType,
+    CompressedFormat,
+    OptimizePolicy,
+)
+from up2b.up2b_lib.constants import (
+    COMPRESS_MAX_ATTEMPTS,
+    COMPRESS_MAX_QUALITY,
+    COMPRESS_MIN_QUALITY,
+    OPTIMIZE_MIN_SAVING_RATIO,
+    OPTIMIZE_MIN_SAVING_SIZE,
+)
 from up2b.up2b_lib.log import child_logger
+from up2b.up2b_lib.utils import output_path
 
 logger = child_logger(__name__)
 
+# exif 中的方向标签
+EXIF_ORIENTATION = 0x0112
+
+
+@dataclass(frozen=True)
+class Encoder:
+    format: CompressedFormat
+    # 有损编码时搜索质量，无损编码时只能缩小尺寸
+    lossy: bool
+    # 编码前减少到的颜色数
+    colors: Optional[int] = None
+    options: Dict[str, Any] = field(default_factory=dict)
+
+
+ENCODERS: Dict[str, Encoder] = {
+    "webp": Encoder(CompressedFormat.WEBP, True),
+    "webp-lossless": Encoder(CompressedFormat.WEBP, False, options={"lossless": True}),
+    "jpeg": Encoder(CompressedFormat.JPEG, True),
+    "jpeg-progressive": Encoder(
+        CompressedFormat.JPEG, True, options={"optimize": True, "progressive": True}
+    ),
+    "png": Encoder(CompressedFormat.PNG, False, options={"optimize": True}),
+    "png-palette": Encoder(
+        CompressedFormat.PNG, False, colors=256, options={"optimize": True}
+    ),
+}
+
+# 选择最佳格式时每种格式尝试的编码方式
+CANDIDATES: Dict[CompressedFormat, Tuple[str, ...]] = {
+    CompressedFormat.WEBP: ("webp", "webp-lossless"),
+    CompressedFormat.JPEG: ("jpeg-progressive",),
+    CompressedFormat.PNG: ("png-palette", "png"),
+}
+
 
 class Compressor:
-    def __init__(self, max_size: int, format: CompressedFormat) -> None:
+    """将图片压缩到 ``max_size`` 以内。
+
+    只解码一次原图，之后每次都从内存中的原图编码：先在原尺寸下二分搜索编码质量，
+    最低质量仍超出大小时再缩小尺寸。编码次数不超过 ``max_attempts``，画质损失不会累积。
+
+    :param max_size: 压缩后的最大字节数
+    :param format: 压缩后的格式
+    :param max_attempts: 每种编码方式最多编码的次数
+    :param formats: 图床允许的格式，不为空时同时尝试这些格式的所有编码方式，
+        选择尺寸最大、体积最小的结果，而不是只使用 ``format``
+    :param animation: 是否将动图压缩为 webp 动图，图床不允许 webp 时为 False，动图保持原样
+    :param optimize: 不为 None 时未超出 ``max_size`` 的图片也会重新压缩，
+        节省的字节数或比例不小于 ``min_saving`` 时才使用压缩后的图片
+    :param min_saving: 节省的字节数或比例的阈值，为 None 时使用默认值
+
+    压缩后的图片不保留 exif、xmp 等元数据，只保留颜色配置文件。
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        format: CompressedFormat,
+        max_attempts: int = COMPRESS_MAX_ATTEMPTS,
+        formats: Sequence[CompressedFormat] = (),
+        animation: bool = True,
+        optimize: Optional[OptimizePolicy] = None,
+        min_saving: Optional[float] = None,
+    ) -> None:
         self.max_size = max_size
         self.format = format
+        self.max_attempts = max(2, max_attempts)
+        self.formats = tuple(formats)
+        self.animation = animation
+        self.optimize = optimize
+
+        if min_saving is None:
+            min_saving = (
+                OPTIMIZE_MIN_SAVING_RATIO
+                if optimize == OptimizePolicy.RATIO
+                else OPTIMIZE_MIN_SAVING_SIZE
+            )
+        self.min_saving = min_saving
+
+    @property
+    def encoders(self) -> List[str]:
+        if not self.formats:
+            return [self.format.value]
+
+        return [name for f in self.formats for name in CANDIDATES[f]]
+
+    def plan_scale(self, raw_size: int) -> float:
+        """估算解码时可以缩小到的比例。
 
-    def compress_to_bytes(self, img: Image.Image, scale: float) -> BytesIO:
-        format = img.format
+        假设压缩后每像素的字节数与原图相同，再将边长放大两倍作为余量，
+        即使压缩后每像素的字节数只有原图的 1/4，也不需要比解码结果更大的图片。
+        """
+        return min(1.0, 2 * (self.max_size / raw_size) ** 0.5)
+
+    def _decode(self, img: Image.Image, scale: float) -> Image.Image:
+        """以不小于 ``scale`` 的比例解码图片。"""
         width, height = img.size
+        target = (max(1, math.ceil(width * scale)), max(1, math.ceil(height * scale)))
+
+        if scale < 1 and img.format == "JPEG":
+            # 解码时直接按 DCT 缩放为 1/2、1/4 或 1/8，不会生成原尺寸的图片
+            img.draft(None, target)
+
+        img.load()
+
+        # 无法在解码时缩小的格式，先按整数倍快速缩小
+        factor = min(img.width // target[0], img.height // target[1])
+        if factor >= 2:
+            img = img.reduce(factor)
+
+        if img.size != (width, height):
+            logger.debug(
+                "image decoded at reduced size", original=(width, height), size=img.size
+            )
+
+        return img
+
+    @staticmethod
+    def _prepare(img: Image.Image, format: CompressedFormat) -> Image.Image:
+        if format == CompressedFormat.JPEG:
+            return img if img.mode == "RGB" else img.convert("RGB")
+
+        if img.mode in ("RGB", "RGBA"):
+            return img
+
+        has_alpha = img.mode in ("LA", "PA") or "transparency" in img.info
+        return img.convert("RGBA" if has_alpha else "RGB")
+
+    @staticmethod
+    def _encode(
+        img: Image.Image,
+        encoder: Encoder,
+        quality: int,
+        scale: float,
+        size: Tuple[int, int],
+    ) -> BytesIO:
+        """
+        :param scale: 相对于原图的比例
+        :param size: 原图的尺寸
+        """
+        target = (max(1, int(size[0] * scale)), max(1, int(size[1] * scale)))
+        if target != img.size:
+            img = img.resize(target, Image.LANCZOS, reducing_gap=2.0)
+
+        if encoder.colors:
+            img = img.quantize(
+                encoder.colors,
+                Image.FASTOCTREE if img.mode == "RGBA" else Image.MEDIANCUT,
+            )
+
         img_io = BytesIO()
+        # 不传入 exif、xmp，只保留颜色配置文件
+        img.save(
+            img_io,
+            encoder.format.value,
+            quality=quality,
+            icc_profile=img.info.get("icc_profile"),
+            **encoder.options,
+        )
+        return img_io
+
+    def _search(
+        self, img: Image.Image, original: Tuple[int, int], name: str
+    ) -> CompressResult:
+        """用一种编码方式搜索不超过 ``max_size`` 的最高质量与最大尺寸。"""
+        encoder = ENCODERS[name]
+        img = self._prepare(img, encoder.format)
 
-        if format == self.format.value.upper():  # 如果已压缩为 webp 体积仍然很大，对图片进行缩放
-            img = img.resize((int(width * scale), int(height * scale)), Image.LANCZOS)
+        # 解码后的图片相对于原图的比例，是可以搜索的最大比例
+        top = img.width / original[0]
 
-        # TODO: 所有图片都压缩为 webp，动图的压缩可能会报错或被压缩为静态图。
-        img.save(img_io, self.format.value)
+        attempts = 0
+        best: Optional[CompressResult] = None
+        smallest: Optional[CompressResult] = None
 
-        new_size = img_io.tell()
+        def encode(quality: int, scale: float) -> int:
+            nonlocal attempts, best, smallest
 
-        if new_size <= self.max_size:
-            return img_io
+            attempts += 1
+            result = CompressResult(
+                self._encode(img, encoder, quality, scale, original),
+                quality,
+                scale,
+                format=encoder.format,
+                encoder=name,
+            )
+            size = result.size
 
-        scale = self.max_size / new_size
-        return self.compress_to_bytes(Image.open(img_io), scale)
+            logger.trace(
+                "encoded",
+                encoder=name,
+                attempt=attempts,
+                quality=quality,
+                scale=scale,
+                size=size,
+            )
+
+            if size <= self.max_size and (
+                best is None or (scale, quality) > (best.scale, best.quality)
+            ):
+                best = result
+
+            if smallest is None or size < smallest.size:
+                smallest = result
+
+            return size
+
+        encoded = encode(COMPRESS_MAX_QUALITY, top)
+        if encoded > self.max_size and encoder.lossy:
+            encoded = encode(COMPRESS_MIN_QUALITY, top)
+            if encoded <= self.max_size:
+                # 原尺寸即可满足，二分搜索最高的质量
+                low, high = COMPRESS_MIN_QUALITY, COMPRESS_MAX_QUALITY
+                while attempts < self.max_attempts and high - low > 5:
+                    quality = (low + high) // 2
+                    if encode(quality, top) <= self.max_size:
+                        low = quality
+                    else:
+                        high = quality
+
+        if best is None:
+            # 以最低质量缩小尺寸，体积大致与面积成正比
+            quality = COMPRESS_MIN_QUALITY if encoder.lossy else COMPRESS_MAX_QUALITY
+            low, high = 0.0, top
+            while attempts < self.max_attempts:
+                if best is None:
+                    scale = high * (self.max_size / encoded) ** 0.5 * 0.9
+                elif high - low < 0.02:
+                    break
+                else:
+                    scale = (low + high) / 2
+
+                result_size = encode(quality, scale)
+                if result_size <= self.max_size:
+                    low = scale
+                else:
+                    high, encoded = scale, result_size
+
+        result = best or smallest
+        assert result is not None
+        result.attempts = attempts
+
+        return result
+
+    def compress_to_bytes(
+        self, img: Image.Image, raw_size: Optional[int] = None
+    ) -> CompressResult:
+        """搜索不超过 ``max_size`` 的最高质量与最大尺寸。
+
+        有多种编码方式时在多个线程中同时搜索，Pillow 编码时会释放 GIL。
+        无法在限定次数内压缩到 ``max_size`` 以内时返回体积最小的结果。
+
+        :param img: 尚未解码的图片
+        :param raw_size: 原图的字节数，有此参数时先估算所需的尺寸，以较小的尺寸解码
+        """
+        original = img.size
+        img = self._decode(img, self.plan_scale(raw_size) if raw_size else 1.0)
+
+        orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+        if orientation != 1:
+            # 压缩后不保留 exif，先按其中的方向旋转图片
+            img = ImageOps.exif_transpose(img)
+            if orientation in (5, 6, 7, 8):
+                original = (original[1], original[0])
+
+        encoders = self.encoders
+        if len(encoders) == 1:
+            results = [self._search(img, original, encoders[0])]
+        else:
+            # 每种编码方式使用单独的副本，Pillow 保存时会在图片对象上记录编码参数，
+            # 多个线程同时保存同一张图片时参数会互相覆盖
+            with ThreadPoolExecutor(len(encoders)) as executor:
+                results = list(
+                    executor.map(
+                        lambda name: self._search(img.copy(), original, name),
+                        encoders,
+                    )
+                )
+
+        fits = [r for r in results if r.size <= self.max_size]
+        if fits:
+            # 优先保留尺寸，再选择体积最小的
+            result = min(fits, key=lambda r: (-r.scale, r.size))
+        else:
+            result = min(results, key=lambda r: r.size)
+
+            logger.warning(
+                "无法在限定的编码次数内压缩到目标大小",
+                attempts=result.attempts,
+                size=result.size,
+                max_size=self.max_size,
+            )
+
+        if len(results) > 1:
+            logger.debug(
+                "best format selected",
+                encoder=result.encoder,
+                sizes={r.encoder: r.size for r in results},
+            )
+
+        return result
+
+    @staticmethod
+    def raw_size(image: ImageType) -> int:
+        return os.path.getsize(image) if isinstance(image, Path) else len(image.stream)
+
+    def should_compress(self, raw_size: int) -> bool:
+        return raw_size > self.max_size or self.optimize is not None
+
+    def worth_saving(self, raw_size: int, size: int) -> bool:
+        """未超出大小限制的图片，节省的字节数或比例是否达到阈值。"""
+        saved = raw_size - size
+        if self.optimize == OptimizePolicy.RATIO:
+            return saved >= raw_size * self.min_saving
+
+        return saved >= self.min_saving
 
     def __call__(self, image: ImageType) -> ImageType:
-        raw_size = (
-            os.path.getsize(image) if isinstance(image, Path) else len(image.stream)
-        )
-        if raw_size <= self.max_size:
+        raw_size = self.raw_size(image)
+        if not self.should_compress(raw_size):
             return image
 
-        filename = (
-            os.path.splitext(os.path.basename(str(image)))[0] + "." + self.format.value
-        )
-        scale = self.max_size / raw_size
-        img = Image.open(image if isinstance(image, Path) else image.stream)
+        with Image.open(
+            image if isinstance(image, Path) else BytesIO(image.stream)
+        ) as img:
+            if getattr(img, "is_animated", False):
+                if not self.animation:
+                    logger.warning("图床不支持 webp 动图，不压缩动图", image=image)
+                    return image
 
-        compressed_img = self.compress_to_bytes(img, scale)
-        if not os.path.exists(CACHE_PATH):
-            os.mkdir(CACHE_PATH)
+                animated = compress_animation(img, self.max_size, self.max_attempts)
+                if animated is None:
+                    logger.warning("动图的帧数、尺寸过大，只压缩第一帧", image=image)
+                    img.seek(0)
+                    result = self.compress_to_bytes(img)
+                    format = result.format or self.format
+                else:
+                    # jpeg 不支持动图，动图都压缩为 webp
+                    result, format = animated, CompressedFormat.WEBP
+            else:
+                result = self.compress_to_bytes(img, raw_size)
+                format = result.format or self.format
 
-        compressed_size = compressed_img.tell()
+        if raw_size <= self.max_size and not self.worth_saving(raw_size, result.size):
+            logger.debug(
+                "节省的空间小于阈值，使用原图",
+                image=image,
+                raw_size=raw_size,
+                compressed_size=result.size,
+                policy=self.optimize.value if self.optimize else None,
+                min_saving=self.min_saving,
+            )
+            return image
+
+        filename = (
+            os.path.splitext(os.path.basename(str(image)))[0] + "." + format.value
+        )
 
-        img_cache_path = CACHE_PATH / filename
+        img_cache_path = output_path(filename)
         with img_cache_path.open("wb") as f:
-            f.write(compressed_img.getbuffer())
+            f.write(result.data.getbuffer())
 
         logger.info(
             "image compression complete",
             image=img_cache_path,
             raw_size=f"{raw_size/1024/1024:.2f}M",
-            compressed_size=f"{compressed_size/1024/1024:.2f}M",
+            compressed_size=f"{result.size/1024/1024:.2f}M",
+            saved=f"{(raw_size - result.size)/1024/1024:.2f}M",
+            saved_ratio=f"{1 - result.size / raw_size:.1%}",
+            quality=result.quality,
+            scale=f"{result.scale:.2f}",
+            attempts=result.attempts,
+            frames=result.frames,
+            encoder=result.encoder,
         )
 
         return img_cache_path
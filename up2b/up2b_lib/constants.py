@@ -27,6 +27,66 @@ class ImageBedCode(IntEnum):
 
 DEFAULT_TIMEOUT = 10.0
 
+# 每个图床连接池中保持的最大连接数
+DEFAULT_POOL_SIZE = 10
+
+# 各图床默认的请求速率（每秒请求数, 突发请求数），可在配置文件的 rate_limits 中修改
+DEFAULT_RATE_LIMITS = {
+    ImageBedCode.SM_MS: (2.0, 5),
+    ImageBedCode.IMGTU: (2.0, 5),
+    ImageBedCode.IMGTG: (2.0, 5),
+    # github 限制创建内容的请求每分钟不超过 80 次
+    ImageBedCode.GITHUB: (1.0, 10),
+}
+
+# 上传流水线中每个阶段的队列长度，限制同时驻留在内存中的图片数量
+PIPELINE_QUEUE_SIZE = 4
+# 流水线中压缩、添加水印等 CPU 密集阶段的线程数
+PIPELINE_CPU_WORKERS = max(1, min(4, os.cpu_count() or 1))
+
+# 缓存数据库被其他进程锁定时最多等待的秒数
+CACHE_BUSY_TIMEOUT = 5.0
+# 缓存的写入最多延迟多少秒提交，或积累多少条后提交
+CACHE_COMMIT_INTERVAL = 1.0
+CACHE_COMMIT_ROWS = 50
+# 提交失败时保留队列中的记录重试，连续失败多少次后丢弃
+CACHE_WRITE_RETRIES = 5
+# 内存中最多保存的查询结果数量，以及链接查询结果的有效期（秒）
+CACHE_MEMO_SIZE = 4096
+CACHE_MEMO_TTL = 300.0
+
+# 计算图片摘要可用的算法，blake2b 比 md5 更快，可通过环境变量 UP2B_HASH_ALGORITHM 选择
+HASH_ALGORITHMS = ("md5", "blake2b")
+DEFAULT_HASH_ALGORITHM = "md5"
+# 计算摘要时每次读取的字节数
+HASH_BUFFER_SIZE = 1024 * 1024
+
+# 压缩一张图片最多编码的次数，以及搜索编码质量的范围
+COMPRESS_MAX_ATTEMPTS = 6
+COMPRESS_MIN_QUALITY = 50
+COMPRESS_MAX_QUALITY = 90
+# 开启压缩时允许上传的图片类型，gif、apng 与 webp 动图压缩为 webp 动图
+COMPRESSIBLE_TYPES = ("jpg", "jpeg", "png", "apng", "gif", "webp")
+# 只能压缩为 webp 的类型，图床不允许 webp 时不能压缩
+WEBP_ONLY_TYPES = ("apng", "gif", "webp")
+# 动图首次编码的质量，以及压缩时最多每几帧保留一帧
+ANIMATION_QUALITY = 75
+ANIMATION_MAX_FRAME_STEP = 4
+# 每次编码动图时内存中所有帧最多占用的字节数，以及为此最多缩小到的比例，
+# 仍然超出时只压缩第一帧
+ANIMATION_MAX_FRAME_BYTES = 256 * 1024 * 1024
+ANIMATION_MIN_SCALE = 0.25
+# 优化未超出大小限制的图片时，至少节省的字节数或比例
+OPTIMIZE_MIN_SAVING_SIZE = 100 * 1024
+OPTIMIZE_MIN_SAVING_RATIO = 0.1
+
+# 检查缓存链接时的默认并发数，以及每次从数据库读取的记录数
+CACHE_VERIFY_JOBS = 32
+CACHE_VERIFY_BATCH = 1000
+
+# 感知哈希的汉明距离不超过此值时视为同一张图片
+SIMILAR_MAX_DISTANCE = 4
+
 # fmt: off
 IMAGE_BEDS_CODE = {
     "sm.ms":      ImageBedCode.SM_MS,
@@ -63,3 +123,8 @@ if not CONFIG_FILE.parent.exists():
 
 CACHE_PATH = Path(gettempdir()) / "up2b"
 CACHE_DATABASE = UP2B_CONFIG_ROOT_DIR / "cache.db"
+# 压缩、添加水印后的图片的缓存目录及其最大总字节数
+ARTIFACTS_PATH = UP2B_CONFIG_ROOT_DIR / "artifacts"
+ARTIFACTS_MAX_SIZE = 256 * 1024 * 1024
+# 超出最大总字节数时删除到此比例以下，不必每次保存都扫描目录
+ARTIFACTS_EVICT_RATIO = 0.9
@@ -2,8 +2,9 @@
 # -*- coding:utf-8 -*-
 
 from enum import Enum, IntEnum
+from io import BytesIO
 from typing import Any, Dict, List, Optional, Union
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field
 from pathlib import Path
 
 from up2b.up2b_lib.constants import ImageBedCode
@@ -17,8 +18,10 @@ class ImageBedType(IntEnum):
 @dataclass
 class ImageStream:
     filename: str
-    stream: bytes
+    stream: Union[bytes, memoryview]
     mime_type: str
+    # 各算法计算过的摘要，stream 不应在创建后修改
+    digests: Dict[str, str] = field(default_factory=dict, repr=False, compare=False)
 
     def __repr__(self) -> str:
         return self.filename
@@ -53,6 +56,18 @@ class WaterMarkConfig:
         )
 
 
+@dataclass
+class RateLimitConfig:
+    # 每秒允许的请求数
+    rate: float
+    # 短时间内允许连续发送的请求数
+    burst: int = 1
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> "RateLimitConfig":
+        return RateLimitConfig(float(data["rate"]), int(data.get("burst", 1)))
+
+
 ConfigFile = Dict[str, Union[int, AuthData, WaterMarkConfig]]
 
 
@@ -61,6 +76,7 @@ class Config:
     image_bed: Optional[ImageBedCode]
     auth_data: Dict[ImageBedCode, Dict[str, str]]
     watermark: Optional[WaterMarkConfig] = None
+    rate_limits: Dict[ImageBedCode, RateLimitConfig] = field(default_factory=dict)
 
 
 @dataclass
@@ -118,3 +134,59 @@ class ImgtuResponse(BaseResponse):
 class CompressedFormat(Enum):
     WEBP = "webp"
     JPEG = "jpeg"
+    PNG = "png"
+
+
+class OptimizePolicy(Enum):
+    """未超出大小限制的图片是否重新压缩。"""
+
+    # 节省的字节数不小于阈值时使用压缩后的图片
+    SIZE = "size"
+    # 节省的比例不小于阈值时使用压缩后的图片
+    RATIO = "ratio"
+
+
+@dataclass
+class CompressResult:
+    data: BytesIO
+    quality: int
+    scale: float
+    # 编码的次数
+    attempts: int = 0
+    # 动图保留的帧数
+    frames: int = 1
+    format: Optional[CompressedFormat] = None
+    # 编码方式，如 png-palette
+    encoder: str = ""
+
+    @property
+    def size(self) -> int:
+        return self.data.getbuffer().nbytes
+
+
+@dataclass
+class CacheVerifyResult:
+    total: int = 0
+    alive: int = 0
+    # 已失效的链接
+    dead: List[str] = field(default_factory=list)
+    # 超时、连接失败或服务器返回其他错误，无法确定是否失效的链接
+    unknown: List[str] = field(default_factory=list)
+    pruned: int = 0
+
+
+@dataclass
+class CacheStats:
+    # 每个图床缓存的链接数量
+    rows: Dict[str, int]
+    # 数据库文件的大小（字节）
+    size: int
+    hits: int = 0
+    misses: int = 0
+    # 命中缓存而不必上传的图片的总字节数
+    saved_bytes: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
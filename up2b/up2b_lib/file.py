@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
 
+import os
+import json
 import mimetypes
 
-from typing import Optional, Tuple, BinaryIO, Union
+from base64 import b64encode
+from typing import Dict, Iterator, Optional, Tuple, BinaryIO, Union
 from pathlib import Path
 from up2b.up2b_lib.custom_types import ImageType
 
@@ -42,3 +45,83 @@ class File:
 
     def to_dict(self):
         return {self.key: self.to_tuple()}
+
+
+class Base64JSONBody:
+    """以流的形式生成 ``{..., "content": "<base64>"}`` 形式的 json 请求体。
+
+    图片按块读取并编码为 base64，不论图片多大，内存中都只保留一个块。
+
+    :param image: 图片路径或图片流
+    :param fields: 请求体中的其他字段
+    :param key: 图片内容对应的字段名
+    """
+
+    # 必须是 3 的倍数，保证每个块单独编码后拼接的结果与整体编码相同
+    chunk_size = 3 * 16 * 1024
+
+    def __init__(
+        self, image: ImageType, fields: Dict[str, str], key: str = "content"
+    ) -> None:
+        self.image = image
+
+        prefix = "".join(
+            "%s: %s, " % (json.dumps(k), json.dumps(v)) for k, v in fields.items()
+        )
+        self.prefix = ("{" + prefix + json.dumps(key) + ': "').encode()
+        self.suffix = b'"}'
+
+        self.size = (
+            os.path.getsize(image) if isinstance(image, Path) else len(image.stream)
+        )
+
+        self._chunks: Optional[Iterator[bytes]] = None
+        self._buffer = b""
+
+    def __len__(self) -> int:
+        return len(self.prefix) + (self.size + 2) // 3 * 4 + len(self.suffix)
+
+    def _raw_chunks(self) -> Iterator[bytes]:
+        if isinstance(self.image, Path):
+            with self.image.open("rb") as f:
+                while True:
+                    data = f.read(self.chunk_size)
+                    if not data:
+                        break
+
+                    yield data
+        else:
+            view = memoryview(self.image.stream)
+            for start in range(0, len(view), self.chunk_size):
+                yield view[start : start + self.chunk_size]
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self.prefix
+
+        for data in self._raw_chunks():
+            yield b64encode(data)
+
+        yield self.suffix
+
+    def read(self, size: int = -1) -> bytes:
+        if self._chunks is None:
+            self._chunks = iter(self)
+
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+
+            self._buffer += chunk
+
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+
+        return data
+
+    def rewind(self):
+        """回到请求体开头，重试请求时重新发送整个请求体。"""
+        self._chunks = None
+        self._buffer = b""
@@ -2,13 +2,22 @@
 # -*- coding:utf-8 -*-
 
 import sys
+import atexit
+import threading
 import requests
 import requests_toolbelt
 
 from typing import Any, Dict, Optional
 from tqdm import tqdm
+from requests.adapters import HTTPAdapter
+from requests.cookies import RequestsCookieJar
+from up2b.up2b_lib.constants import ImageBedCode
 from up2b.up2b_lib.errors import Timeout
 from up2b.up2b_lib.file import File
+from up2b.up2b_lib.utils import pool_size_in_env
+
+_sessions: Dict[ImageBedCode, requests.Session] = {}
+_sessions_lock = threading.Lock()
 
 
 class ProgressBar(tqdm):
@@ -16,12 +25,70 @@ class ProgressBar(tqdm):
         self.update(n - self.n)
 
 
+def new_session(pool_size: int) -> requests.Session:
+    """创建一个保持长连接的会话，连接池大小为 ``pool_size``。"""
+    session = requests.Session()
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    session.headers["Connection"] = "keep-alive"
+
+    return session
+
+
+def get_session(
+    image_bed_code: ImageBedCode, pool_size: Optional[int] = None
+) -> requests.Session:
+    """获取图床共用的会话。
+
+    同一图床的所有实例共用一个会话，一次批量上传中的所有请求都会复用连接池中的连接。
+
+    :param image_bed_code: 图床代码
+    :param pool_size: 连接池大小，仅在首次创建会话时生效，默认读取环境变量 UP2B_POOL_SIZE
+    """
+    with _sessions_lock:
+        session = _sessions.get(image_bed_code)
+        if session is None:
+            session = new_session(pool_size or pool_size_in_env())
+            _sessions[image_bed_code] = session
+
+        return session
+
+
+@atexit.register
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+
+        _sessions.clear()
+
+
+def parse_cookie(cookie: str) -> Dict[str, str]:
+    """将 ``a=1; b=2`` 形式的 cookie 字符串转换为字典。"""
+    cookies: Dict[str, str] = {}
+    for item in cookie.split(";"):
+        name, sep, value = item.strip().partition("=")
+        if sep:
+            cookies[name] = value
+
+    return cookies
+
+
+def dump_cookies(jar: RequestsCookieJar) -> str:
+    """将 cookie jar 转换为 ``a=1; b=2`` 形式的字符串，用于保存到配置文件。"""
+    return "; ".join(f"{name}={value}" for name, value in jar.items())
+
+
 def upload_with_progress_bar(
     url: str,
     file: File,
     timeout: float,
     form: Optional[Dict[str, Any]] = None,
     headers: Optional[Dict[str, str]] = None,
+    session: Optional[requests.Session] = None,
 ):
     data = form or {}
     data.update(file.to_dict())
@@ -46,7 +113,9 @@ def upload_with_progress_bar(
         headers.update({"Content-Type": monitor.content_type})
 
         try:
-            resp = requests.post(url, data=monitor, headers=headers, timeout=timeout)
+            resp = (session or requests).post(
+                url, data=monitor, headers=headers, timeout=timeout
+            )
         except requests.exceptions.ReadTimeout:
             raise Timeout("网络连接超时，默认超时时间为 10s，可通过设置环境变量 UP2B_TIMEOUT 修改超时时间")
 
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import time
+import threading
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# 表示内存缓存中没有此键，以便区分缓存的 None
+MISSING = object()
+
+
+class LRUCache:
+    """线程安全的内存缓存，超过容量时淘汰最久未使用的键，超过有效期的键视为不存在。
+
+    :param maxsize: 最多保存的键数
+    :param ttl: 每个键的有效期（秒），为 None 时不过期
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self.clock: Callable[[], float] = time.monotonic
+
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        """返回键对应的值，不存在或已过期时返回 ``MISSING``。"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, value = item
+                if self.ttl is None or expires > self.clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+                del self._data[key]
+
+            self.misses += 1
+            return MISSING
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            expires = self.clock() + self.ttl if self.ttl is not None else 0.0
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import atexit
+import tempfile
+import threading
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, List, Optional, Sequence, TYPE_CHECKING
+from up2b.up2b_lib.custom_types import (
+    CompressedFormat,
+    ImagePath,
+    ImageType,
+    OptimizePolicy,
+)
+from up2b.up2b_lib.log import child_logger
+from up2b.up2b_lib.utils import use_work_dir, work_dir
+
+if TYPE_CHECKING:
+    from up2b.up2b_lib.compress import Compressor
+
+logger = child_logger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(processes: int) -> ProcessPoolExecutor:
+    """获取压缩图片、添加水印共用的进程池。
+
+    Pillow 重新编码大图时会长时间持有 GIL，放到进程池中才能同时利用多个 CPU 核心。
+    进程之间只传递文件路径，图片数据通过临时文件交换，不会序列化图片字节。
+
+    :param processes: 进程数，仅在首次创建进程池时生效
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            # 上传流水线是多线程的，fork 可能复制出持有锁的子进程，所以使用 spawn
+            _pool = ProcessPoolExecutor(
+                processes, mp_context=multiprocessing.get_context("spawn")
+            )
+
+            logger.debug("process pool has been created", processes=processes)
+
+        return _pool
+
+
+@atexit.register
+def shutdown_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+
+def _spill(image: ImageType) -> ImagePath:
+    """将图片流写入临时文件，子进程通过路径读取图片。"""
+    if isinstance(image, Path):
+        return image
+
+    # 每个图片流使用单独的目录，保证压缩后的文件名与在当前进程中压缩时相同
+    path = Path(tempfile.mkdtemp(dir=work_dir())) / image.filename
+    path.write_bytes(image.stream)
+
+    return path
+
+
+def _compress(
+    source: str,
+    max_size: int,
+    format: str,
+    formats: List[str],
+    animation: bool,
+    optimize: Optional[str],
+    min_saving: float,
+    output: str,
+) -> str:
+    from up2b.up2b_lib.compress import Compressor
+
+    compressor = Compressor(
+        max_size,
+        CompressedFormat(format),
+        formats=[CompressedFormat(f) for f in formats],
+        animation=animation,
+        optimize=OptimizePolicy(optimize) if optimize else None,
+        min_saving=min_saving,
+    )
+    # 子进程中没有调用方的上下文，压缩结果写入调用方批次的临时目录
+    with use_work_dir(Path(output)):
+        return str(compressor(Path(source)))
+
+
+def _add_text_watermark(
+    source: str, x: int, y: int, opacity: int, texts: Sequence[Any], output: str
+) -> str:
+    from up2b.up2b_lib.watermark import AddWatermark, TypeFont
+
+    aw = AddWatermark(x, y, opacity)
+    with use_work_dir(Path(output)):
+        return str(aw.add_text_watermark(Path(source), [TypeFont(*t) for t in texts]))
+
+
+def compress(compressor: "Compressor", image: ImageType, processes: int) -> ImageType:
+    if not compressor.should_compress(compressor.raw_size(image)):
+        return image
+
+    source = _spill(image)
+
+    future = get_pool(processes).submit(
+        _compress,
+        str(source),
+        compressor.max_size,
+        compressor.format.value,
+        [f.value for f in compressor.formats],
+        compressor.animation,
+        compressor.optimize.value if compressor.optimize else None,
+        compressor.min_saving,
+        str(work_dir()),
+    )
+
+    compressed = Path(future.result())
+    # 节省的空间小于阈值时使用原图，图片流不必换成写入的临时文件
+    return image if compressed == source else compressed
+
+
+def add_text_watermark(
+    image_path: ImagePath,
+    x: int,
+    y: int,
+    opacity: int,
+    texts: List[Any],
+    processes: int,
+) -> ImagePath:
+    future = get_pool(processes).submit(
+        _add_text_watermark,
+        str(image_path),
+        x,
+        y,
+        opacity,
+        [tuple(t) for t in texts],
+        str(work_dir()),
+    )
+
+    return Path(future.result())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+try:
+    from PIL import Image
+except ModuleNotFoundError:
+    raise Exception(
+        "you have enabled the similar image detection feature, but [ pillow ] is not installed, please execute `pip install pillow` before enabling this feature"
+    )
+
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+from up2b.up2b_lib.custom_types import ImageStream, ImageType
+
+# dHash 的边长，结果为 DHASH_SIZE * DHASH_SIZE 位
+DHASH_SIZE = 8
+
+
+def dhash(image: ImageType) -> int:
+    """计算图片的差异哈希。
+
+    缩小为 9x8 的灰度图后比较每行相邻像素的亮度，与图片的格式、元数据、压缩质量无关，
+    重新编码或另存的同一张图片的哈希相同或只有少数位不同。
+    """
+    fp = BytesIO(image.stream) if isinstance(image, ImageStream) else image
+    with Image.open(fp) as img:
+        # 动图只使用第一帧
+        img.seek(0)
+        small = img.convert("L").resize((DHASH_SIZE + 1, DHASH_SIZE), Image.LANCZOS)
+
+    pixels = small.tobytes()
+
+    value = 0
+    for row in range(DHASH_SIZE):
+        offset = row * (DHASH_SIZE + 1)
+        for col in range(DHASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """以汉明距离为度量的 BK 树。
+
+    每个子节点按与父节点的距离保存，查询时根据三角不等式跳过距离范围之外的子树，
+    查询距离很小时只需访问很少的节点。
+    """
+
+    def __init__(self):
+        # 节点为 (哈希, 数据, {距离: 子节点})
+        self.root: Optional[Tuple[int, Any, Dict[int, Any]]] = None
+        self.size = 0
+
+    def add(self, value: int, payload: Any):
+        if self.root is None:
+            self.root = (value, payload, {})
+            self.size = 1
+            return
+
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                # 同样的哈希只保留第一个数据
+                return
+
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, payload, {})
+                self.size += 1
+                return
+
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """查询距离不超过 ``max_distance`` 的所有数据，按距离从小到大返回。"""
+        if self.root is None:
+            return []
+
+        result: List[Tuple[int, Any]] = []
+        stack = [self.root]
+        while stack:
+            node_value, payload, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance:
+                result.append((distance, payload))
+
+            for d, child in children.items():
+                if distance - max_distance <= d <= distance + max_distance:
+                    stack.append(child)
+
+        result.sort(key=lambda r: r[0])
+        return result
+
+    def __len__(self) -> int:
+        return self.size
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import threading
+
+from contextvars import copy_context
+from queue import Queue
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional, Sequence
+from up2b.up2b_lib.constants import PIPELINE_QUEUE_SIZE
+from up2b.up2b_lib.log import child_logger
+
+logger = child_logger(__name__)
+
+_STOP = object()
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[[Any], Any]
+    workers: int = 1
+
+
+class Done:
+    """阶段函数返回此对象表示已得到最终结果，后续阶段不再处理。"""
+
+    __slots__ = ("result",)
+
+    def __init__(self, result: Any):
+        self.result = result
+
+
+class _Failed(Done):
+    pass
+
+
+class Pipeline:
+    """生产者/消费者流水线。
+
+    每个阶段有独立的有界队列和工作线程，第 N+1 个元素可以在第 N 个元素处于
+    后续阶段时开始处理，队列有界保证同时驻留在内存中的元素数量有限。
+
+    :param on_error: 将阶段抛出的异常转换为对应元素的结果，参数为输入的元素与异常，
+        为 None 时所有元素处理完成后抛出第一个异常
+    """
+
+    def __init__(
+        self,
+        stages: Sequence[Stage],
+        queue_size: int = PIPELINE_QUEUE_SIZE,
+        on_error: Optional[Callable[[Any, Exception], Any]] = None,
+    ):
+        assert stages, "流水线至少需要一个阶段"
+
+        self.stages = stages
+        self.queue_size = queue_size
+        self.on_error = on_error
+
+    def run(self, items: Sequence[Any]) -> List[Any]:
+        """按输入顺序返回最后一个阶段的结果。
+
+        任一阶段抛出的异常不会中断其他元素的处理，所有元素处理完成后交给 ``on_error``
+        转换为该元素的结果，没有 ``on_error`` 时抛出第一个异常。``SystemExit``、
+        ``KeyboardInterrupt`` 总是在所有线程退出后抛出。
+        """
+        queues: List["Queue[Any]"] = [
+            Queue(maxsize=self.queue_size) for _ in self.stages
+        ]
+        results: List[Any] = [None] * len(items)
+
+        threads: List[threading.Thread] = []
+        for idx, stage in enumerate(self.stages):
+            output = queues[idx + 1] if idx + 1 < len(queues) else None
+            next_workers = self.stages[idx + 1].workers if output is not None else 0
+            alive = [stage.workers]
+            lock = threading.Lock()
+
+            for n in range(stage.workers):
+                # 每个线程使用调用方上下文的副本，如当前批次的临时目录
+                t = threading.Thread(
+                    target=copy_context().run,
+                    args=(
+                        self._work,
+                        stage,
+                        queues[idx],
+                        output,
+                        next_workers,
+                        alive,
+                        lock,
+                        results,
+                    ),
+                    name="up2b-%s-%d" % (stage.name, n),
+                    daemon=True,
+                )
+                t.start()
+                threads.append(t)
+
+        for item in enumerate(items):
+            queues[0].put(item)
+
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_STOP)
+
+        for t in threads:
+            t.join()
+
+        # logger.fatal 等引起的 SystemExit、KeyboardInterrupt 不能转换为元素的结果，
+        # 等所有线程退出后原样抛出
+        for result in results:
+            if isinstance(result, _Failed) and not isinstance(
+                result.result, Exception
+            ):
+                raise result.result
+
+        for idx, result in enumerate(results):
+            if isinstance(result, _Failed):
+                if self.on_error is None:
+                    raise result.result
+
+                results[idx] = self.on_error(items[idx], result.result)
+
+        return [r.result if isinstance(r, Done) else r for r in results]
+
+    @staticmethod
+    def _work(
+        stage: Stage,
+        input: "Queue[Any]",
+        output: "Optional[Queue[Any]]",
+        next_workers: int,
+        alive: List[int],
+        lock: threading.Lock,
+        results: List[Any],
+    ):
+        while True:
+            item: Any = input.get()
+            if item is _STOP:
+                with lock:
+                    alive[0] -= 1
+                    last = alive[0] == 0
+
+                # 本阶段最后一个线程退出时通知下一阶段的所有线程
+                if last and output is not None:
+                    for _ in range(next_workers):
+                        output.put(_STOP)
+
+                return
+
+            idx, value = item
+            if not isinstance(value, Done):
+                try:
+                    value = stage.func(value)
+                except BaseException as e:
+                    # 捕获 BaseException 保证线程总能向下一阶段发送 _STOP，
+                    # 否则 run 会一直阻塞在 join 上
+                    logger.error("流水线阶段出错", stage=stage.name, error=e)
+                    value = _Failed(e)
+
+            if output is not None:
+                output.put((idx, value))
+            else:
+                results[idx] = value
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import time
+import threading
+import requests
+
+from typing import Callable, Dict, Optional
+from up2b.up2b_lib.constants import DEFAULT_RATE_LIMITS, ImageBedCode
+from up2b.up2b_lib.custom_types import RateLimitConfig
+from up2b.up2b_lib.log import child_logger
+from up2b.up2b_lib.retry import RetryPolicy
+
+logger = child_logger(__name__)
+
+# 根据响应头降低速率时的下限，避免速率为 0 后无法恢复
+MIN_RATE = 0.05
+
+_limiters: Dict[ImageBedCode, "TokenBucket"] = {}
+_limiters_lock = threading.Lock()
+
+
+class TokenBucket:
+    """令牌桶限速器。
+
+    桶中最多保存 ``burst`` 个令牌，每秒补充 ``rate`` 个，每个请求消耗一个令牌，
+    没有令牌时等待。同一图床的所有线程共用一个桶，所以并发上传时总速率也不会超过限制。
+
+    :param rate: 每秒允许的请求数
+    :param burst: 短时间内允许连续发送的请求数
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+
+        self.clock: Callable[[], float] = time.monotonic
+        self.sleep: Callable[[float], None] = time.sleep
+
+        self._updated_at = self.clock()
+        # 服务器要求暂停请求时，在此时间之前不发放令牌
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _fill(self, now: float):
+        elapsed = max(0.0, now - self._updated_at)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    def _wait_time(self) -> float:
+        now = self.clock()
+        if now < self._paused_until:
+            return self._paused_until - now
+
+        self._fill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """取得一个令牌，没有令牌时阻塞到有令牌为止。"""
+        while True:
+            with self._lock:
+                wait = self._wait_time()
+
+            if wait <= 0:
+                return
+
+            self.sleep(wait)
+
+    def pause(self, seconds: float):
+        """在 ``seconds`` 秒内暂停所有请求。"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self.clock() + seconds)
+            self.tokens = 0
+
+    def observe(self, resp: requests.Response):
+        """根据响应头中剩余的请求次数调整速率。"""
+        if resp.status_code == 429:
+            delay = RetryPolicy.server_delay(resp)
+            if delay:
+                # 其他线程也要等待，而不只是收到 429 的请求
+                self.pause(delay)
+
+        remaining = resp.headers.get("X-RateLimit-Remaining")
+        reset = resp.headers.get("X-RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+
+        try:
+            remaining_count = int(remaining)
+            window = float(reset) - time.time()
+        except ValueError:
+            return
+
+        if window <= 0:
+            return
+
+        if remaining_count <= 0:
+            logger.warning("已达到图床的请求次数限制，暂停请求", seconds=window)
+            self.pause(window)
+            return
+
+        # 把剩余次数平均分配到重置前的时间内
+        rate = min(self.max_rate, max(MIN_RATE, remaining_count / window))
+        with self._lock:
+            if rate != self.rate:
+                self._fill(self.clock())
+                logger.debug("rate limit adjusted", rate=rate, remaining=remaining)
+                self.rate = rate
+
+
+def get_rate_limiter(
+    image_bed_code: ImageBedCode, config: Optional[RateLimitConfig] = None
+) -> TokenBucket:
+    """获取图床共用的限速器。
+
+    :param image_bed_code: 图床代码
+    :param config: 配置文件中的速率，仅在首次创建限速器时生效，默认使用 ``DEFAULT_RATE_LIMITS``
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(image_bed_code)
+        if limiter is None:
+            if config is None:
+                rate, burst = DEFAULT_RATE_LIMITS[image_bed_code]
+                config = RateLimitConfig(rate, burst)
+
+            limiter = TokenBucket(config.rate, config.burst)
+            _limiters[image_bed_code] = limiter
+
+        return limiter
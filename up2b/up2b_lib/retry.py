@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import time
+import random
+import threading
+import requests
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Iterator, Optional
+from up2b.up2b_lib.errors import Timeout
+from up2b.up2b_lib.log import child_logger
+
+logger = child_logger(__name__)
+
+# 错误类别
+CONNECTION = "connection"
+TIMEOUT = "timeout"
+SERVER = "server"
+THROTTLE = "throttle"
+AUTH = "auth"
+
+SERVER_ERROR_STATUS = (500, 502, 503, 504)
+
+
+@dataclass
+class RetryRule:
+    retries: int
+    backoff: float = 0.5
+    # 为 False 时重试不消耗批次的重试预算
+    budgeted: bool = True
+
+
+DEFAULT_RULES: Dict[str, RetryRule] = {
+    CONNECTION: RetryRule(3),
+    # 读取超时时服务器可能已经收到了图片，只重试一次
+    TIMEOUT: RetryRule(1),
+    SERVER: RetryRule(3, 1),
+    THROTTLE: RetryRule(5, 2),
+    # token 过期时刷新后立即重试
+    AUTH: RetryRule(3, 0, budgeted=False),
+}
+
+
+class RetryBudget:
+    """一批上传共用的重试次数。
+
+    图床不稳定时，预算耗尽后剩下的请求失败即返回，而不是每个请求都按退避时间重试到上限。
+    """
+
+    def __init__(self, total: int):
+        self.remaining = total
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_batch(cls, count: int) -> "RetryBudget":
+        return cls(max(3, count))
+
+    def consume(self) -> bool:
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+
+            self.remaining -= 1
+            return True
+
+
+# 当前批次共用的重试预算，只在批次的调用中有效，批次之外的请求不受限制
+_batch_budget: "ContextVar[Optional[RetryBudget]]" = ContextVar(
+    "up2b_retry_budget", default=None
+)
+
+
+def current_budget() -> Optional[RetryBudget]:
+    return _batch_budget.get()
+
+
+@contextmanager
+def batch_budget(count: int) -> Iterator[RetryBudget]:
+    """在 ``with`` 块中使用一批 ``count`` 张图片共用的重试预算。
+
+    预算保存在上下文变量中，同时上传的批次互不影响，批次结束后恢复为不限制。
+    在其他线程中执行的请求需要复制调用方的上下文。
+    """
+    budget = RetryBudget.for_batch(count)
+    token = _batch_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _batch_budget.reset(token)
+
+
+class RetryPolicy:
+    """所有图床共用的重试策略。
+
+    - 连接错误、超时、5xx、429 按错误类别分别设置重试次数和退避时间
+    - 退避时间按指数增长并加入随机抖动
+    - 响应头中有 ``Retry-After`` 或 ``X-RateLimit-Reset`` 时按服务器要求的时间等待
+    """
+
+    def __init__(
+        self,
+        rules: Optional[Dict[str, RetryRule]] = None,
+        max_backoff: float = 30.0,
+        jitter: float = 0.5,
+    ):
+        self.rules = dict(DEFAULT_RULES, **(rules or {}))
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.sleep: Callable[[float], None] = time.sleep
+
+    @staticmethod
+    def exception_kind(e: Exception) -> Optional[str]:
+        if isinstance(e, (requests.exceptions.Timeout, Timeout)):
+            return TIMEOUT
+
+        if isinstance(e, requests.exceptions.ConnectionError):
+            return CONNECTION
+
+        return None
+
+    @staticmethod
+    def response_kind(resp: requests.Response) -> Optional[str]:
+        if resp.status_code == 429:
+            return THROTTLE
+
+        if resp.status_code == 403 and resp.headers.get("X-RateLimit-Remaining") == "0":
+            # github 超出限额时返回 403
+            return THROTTLE
+
+        if resp.status_code in SERVER_ERROR_STATUS:
+            return SERVER
+
+        return None
+
+    @staticmethod
+    def server_delay(resp: requests.Response) -> Optional[float]:
+        """服务器通过响应头要求的等待时间。"""
+        retry_after = resp.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                pass
+
+            try:
+                return max(
+                    0.0, parsedate_to_datetime(retry_after).timestamp() - time.time()
+                )
+            except (TypeError, ValueError):
+                pass
+
+        reset = resp.headers.get("X-RateLimit-Reset")
+        if reset and resp.headers.get("X-RateLimit-Remaining") == "0":
+            try:
+                return max(0.0, float(reset) - time.time())
+            except ValueError:
+                pass
+
+        return None
+
+    def backoff(self, rule: RetryRule, attempt: int) -> float:
+        delay = min(self.max_backoff, rule.backoff * 2**attempt)
+        return delay * (1 - self.jitter * random.random())
+
+    def _allow(
+        self,
+        kind: str,
+        attempts: Dict[str, int],
+        budget: Optional[RetryBudget],
+    ) -> bool:
+        rule = self.rules.get(kind)
+        if rule is None or attempts.get(kind, 0) >= rule.retries:
+            return False
+
+        if rule.budgeted and budget is not None and not budget.consume():
+            logger.warning("本批次的重试次数已用完，不再重试", kind=kind)
+            return False
+
+        attempts[kind] = attempts.get(kind, 0) + 1
+        return True
+
+    def call(
+        self,
+        send: Callable[[], requests.Response],
+        retry_if: Optional[Callable[[requests.Response], Optional[str]]] = None,
+        before_retry: Optional[Callable[[str], None]] = None,
+        budget: Optional[RetryBudget] = None,
+    ) -> requests.Response:
+        """发送请求，失败时按策略重试。
+
+        :param send: 发送一次请求，每次重试都会重新调用，所以请求体需要在其中创建
+        :param retry_if: 根据响应内容判断错误类别，用于图床特有的错误，如 token 过期
+        :param before_retry: 重试前调用，参数为错误类别，如在 token 过期时刷新 token
+        :param budget: 一批上传共用的重试预算
+        :returns: 最后一次请求的响应，重试次数用完后仍失败的响应也会返回
+        """
+        attempts: Dict[str, int] = {}
+
+        while True:
+            try:
+                resp = send()
+            except Exception as e:
+                kind = self.exception_kind(e)
+                if kind is None or not self._allow(kind, attempts, budget):
+                    raise
+
+                delay = self.backoff(self.rules[kind], attempts[kind] - 1)
+                logger.warning(
+                    "请求出错，稍后重试",
+                    kind=kind,
+                    attempt=attempts[kind],
+                    delay=delay,
+                    error=e,
+                )
+                self.sleep(delay)
+                continue
+
+            kind = self.response_kind(resp)
+            if kind is None and retry_if is not None:
+                kind = retry_if(resp)
+
+            if kind is None or not self._allow(kind, attempts, budget):
+                return resp
+
+            delay = self.server_delay(resp)
+            if delay is None:
+                delay = self.backoff(self.rules[kind], attempts[kind] - 1)
+            delay = min(delay, self.max_backoff)
+
+            logger.warning(
+                "请求失败，稍后重试",
+                kind=kind,
+                status_code=resp.status_code,
+                attempt=attempts[kind],
+                delay=delay,
+            )
+
+            if before_retry is not None:
+                before_retry(kind)
+
+            self.sleep(delay)
@@ -4,18 +4,37 @@
 import os
 import time
 import json
-import shutil
+import asyncio
+import threading
 import requests
 
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from functools import partial
 from abc import ABC, abstractmethod
-from typing import Callable, Optional, List, Tuple, Dict, Union, Any
+from typing import (
+    Awaitable,
+    Callable,
+    Optional,
+    List,
+    Sequence,
+    Tuple,
+    Dict,
+    Union,
+    Any,
+)
 from pathlib import Path
+from up2b.up2b_lib.artifacts import ArtifactStore
+from up2b.up2b_lib.auth import TOKEN_TIME_KEY, TokenRefresher
 from up2b.up2b_lib.cache import Cache
 from up2b.up2b_lib.constants import (
     CONFIG_FILE,
-    CACHE_PATH,
     IMAGE_BEDS_NAME,
+    PIPELINE_CPU_WORKERS,
     PYTHON_VERSION,
+    SIMILAR_MAX_DISTANCE,
+    COMPRESSIBLE_TYPES,
+    WEBP_ONLY_TYPES,
     ImageBedCode,
 )
 
@@ -36,9 +55,27 @@ from up2b.up2b_lib.custom_types import (
     AuthInfo,
     UploadErrorResponse,
     CompressedFormat,
+    OptimizePolicy,
 )
+from up2b.up2b_lib.file import Base64JSONBody
+from up2b.up2b_lib.http import get_session
 from up2b.up2b_lib.log import child_logger
-from up2b.up2b_lib.utils import check_image_exists, read_conf, timeout_in_env
+from up2b.up2b_lib.pipeline import Done, Pipeline, Stage
+from up2b.up2b_lib.ratelimit import get_rate_limiter
+from up2b.up2b_lib.retry import (
+    AUTH,
+    RetryBudget,
+    RetryPolicy,
+    batch_budget,
+    current_budget,
+)
+from up2b.up2b_lib.utils import (
+    batch_work_dir,
+    check_image_exists,
+    in_context,
+    read_conf,
+    timeout_in_env,
+)
 from up2b.up2b_lib.errors import UnsupportedType, OverSizeError
 
 logger = child_logger(__name__)
@@ -99,7 +136,25 @@ class Base(ImageBedAbstract):
 
     cache = Cache()
 
+    # 压缩、添加水印后的图片
+    artifacts = ArtifactStore()
+
+    # 批量上传时同一图床允许的最大并发数
+    max_jobs: int = 4
+
+    # 所有图床共用的重试策略
+    retry_policy = RetryPolicy()
+
+    # token 的有效时长（秒），超过后在请求前主动刷新，为 None 时只在图床拒绝后刷新
+    token_max_age: Optional[float] = None
+
     compressed_format: CompressedFormat = CompressedFormat.WEBP
+    # 选择最佳格式时可以使用的格式
+    allowed_formats: Tuple[CompressedFormat, ...] = (
+        CompressedFormat.WEBP,
+        CompressedFormat.PNG,
+        CompressedFormat.JPEG,
+    )
 
     def __init__(
         self,
@@ -109,12 +164,25 @@ class Base(ImageBedAbstract):
         conf: Optional[Config] = None,
         timeout: Optional[float] = None,
         quiet: bool = False,
+        processes: int = 0,
+        similar: bool = False,
+        best_format: bool = False,
+        optimize: Optional[OptimizePolicy] = None,
+        min_saving: Optional[float] = None,
     ):
         self.timeout = timeout_in_env() if timeout is None else timeout
         self.quiet = quiet
         self.conf = conf if conf != None else read_conf()
+        self.session = get_session(self.image_bed_code)
+        self.rate_limiter = get_rate_limiter(
+            self.image_bed_code, self.conf.rate_limits.get(self.image_bed_code)
+        )
 
         self.auth_info: Optional[AuthInfo] = self._read_auth_info()
+        self.token_refresher = TokenRefresher(
+            self.token_max_age,
+            self.auth_info.get(TOKEN_TIME_KEY) if self.auth_info else None,
+        )
         self.add_watermark: bool = add_watermark
         if self.add_watermark:
             if not self.conf.watermark:
@@ -122,15 +190,114 @@ class Base(ImageBedAbstract):
                     "you have enabled the function of adding watermark, but the watermark is not configured, please configure the text watermark through `config-watermark`"
                 )
 
-        if auto_compress:
+        # 优化图片时未超出大小限制的图片也会压缩
+        if auto_compress or optimize:
             from up2b.up2b_lib.compress import Compressor
 
-            self.compressor = Compressor(self.max_size, self.compressed_format)
+            # 选择最佳格式时同时尝试图床允许的所有格式，保留体积最小的结果
+            self.compressor = Compressor(
+                self.max_size,
+                self.compressed_format,
+                formats=self.allowed_formats if best_format else (),
+                # 动图只能压缩为 webp
+                animation=CompressedFormat.WEBP in self.allowed_formats,
+                optimize=optimize,
+                min_saving=min_saving,
+            )
         else:
             self.compressor = None
 
         self.ignore_cache: bool = ignore_cache
 
+        # 大于 0 时在子进程中压缩图片、添加水印
+        self.processes = processes
+
+        # 缓存中没有同样的文件时，再用感知哈希查询看起来相同的图片
+        self.similar = similar
+        if self.similar:
+            from up2b.up2b_lib.phash import dhash
+
+            self._dhash = dhash
+
+        self._async_executor: Optional[ThreadPoolExecutor] = None
+        self._async_semaphore: Optional[asyncio.Semaphore] = None
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def retry_budget(self) -> Optional[RetryBudget]:
+        """当前批次共用的重试预算，不在批次中时不限制。"""
+        return current_budget()
+
+    def _send(
+        self,
+        send: Callable[[], requests.Response],
+        retry_if: Optional[Callable[[requests.Response], Optional[str]]] = None,
+        before_retry: Optional[Callable[[str], None]] = None,
+    ) -> requests.Response:
+        """按图床的限速和重试策略发送请求，参数含义见 ``RetryPolicy.call``。"""
+
+        def limited() -> requests.Response:
+            # 重试的请求同样受限速约束
+            self.rate_limiter.acquire()
+            resp = send()
+            self.rate_limiter.observe(resp)
+            return resp
+
+        return self.retry_policy.call(
+            limited, retry_if, before_retry, self.retry_budget
+        )
+
+    def _request(
+        self,
+        method: str,
+        url: str,
+        retry_if: Optional[Callable[[requests.Response], Optional[str]]] = None,
+        before_retry: Optional[Callable[[str], None]] = None,
+        **kwargs: Any,
+    ) -> requests.Response:
+        """通过图床共用的会话发送请求，复用连接池中的连接，失败时按重试策略重试。"""
+        kwargs.setdefault("timeout", self.timeout)
+
+        def send() -> requests.Response:
+            data = kwargs.get("data")
+            if isinstance(data, Base64JSONBody):
+                # 流式请求体在上一次请求中已被读完
+                data.rewind()
+
+            return self.session.request(method, url, **kwargs)
+
+        return self._send(send, retry_if, before_retry)
+
+    def _update_auth_token(self):
+        """获取新的 token 并保存，由需要刷新 token 的图床实现。"""
+        raise NotImplementedError
+
+    def _send_authorized(
+        self,
+        send: Callable[[], requests.Response],
+        token_rejected: Callable[[requests.Response], Optional[str]],
+    ) -> requests.Response:
+        """发送携带 token 的请求。
+
+        ``send`` 每次调用时都要读取当前的 token。token 过期时只有第一个被拒绝的请求
+        刷新 token，同时被拒绝的其他请求等待刷新完成后使用新 token 重试。
+        """
+        refresher = self.token_refresher
+        refresher.refresh_if_expired(self._update_auth_token)
+
+        generation = [refresher.generation]
+
+        def attempt() -> requests.Response:
+            # 先记录 generation 再读取 token，保证 token 不会比记录的 generation 旧
+            generation[0] = refresher.generation
+            return send()
+
+        def before_retry(kind: str):
+            if kind == AUTH:
+                refresher.refresh(generation[0], self._update_auth_token)
+
+        return self._send(attempt, token_rejected, before_retry)
+
     def check_login(self):
         if not self.auth_info:
             logger.fatal(
@@ -152,8 +319,13 @@ class Base(ImageBedAbstract):
 
         return auth_info
 
-    def _save_auth_info(self, auth_info: Dict[str, str]):
+    def _save_auth_info(self, auth_info: Dict[str, Any]):
         logger.debug("current image bed code", code=self.image_bed_code)
+
+        auth_info[TOKEN_TIME_KEY] = int(time.time())
+        # 同步到内存中的配置，重新读取认证信息时不必再读配置文件
+        self.conf.auth_data[self.image_bed_code] = auth_info
+
         try:
             with open(CONFIG_FILE, "r+") as f:
                 conf = json.loads(f.read())
@@ -210,21 +382,76 @@ class Base(ImageBedAbstract):
 
                 logger.trace("image mime type", image=_img, type=mime_type)
 
-                if mime_type not in ["jpg", "png", "jpeg"]:
+                if mime_type not in COMPRESSIBLE_TYPES or (
+                    mime_type in WEBP_ONLY_TYPES
+                    and CompressedFormat.WEBP not in self.allowed_formats
+                ):
                     raise UnsupportedType(
                         "currently does not support compression of this type of image: %s"
                         % mime_type.upper()
                     )
 
-    def _compress_image(self, image: ImageType) -> ImageType:
+    def _compress_params(self) -> Optional[Dict[str, Any]]:
+        if self.compressor is None:
+            return None
+
+        return {
+            "format": self.compressor.format.value,
+            "formats": [f.value for f in self.compressor.formats],
+            "animation": self.compressor.animation,
+            "max_size": self.compressor.max_size,
+            "optimize": (
+                self.compressor.optimize.value if self.compressor.optimize else None
+            ),
+            "min_saving": self.compressor.min_saving,
+        }
+
+    def _watermark_params(self) -> Dict[str, Any]:
+        assert self.conf.watermark is not None
+
+        params = asdict(self.conf.watermark)
+        # 字体文件被替换后结果也会改变
+        params["font_mtime"] = os.path.getmtime(self.conf.watermark.font)
+        return params
+
+    def _compress_image(self, image: ImageType, md5: Optional[str] = None) -> ImageType:
+        """
+        :param md5: 原图的摘要，有摘要时使用或保存已缓存的压缩结果
+        """
         if self.compressor == None:
             return image
 
+        if not self.compressor.should_compress(self.compressor.raw_size(image)):
+            return image
+
+        key = None
+        if md5:
+            key = self.artifacts.key(md5, "compress", self._compress_params())
+            cached = self.artifacts.get(key)
+            if cached:
+                logger.info("使用已缓存的压缩结果", image=image, cached=cached)
+                return cached
+
         logger.debug("compressing image", image=image)
 
-        return self.compressor(image)
+        if self.processes:
+            from up2b.up2b_lib import offload
+
+            compressed = offload.compress(self.compressor, image, self.processes)
+        else:
+            compressed = self.compressor(image)
+
+        if key and isinstance(compressed, Path) and compressed != image:
+            compressed = self.artifacts.put(key, compressed)
+
+        return compressed
 
-    def _add_watermark(self, image_path: ImagePath) -> ImagePath:
+    def _add_watermark(
+        self, image_path: ImagePath, md5: Optional[str] = None
+    ) -> ImagePath:
+        """
+        :param md5: 原图的摘要，有摘要时使用或保存已缓存的结果
+        """
         if not self.add_watermark:
             return image_path
 
@@ -232,31 +459,47 @@ class Base(ImageBedAbstract):
 
         assert self.conf.watermark != None
 
-        aw = AddWatermark(
-            self.conf.watermark.x,
-            self.conf.watermark.y,
-            self.conf.watermark.opacity or 50,
-        )
-        return aw.add_text_watermark(
-            image_path,
-            [
-                TypeFont(
-                    self.conf.watermark.text,
-                    self.conf.watermark.size,
-                    self.conf.watermark.font,
-                    (0, 0, 0),
-                )
-            ],
-        )
+        key = None
+        if md5:
+            # 水印添加在压缩后的图片上，压缩参数也会影响结果
+            params = {
+                "watermark": self._watermark_params(),
+                "compress": self._compress_params(),
+            }
+            key = self.artifacts.key(md5, "watermark", params)
+            cached = self.artifacts.get(key)
+            if cached:
+                logger.info("使用已缓存的水印结果", image=image_path, cached=cached)
+                return cached
+
+        x = self.conf.watermark.x
+        y = self.conf.watermark.y
+        opacity = self.conf.watermark.opacity or 50
+        texts = [
+            TypeFont(
+                self.conf.watermark.text,
+                self.conf.watermark.size,
+                self.conf.watermark.font,
+                (0, 0, 0),
+            )
+        ]
 
-    def _clear_cache(self):
-        if os.path.exists(CACHE_PATH):
-            shutil.rmtree(CACHE_PATH)
-            os.mkdir(CACHE_PATH)
+        if self.processes:
+            from up2b.up2b_lib import offload
 
-            logger.debug("cache folder has been cleared", cache_path=CACHE_PATH)
+            result = offload.add_text_watermark(
+                image_path, x, y, opacity, texts, self.processes
+            )
+        else:
+            aw = AddWatermark(x, y, opacity)
+            result = aw.add_text_watermark(image_path, texts)
+
+        if key:
+            result = self.artifacts.put(key, result)
 
-    def _check_cache(self, image: Path) -> Tuple[str, str, bool]:
+        return result
+
+    def _check_cache(self, image: ImageType) -> Tuple[str, str, bool]:
         url, md5, ok = self.cache.check_cache_of_image_bed(
             image, IMAGE_BEDS_NAME[self.image_bed_code]
         )
@@ -269,11 +512,228 @@ class Base(ImageBedAbstract):
 
             return (url, md5, ok)
 
+        similar_url = self._check_similar(image, md5)
+        if similar_url:
+            logger.info("缓存中找到相似的图片链接", url=similar_url)
+            return (similar_url, md5, True)
+
         logger.info("缓存中未找到此图片链接，开始上传")
         return (url, md5, ok)
 
+    def _check_similar(self, image: ImageType, md5: str) -> Optional[str]:
+        """用感知哈希查询当前图床中看起来相同的图片。
+
+        未开启或忽略缓存时不查询。查询不到时记录感知哈希，上传成功后随缓存一起保存。
+        """
+        if not self.similar or self.ignore_cache:
+            return None
+
+        try:
+            phash = self._dhash(image)
+        except Exception as e:
+            logger.debug("failed to compute phash", image=image, error=e)
+            return None
+
+        url = self.cache.find_similar(
+            phash, IMAGE_BEDS_NAME[self.image_bed_code], SIMILAR_MAX_DISTANCE
+        )
+        if not url:
+            self.cache.remember_phash(md5, phash)
+
+        return url
+
+    def _hash_stage(
+        self, image: Union[ImageType, DownloadErrorResponse]
+    ) -> Union[Done, Tuple[ImageType, str]]:
+        if isinstance(image, DownloadErrorResponse):
+            return Done(image)
+
+        if isinstance(image, tuple):
+            # 已在 _prefetch_cache 中计算过摘要
+            return image
+
+        url, md5, ok = self._check_cache(image)
+
+        if ok and not self.ignore_cache:
+            self._record_cache_stats([image], 0)
+            return Done(url)
+
+        self._record_cache_stats([], 1)
+        return image, md5
+
+    def _record_cache_stats(self, hits: Sequence[ImageType], misses: int):
+        """记录缓存命中次数与因此不必上传的字节数。"""
+        saved = sum(
+            os.path.getsize(img) if isinstance(img, Path) else len(img.stream)
+            for img in hits
+        )
+        self.cache.record_stats(hits=len(hits), misses=misses, saved_bytes=saved)
+
+    def _prefetch_cache(
+        self, images: Sequence[Union[ImageType, DownloadErrorResponse]]
+    ) -> List[Any]:
+        """开始上传前一次查询整批图片的缓存。
+
+        已缓存的图片替换为 ``Done(url)``，未缓存的图片替换为 ``(图片, 摘要)``，
+        流水线的 hash 阶段不再逐张查询。
+        """
+        items: List[Any] = list(images)
+        indexes = [
+            i for i, img in enumerate(images) if isinstance(img, (Path, ImageStream))
+        ]
+        if not indexes:
+            return items
+
+        results = self.cache.check_cache_of_images(
+            [images[i] for i in indexes],  # type: ignore
+            IMAGE_BEDS_NAME[self.image_bed_code],
+        )
+
+        hits: List[ImageType] = []
+        for i, (url, md5, ok) in zip(indexes, results):
+            if not ok:
+                url = self._check_similar(images[i], md5)  # type: ignore
+                ok = bool(url)
+
+            if ok and not self.ignore_cache:
+                items[i] = Done(url)
+                hits.append(images[i])  # type: ignore
+            else:
+                items[i] = (images[i], md5)
+
+        self._record_cache_stats(hits, len(indexes) - len(hits))
+
+        logger.info("缓存查询完成", total=len(indexes), cached=len(hits))
+
+        return items
+
+    def _run_pipeline(
+        self,
+        stages: List[Stage],
+        images: Sequence[Union[ImageType, DownloadErrorResponse]],
+    ) -> List[Any]:
+        items = self._prefetch_cache(images)
+
+        if all(isinstance(item, Done) for item in items):
+            # 整批图片都已上传过，不必启动流水线
+            return [item.result for item in items]
+
+        return Pipeline(stages, on_error=self._stage_error).run(items)
+
+    def _stage_error(self, item: Any, error: Exception) -> UploadErrorResponse:
+        """某张图片在流水线中出错时只记录这张图片的错误，不影响其他图片的结果。"""
+        image = item[0] if isinstance(item, tuple) else item
+
+        return UploadErrorResponse(500, str(error), str(image))
+
+    def _compress_stage(self, prepared: Tuple[ImageType, str]) -> Tuple[ImageType, str]:
+        image, md5 = prepared
+
+        return self._compress_image(image, md5), md5
+
+    def _watermark_stage(
+        self, prepared: Tuple[ImageType, str]
+    ) -> Tuple[ImageType, str]:
+        image, md5 = prepared
+
+        if isinstance(image, Path):
+            image = self._add_watermark(image, md5)
+
+        return image, md5
+
+    def _upload_stage(
+        self, prepared: Tuple[ImageType, str]
+    ) -> Union[str, UploadErrorResponse]:
+        return self._upload_prepared(*prepared)
+
+    def _upload_prepared(
+        self, image: ImageType, md5: str
+    ) -> Union[str, UploadErrorResponse]:
+        """上传已经压缩、添加过水印的图片。
+
+        :param image: 处理后的图片
+        :param md5: 原图片的 md5，上传成功后用于保存缓存
+        """
+        raise NotImplementedError
+
+    def _cpu_stage_workers(self) -> int:
+        # 使用进程池时，每个线程只负责等待一个子进程的结果
+        return self.processes or PIPELINE_CPU_WORKERS
+
+    def _pipeline_stages(self, jobs: int) -> List[Stage]:
+        return [
+            # 计算摘要时 hashlib 会释放 GIL，多个线程可以同时计算
+            Stage("hash", self._hash_stage, PIPELINE_CPU_WORKERS),
+            Stage(
+                "compress",
+                self._compress_stage,
+                self._cpu_stage_workers() if self.compressor else 1,
+            ),
+            Stage(
+                "watermark",
+                self._watermark_stage,
+                self._cpu_stage_workers() if self.add_watermark else 1,
+            ),
+            Stage("upload", self._upload_stage, jobs),
+        ]
+
+    def _upload_image(self, image: ImageType) -> Union[str, UploadErrorResponse]:
+        """在当前线程中依次执行流水线的每个阶段。"""
+        item: Any = image
+        for stage in self._pipeline_stages(1):
+            item = stage.func(item)
+            if isinstance(item, Done):
+                return item.result
+
+        return item
+
+    def _upload_one(
+        self, img: Union[ImageType, DownloadErrorResponse]
+    ) -> Union[str, DownloadErrorResponse, UploadErrorResponse]:
+        if isinstance(img, DownloadErrorResponse):
+            return img
+
+        if isinstance(img, Path):
+            return self.upload_image(img)
+
+        return self.upload_image_stream(img)
+
+    def _upload_batch(
+        self, images: Tuple[Union[ImageType, DownloadErrorResponse], ...], jobs: int
+    ) -> List[Union[str, DownloadErrorResponse, UploadErrorResponse]]:
+        """按输入顺序返回每张图片的上传结果。
+
+        :param images: 待上传的图片
+        :param jobs: 并发数，不会超过图床的 ``max_jobs``
+        """
+        jobs = max(1, min(jobs, self.max_jobs, len(images)))
+
+        with batch_budget(len(images)):
+            if len(images) > 1 and self._supports_pipeline():
+                # 计算 md5、压缩、添加水印与上传重叠进行，第 N+1 张图片的预处理与第 N 张的上传同时进行
+                logger.debug(
+                    "uploading images with pipeline", jobs=jobs, count=len(images)
+                )
+
+                return self._run_pipeline(self._pipeline_stages(jobs), images)
+
+            if jobs == 1:
+                return [self._upload_one(img) for img in images]
+
+            logger.debug("uploading images concurrently", jobs=jobs, count=len(images))
+
+            with ThreadPoolExecutor(jobs) as pool:
+                return list(pool.map(in_context(self._upload_one), images))
+
+    def _supports_pipeline(self) -> bool:
+        # 只实现了 upload_image 的自定义图床仍使用线程池逐张上传
+        return type(self)._upload_prepared is not Base._upload_prepared
+
     def upload_images(
-        self, *images: Union[ImageType, DownloadErrorResponse], to_console: bool = True
+        self,
+        *images: Union[ImageType, DownloadErrorResponse],
+        to_console: bool = True,
+        jobs: int = 1,
     ) -> List[Union[str, DownloadErrorResponse, UploadErrorResponse]]:
         self.check_login()
 
@@ -281,27 +741,97 @@ class Base(ImageBedAbstract):
 
         self._check_images_valid(images)
 
-        image_urls: List[Union[str, DownloadErrorResponse, UploadErrorResponse]] = []
-        for img in images:
-            if isinstance(img, DownloadErrorResponse):
-                result = img
-            elif isinstance(img, Path):
-                result = self.upload_image(img)
+        # 处理后的图片写入本批次的临时目录，上传完成后删除
+        with batch_work_dir():
+            image_urls = self._upload_batch(images, jobs)
+
+        if to_console:
+            self._print_results(image_urls)
+
+        return image_urls
+
+    def _print_results(
+        self, image_urls: List[Union[str, DownloadErrorResponse, UploadErrorResponse]]
+    ):
+        for iu in image_urls:
+            if isinstance(iu, UploadErrorResponse):
+                logger.error("上传出错", status_code=iu.status_code, error=iu.error)
             else:
-                result = self.upload_image_stream(img)
+                print(iu)
+
+    def _async_slots(self) -> asyncio.Semaphore:
+        """当前事件循环中限制同时执行的阻塞调用数量的信号量。
+
+        等待信号量的协程不会占用线程，所以同一进程中可以同时挂起成百上千个上传任务。
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_semaphore is None or self._async_loop is not loop:
+            self._async_semaphore = asyncio.Semaphore(self.max_jobs)
+            self._async_loop = loop
+
+        return self._async_semaphore
+
+    async def _run_async(self, func: Callable[..., Any], *args: Any, **kwargs: Any):
+        if self._async_executor is None:
+            self._async_executor = ThreadPoolExecutor(
+                self.max_jobs, thread_name_prefix="up2b-%s" % self
+            )
+
+        async with self._async_slots():
+            return await asyncio.get_running_loop().run_in_executor(
+                self._async_executor, in_context(partial(func, *args, **kwargs))
+            )
+
+    async def aupload_image(
+        self, image: Union[ImageType, DownloadErrorResponse]
+    ) -> Union[str, DownloadErrorResponse, UploadErrorResponse]:
+        return await self._run_async(self._upload_one, image)
+
+    async def aupload_images(
+        self,
+        *images: Union[ImageType, DownloadErrorResponse],
+        to_console: bool = False,
+        jobs: Optional[int] = None,
+    ) -> List[Union[str, DownloadErrorResponse, UploadErrorResponse]]:
+        """``upload_images`` 的异步版本，按输入顺序返回结果。
 
-            image_urls.append(result)
+        :param jobs: 本批图片的并发数，默认与图床的 ``max_jobs`` 相同
+        """
+        self.check_login()
+
+        check_image_exists(images)
+
+        self._check_images_valid(images)
+
+        batch_slots = asyncio.Semaphore(jobs or self.max_jobs)
+
+        async def upload(
+            img: Union[ImageType, DownloadErrorResponse],
+        ) -> Union[str, DownloadErrorResponse, UploadErrorResponse]:
+            async with batch_slots:
+                return await self.aupload_image(img)
+
+        # 每个批次使用单独的临时目录和重试预算，同时进行的批次互不影响
+        with batch_work_dir(), batch_budget(len(images)):
+            tasks: List[
+                Awaitable[Union[str, DownloadErrorResponse, UploadErrorResponse]]
+            ] = [upload(img) for img in images]
+            image_urls = list(await asyncio.gather(*tasks))
 
         if to_console:
-            for iu in image_urls:
-                if isinstance(iu, UploadErrorResponse):
-                    logger.error("上传出错", status_code=iu.status_code, error=iu.error)
-                else:
-                    print(iu)
+            self._print_results(image_urls)
 
-        self._clear_cache()
         return image_urls
 
+    async def aget_all_images(self) -> Any:
+        return await self._run_async(self.get_all_images)
+
+    async def adelete_image(self, *args, **kwargs) -> Optional[ErrorResponse]:
+        return await self._run_async(self.delete_image, *args, **kwargs)
+
+    async def adelete_images(self, *args, **kwargs) -> Dict[str, ErrorResponse]:
+        return await self._run_async(self.delete_images, *args, **kwargs)
+
 
 class GitBase(Base):
     headers: Dict[str, str]
@@ -311,6 +841,10 @@ class GitBase(Base):
     username: str
     repo: str
     folder: str
+    branch: str = "main"
+
+    _filename_lock = threading.Lock()
+    _last_timestamp = 0
 
     def __init__(
         self,
@@ -320,9 +854,24 @@ class GitBase(Base):
         conf: Optional[Config] = None,
         timeout: Optional[float] = None,
         quiet: bool = False,
+        processes: int = 0,
+        similar: bool = False,
+        best_format: bool = False,
+        optimize: Optional[OptimizePolicy] = None,
+        min_saving: Optional[float] = None,
     ):
         super().__init__(
-            auto_compress, add_watermark, ignore_cache, conf, timeout, quiet
+            auto_compress,
+            add_watermark,
+            ignore_cache,
+            conf,
+            timeout,
+            quiet,
+            processes,
+            similar,
+            best_format,
+            optimize,
+            min_saving,
         )
 
         if self.auth_info:
@@ -330,6 +879,7 @@ class GitBase(Base):
             self.username = self.auth_info["username"]
             self.repo = self.auth_info["repo"]
             self.folder = self.auth_info["folder"]
+            self.branch = self.auth_info.get("branch", self.branch)
 
     def login(self, token: str, username: str, repo: str, folder: str = "up2b"):
         auth_info = {
@@ -340,77 +890,65 @@ class GitBase(Base):
         }
         self._save_auth_info(auth_info)
 
-    def _upload(
-        self, image: ImageType, data: Dict[str, str], request_method: str = "put"
+    @abstractmethod
+    def _request_data(self, image: ImageType) -> Base64JSONBody:
+        pass
+
+    def _upload_prepared(
+        self, image: ImageType, md5: str, request_method: str = "put"
     ) -> Union[str, UploadErrorResponse]:
         self.check_login()
 
-        url, md5, ok = self._check_cache(image)  # type: ignore
-
-        if ok and not self.ignore_cache:
-            return url
-
-        image = self._compress_image(image)
-        if isinstance(image, Path):
-            image = self._add_watermark(image)
-
-        suffix = os.path.splitext(str(image))[-1]
-        if suffix.lower() == ".apng":
-            suffix = ".png"
-        filename = f"{int(time.time() * 1000)}{suffix}"
+        data = self._request_data(image)
 
-        url = self.base_url + filename
+        url = self.base_url + self._filename(image)
 
         logger.debug("request headers", headers=self.headers)
 
-        resp = requests.request(
-            request_method, url, headers=self.headers, json=data, timeout=self.timeout
-        )
+        headers = self.headers.copy()
+        headers["Content-Type"] = "application/json"
+
+        # 请求体是流，base64 编码边读边发送，内存占用与图片大小无关
+        resp = self._request(request_method, url, headers=headers, data=data)
         if resp.status_code == 201:
             uploaded_url: str = resp.json()["content"]["download_url"]
-            logger.info("uploaded", image=image, url=uploaded_url)
-            if hasattr(self, "cdn_url") and callable(getattr(self, "cdn_url")):
-                return self.cdn_url(uploaded_url)  # type: ignore
-
-            self.cache.save(
-                md5,
-                IMAGE_BEDS_NAME[self.image_bed_code],
-                uploaded_url,
-                self.ignore_cache,
-            )
-
-            return uploaded_url
+            return self._uploaded(image, md5, uploaded_url)
         else:
             error = resp.json()["message"]
             logger.error("upload failed", image=image, error=error)
             return UploadErrorResponse(resp.status_code, error, str(image))
 
-    def upload_images(
-        self, *images: Union[ImageType, DownloadErrorResponse], to_console: bool = True
-    ) -> List[Union[str, DownloadErrorResponse, UploadErrorResponse]]:
-        self.check_login()
+    def _uploaded(self, image: ImageType, md5: str, uploaded_url: str) -> str:
+        logger.info("uploaded", image=image, url=uploaded_url)
+        if hasattr(self, "cdn_url") and callable(getattr(self, "cdn_url")):
+            return self.cdn_url(uploaded_url)  # type: ignore
 
-        check_image_exists(images)
+        self.cache.save(
+            md5,
+            IMAGE_BEDS_NAME[self.image_bed_code],
+            uploaded_url,
+            self.ignore_cache,
+        )
 
-        self._check_images_valid(images)
+        return uploaded_url
 
-        image_urls: List[Union[str, DownloadErrorResponse, UploadErrorResponse]] = []
-        for img in images:
-            if isinstance(img, DownloadErrorResponse):
-                result = img
-            elif isinstance(img, Path):
-                result = self.upload_image(img)
-            else:
-                result = self.upload_image_stream(img)
+    def _filename(self, image: ImageType) -> str:
+        """以毫秒时间戳作为仓库中的文件名，同一毫秒内的多张图片依次加一，保证文件名不重复。"""
+        suffix = os.path.splitext(str(image))[-1]
+        if suffix.lower() == ".apng":
+            suffix = ".png"
 
-            image_urls.append(result)
+        with self._filename_lock:
+            timestamp = max(int(time.time() * 1000), GitBase._last_timestamp + 1)
+            GitBase._last_timestamp = timestamp
 
-        if to_console:
-            for iu in image_urls:
-                print(iu)
+        return f"{timestamp}{suffix}"
 
-        self._clear_cache()
-        return image_urls
+    def _print_results(
+        self, image_urls: List[Union[str, DownloadErrorResponse, UploadErrorResponse]]
+    ):
+        for iu in image_urls:
+            print(iu)
 
     @abstractmethod
     def _get_all_images_in_image_bed(
@@ -454,9 +992,7 @@ class GitBase(Base):
         if extra:
             data.update(extra)
 
-        resp = requests.delete(
-            url, headers=self.headers, json=data, timeout=self.timeout
-        )
+        resp = self._request("delete", url, headers=self.headers, json=data)
         if resp.status_code == 200:
             return None
 
@@ -484,3 +1020,7 @@ class GitBase(Base):
             self.repo,
             self.folder,
         )
+
+    @cached_property
+    def repo_url(self) -> str:
+        return "%s/repos/%s/%s/" % (self.api_url, self.username, self.repo)
@@ -2,10 +2,13 @@ from pathlib import Path
 import requests
 
 from abc import ABC, abstractmethod
-from typing import overload, Optional, List, Tuple, Dict, Union
+from typing import overload, Any, Callable, Optional, Sequence, List, Tuple, Dict, Union
+from up2b.up2b_lib.artifacts import ArtifactStore
+from up2b.up2b_lib.auth import TokenRefresher
 from up2b.up2b_lib.cache import Cache
 from up2b.up2b_lib.constants import ImageBedCode
 from up2b.up2b_lib.custom_types import (
+    CompressedFormat,
     Config,
     DownloadErrorResponse,
     ErrorResponse,
@@ -18,8 +21,13 @@ from up2b.up2b_lib.custom_types import (
     ImgtuResponse,
     SMMSResponse,
     UploadErrorResponse,
+    OptimizePolicy,
 )
 from up2b.up2b_lib.compress import Compressor
+from up2b.up2b_lib.file import Base64JSONBody
+from up2b.up2b_lib.pipeline import Done, Stage
+from up2b.up2b_lib.ratelimit import TokenBucket
+from up2b.up2b_lib.retry import RetryBudget, RetryPolicy
 
 def choose_image_bed(image_bed_code: int) -> None: ...
 
@@ -40,9 +48,7 @@ class ImageBedAbstract(ABC):
     ) -> Union[str, UploadErrorResponse]: ...
     @overload
     @abstractmethod
-    def delete_image(
-        self, unique_id: str, retries: int = ...
-    ) -> Optional[ErrorResponse]: ...
+    def delete_image(self, unique_id: str) -> Optional[ErrorResponse]: ...
     @overload
     @abstractmethod
     def delete_image(
@@ -53,9 +59,7 @@ class ImageBedAbstract(ABC):
     ) -> Optional[ErrorResponse]: ...
     @overload
     @abstractmethod
-    def delete_images(
-        self, unique_ids: List[str], retries: int = ...
-    ) -> Dict[str, ErrorResponse]: ...
+    def delete_images(self, unique_ids: List[str]) -> Dict[str, ErrorResponse]: ...
     @overload
     @abstractmethod
     def delete_images(
@@ -78,10 +82,23 @@ class Base:
     auth_info: Optional[AuthInfo]
     add_watermark: bool
     compressor: Compressor | None
+    compressed_format: CompressedFormat
+    allowed_formats: Tuple[CompressedFormat, ...]
     ignore_cache: bool
     quiet: bool
     timeout: float
     cache: Cache
+    artifacts: ArtifactStore
+    max_jobs: int
+    processes: int
+    similar: bool
+    session: requests.Session
+    rate_limiter: TokenBucket
+    retry_policy: RetryPolicy
+    @property
+    def retry_budget(self) -> Optional[RetryBudget]: ...
+    token_max_age: Optional[float]
+    token_refresher: TokenRefresher
 
     def __init__(
         self,
@@ -91,19 +108,105 @@ class Base:
         conf: Optional[Config] = ...,
         timeout: Optional[float] = ...,
         quiet: bool = ...,
+        processes: int = ...,
+        similar: bool = ...,
+        best_format: bool = ...,
+        optimize: Optional[OptimizePolicy] = ...,
+        min_saving: Optional[float] = ...,
     ) -> None: ...
+    def _send(
+        self,
+        send: Callable[[], requests.Response],
+        retry_if: Optional[Callable[[requests.Response], Optional[str]]] = ...,
+        before_retry: Optional[Callable[[str], None]] = ...,
+    ) -> requests.Response: ...
+    def _update_auth_token(self) -> None: ...
+    def _send_authorized(
+        self,
+        send: Callable[[], requests.Response],
+        token_rejected: Callable[[requests.Response], Optional[str]],
+    ) -> requests.Response: ...
+    def _request(
+        self,
+        method: str,
+        url: str,
+        retry_if: Optional[Callable[[requests.Response], Optional[str]]] = ...,
+        before_retry: Optional[Callable[[str], None]] = ...,
+        **kwargs: Any,
+    ) -> requests.Response: ...
     def check_login(self) -> None: ...
     def _read_auth_info(self) -> Optional[AuthInfo]: ...
-    def _save_auth_info(self, auth_info: Dict[str, str]) -> None: ...
+    def _save_auth_info(self, auth_info: Dict[str, Any]) -> None: ...
     def _exceed_max_size(self, images: Images) -> Tuple[bool, Optional[str]]: ...
     def _check_images_valid(self, images: Images): ...
-    def _compress_image(self, image: ImageType) -> ImageType: ...
-    def _add_watermark(self, image_path: ImagePath) -> ImagePath: ...
-    def _clear_cache(self) -> None: ...
-    def _check_cache(self, image: Path) -> Tuple[str, str, bool]: ...
+    def _compress_params(self) -> Optional[Dict[str, Any]]: ...
+    def _watermark_params(self) -> Dict[str, Any]: ...
+    def _compress_image(
+        self, image: ImageType, md5: Optional[str] = ...
+    ) -> ImageType: ...
+    def _add_watermark(
+        self, image_path: ImagePath, md5: Optional[str] = ...
+    ) -> ImagePath: ...
+    def _check_cache(self, image: ImageType) -> Tuple[str, str, bool]: ...
+    def _check_similar(self, image: ImageType, md5: str) -> Optional[str]: ...
+    def _hash_stage(
+        self, image: Union[ImageType, DownloadErrorResponse]
+    ) -> Union[Done, Tuple[ImageType, str]]: ...
+    def _record_cache_stats(
+        self, hits: Sequence[ImageType], misses: int
+    ) -> None: ...
+    def _prefetch_cache(
+        self, images: Sequence[Union[ImageType, DownloadErrorResponse]]
+    ) -> List[Any]: ...
+    def _run_pipeline(
+        self,
+        stages: List[Stage],
+        images: Sequence[Union[ImageType, DownloadErrorResponse]],
+    ) -> List[Any]: ...
+    def _stage_error(self, item: Any, error: Exception) -> UploadErrorResponse: ...
+    def _compress_stage(
+        self, prepared: Tuple[ImageType, str]
+    ) -> Tuple[ImageType, str]: ...
+    def _watermark_stage(
+        self, prepared: Tuple[ImageType, str]
+    ) -> Tuple[ImageType, str]: ...
+    def _upload_stage(
+        self, prepared: Tuple[ImageType, str]
+    ) -> Union[str, UploadErrorResponse]: ...
+    def _upload_prepared(
+        self, image: ImageType, md5: str
+    ) -> Union[str, UploadErrorResponse]: ...
+    def _cpu_stage_workers(self) -> int: ...
+    def _pipeline_stages(self, jobs: int) -> List[Stage]: ...
+    def _upload_image(self, image: ImageType) -> Union[str, UploadErrorResponse]: ...
+    def _supports_pipeline(self) -> bool: ...
+    def _upload_one(
+        self, img: Union[ImageType, DownloadErrorResponse]
+    ) -> Union[str, DownloadErrorResponse, UploadErrorResponse]: ...
+    def _upload_batch(
+        self, images: Images, jobs: int
+    ) -> List[Union[str, DownloadErrorResponse, UploadErrorResponse]]: ...
     def upload_images(
-        self, *images: Union[ImageType, DownloadErrorResponse], to_console: bool = ...
+        self,
+        *images: Union[ImageType, DownloadErrorResponse],
+        to_console: bool = ...,
+        jobs: int = ...,
     ) -> List[Union[str, UploadErrorResponse]]: ...
+    def _print_results(
+        self, image_urls: List[Union[str, DownloadErrorResponse, UploadErrorResponse]]
+    ) -> None: ...
+    async def aupload_image(
+        self, image: Union[ImageType, DownloadErrorResponse]
+    ) -> Union[str, DownloadErrorResponse, UploadErrorResponse]: ...
+    async def aupload_images(
+        self,
+        *images: Union[ImageType, DownloadErrorResponse],
+        to_console: bool = ...,
+        jobs: Optional[int] = ...,
+    ) -> List[Union[str, DownloadErrorResponse, UploadErrorResponse]]: ...
+    async def aget_all_images(self) -> Union[AllImagesResponse, ErrorResponse]: ...
+    async def adelete_image(self, *args, **kwargs) -> Optional[ErrorResponse]: ...
+    async def adelete_images(self, *args, **kwargs) -> Dict[str, ErrorResponse]: ...
 
 class GitBase(Base, ImageBedAbstract):
     headers: Dict[str, str]
@@ -113,6 +216,7 @@ class GitBase(Base, ImageBedAbstract):
     username: str
     repo: str
     folder: str
+    branch: str
 
     def __init__(
         self,
@@ -122,13 +226,22 @@ class GitBase(Base, ImageBedAbstract):
         conf: Optional[Config] = ...,
         timeout: Optional[float] = None,
         quiet: bool = ...,
+        processes: int = ...,
+        similar: bool = ...,
+        best_format: bool = ...,
+        optimize: Optional[OptimizePolicy] = ...,
+        min_saving: Optional[float] = ...,
     ) -> None: ...
     def login(
         self, token: str, username: str, repo: str, folder: str = ...
     ) -> None: ...
-    def _upload(
-        self, image: ImageType, data: Dict[str, str], request_method: str = ...
+    @abstractmethod
+    def _request_data(self, image: ImageType) -> Base64JSONBody: ...
+    def _upload_prepared(
+        self, image: ImageType, md5: str, request_method: str = ...
     ) -> Union[str, UploadErrorResponse]: ...
+    def _uploaded(self, image: ImageType, md5: str, uploaded_url: str) -> str: ...
+    def _filename(self, image: ImageType) -> str: ...
     @abstractmethod
     def _get_all_images_in_image_bed(
         self,
@@ -148,3 +261,5 @@ class GitBase(Base, ImageBedAbstract):
     ) -> Dict[str, ErrorResponse]: ...
     @property
     def base_url(self) -> str: ...
+    @property
+    def repo_url(self) -> str: ...
@@ -2,29 +2,47 @@
 # -*- coding:utf-8 -*-
 
 import os
-import requests
 
-from base64 import b64encode
-from typing import Optional
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+from pathlib import Path
 from up2b.up2b_lib.custom_types import (
     Config,
+    DownloadErrorResponse,
     ImageBedType,
     ImagePath,
     ImageStream,
+    ImageType,
     ErrorResponse,
+    UploadErrorResponse,
+    OptimizePolicy,
 )
+from up2b.up2b_lib.file import Base64JSONBody
+from up2b.up2b_lib.pipeline import Done, Stage
+from up2b.up2b_lib.retry import batch_budget
 from up2b.up2b_lib.up2b_api import GitBase
+from up2b.up2b_lib.utils import batch_work_dir, check_image_exists
 from up2b.up2b_lib.constants import ImageBedCode
 from up2b.up2b_lib.log import child_logger
 
 logger = child_logger(__name__)
 
 
+class Blob(NamedTuple):
+    image: ImageType
+    md5: str
+    path: str
+    sha: str
+
+
 class Github(GitBase):
     image_bed_code = ImageBedCode.GITHUB
     max_size = 20 * 1024 * 1024
     api_url = "https://api.github.com"
     image_bed_type = ImageBedType.git
+    # Contents API 的每次 PUT 都是一次提交，并发提交会返回 409 冲突
+    max_jobs = 1
+    # 批量提交时只并发创建 blob，不会产生冲突
+    max_blob_jobs = 8
 
     def __init__(
         self,
@@ -34,9 +52,24 @@ class Github(GitBase):
         conf: Optional[Config] = None,
         timeout: Optional[float] = None,
         quiet: bool = False,
+        processes: int = 0,
+        similar: bool = False,
+        best_format: bool = False,
+        optimize: Optional[OptimizePolicy] = None,
+        min_saving: Optional[float] = None,
     ):
         super().__init__(
-            auto_compress, add_watermark, ignore_cache, conf, timeout, quiet
+            auto_compress,
+            add_watermark,
+            ignore_cache,
+            conf,
+            timeout,
+            quiet,
+            processes,
+            similar,
+            best_format,
+            optimize,
+            min_saving,
         )
 
         if hasattr(self, "token"):
@@ -46,25 +79,149 @@ class Github(GitBase):
             }
 
     def upload_image(self, image_path: ImagePath):
-        basename = os.path.basename(image_path)
-        logger.debug("uploading", name=basename)
-        with open(image_path, "rb") as fb:
-            data = {
-                "content": b64encode(fb.read()).decode("utf-8"),
-                "message": "up2b - " + basename,
-            }
-        return self._upload(image_path, data)
+        logger.debug("uploading", name=os.path.basename(image_path))
+        return self._upload_image(image_path)
 
     def upload_image_stream(self, image: ImageStream):
         logger.debug("uploading", name=image.filename)
-        data = {
-            "content": b64encode(image.stream).decode("utf-8"),
-            "message": "up2b - " + image.filename,
+        return self._upload_image(image)
+
+    def _request_data(self, image: ImageType) -> Base64JSONBody:
+        basename = (
+            os.path.basename(image) if isinstance(image, Path) else image.filename
+        )
+
+        return Base64JSONBody(image, {"message": "up2b - " + basename})
+
+    def upload_images(
+        self,
+        *images: Union[ImageType, DownloadErrorResponse],
+        to_console: bool = True,
+        jobs: int = 1,
+        batch: bool = False,
+    ) -> List[Union[str, DownloadErrorResponse, UploadErrorResponse]]:
+        """上传多张图片。
+
+        :param batch: 通过 Git Data API 把所有图片放在同一次提交中，
+            只需为每张图片创建 blob，再创建一次 tree、一次 commit 并更新一次分支
+        """
+        if not batch:
+            return super().upload_images(*images, to_console=to_console, jobs=jobs)
+
+        self.check_login()
+
+        check_image_exists(images)
+
+        self._check_images_valid(images)
+
+        with batch_work_dir(), batch_budget(len(images)):
+            image_urls = self._upload_in_one_commit(images, jobs)
+
+        if to_console:
+            self._print_results(image_urls)
+
+        return image_urls
+
+    def _upload_in_one_commit(
+        self, images: Tuple[Union[ImageType, DownloadErrorResponse], ...], jobs: int
+    ) -> List[Union[str, DownloadErrorResponse, UploadErrorResponse]]:
+        stages = self._pipeline_stages(1)[:-1]
+        stages.append(
+            Stage("blob", self._blob_stage, max(1, min(jobs, self.max_blob_jobs)))
+        )
+
+        results: List[Any] = self._run_pipeline(stages, images)
+
+        blobs = [r for r in results if isinstance(r, Blob)]
+        if not blobs:
+            return results
+
+        logger.debug("committing blobs", count=len(blobs), branch=self.branch)
+
+        error = self._commit_blobs(blobs)
+
+        image_urls: List[Union[str, DownloadErrorResponse, UploadErrorResponse]] = []
+        for r in results:
+            if not isinstance(r, Blob):
+                image_urls.append(r)
+            elif error:
+                image_urls.append(
+                    UploadErrorResponse(error.status_code, error.error, str(r.image))
+                )
+            else:
+                image_urls.append(self._uploaded(r.image, r.md5, self._raw_url(r.path)))
+
+        return image_urls
+
+    def _blob_stage(self, prepared: Tuple[ImageType, str]) -> Union[Done, Blob]:
+        image, md5 = prepared
+
+        # blob 请求体只含图片内容和编码方式，同样以流的形式发送
+        body = Base64JSONBody(image, {"encoding": "base64"})
+        resp = self._git_api("post", "git/blobs", data=body)
+        if resp.status_code != 201:
+            error = resp.json()["message"]
+            logger.error("create blob failed", image=image, error=error)
+            return Done(UploadErrorResponse(resp.status_code, error, str(image)))
+
+        path = "%s/%s" % (self.folder, self._filename(image))
+        return Blob(image, md5, path, resp.json()["sha"])
+
+    def _commit_blobs(self, blobs: List[Blob]) -> Optional[ErrorResponse]:
+        resp = self._git_api("get", "git/ref/heads/" + self.branch)
+        if resp.status_code != 200:
+            return ErrorResponse(resp.status_code, resp.json()["message"])
+        parent: str = resp.json()["object"]["sha"]
+
+        resp = self._git_api("get", "git/commits/" + parent)
+        if resp.status_code != 200:
+            return ErrorResponse(resp.status_code, resp.json()["message"])
+        base_tree: str = resp.json()["tree"]["sha"]
+
+        tree = [
+            {"path": b.path, "mode": "100644", "type": "blob", "sha": b.sha}
+            for b in blobs
+        ]
+        resp = self._git_api(
+            "post", "git/trees", json={"base_tree": base_tree, "tree": tree}
+        )
+        if resp.status_code != 201:
+            return ErrorResponse(resp.status_code, resp.json()["message"])
+
+        commit = {
+            "message": "up2b - upload %d images" % len(blobs),
+            "tree": resp.json()["sha"],
+            "parents": [parent],
         }
-        return self._upload(image, data)
+        resp = self._git_api("post", "git/commits", json=commit)
+        if resp.status_code != 201:
+            return ErrorResponse(resp.status_code, resp.json()["message"])
+
+        resp = self._git_api(
+            "patch", "git/refs/heads/" + self.branch, json={"sha": resp.json()["sha"]}
+        )
+        if resp.status_code != 200:
+            return ErrorResponse(resp.status_code, resp.json()["message"])
+
+        return None
+
+    def _git_api(self, method: str, path: str, **kwargs: Any):
+        headers: Dict[str, str] = self.headers.copy()
+        if "data" in kwargs:
+            headers["Content-Type"] = "application/json"
+
+        return self._request(method, self.repo_url + path, headers=headers, **kwargs)
+
+    def _raw_url(self, path: str) -> str:
+        return "https://raw.githubusercontent.com/%s/%s/%s/%s" % (
+            self.username,
+            self.repo,
+            self.branch,
+            path,
+        )
 
     def _get_all_images_in_image_bed(self):
-        resp = requests.get(self.base_url, headers=self.headers, timeout=self.timeout)
+        resp = self._request("get", self.base_url, headers=self.headers)
 
         return resp
 
@@ -77,7 +234,7 @@ class Github(GitBase):
         return self._delete_image(sha, url, message)
 
     def cdn_url(self, url: str) -> str:
-        path = url.split("/main/")[-1]
+        path = url.split("/%s/" % self.branch)[-1]
         return "https://cdn.jsdelivr.net/gh/%s/%s/%s" % (self.username, self.repo, path)
 
     def __repr__(self):
@@ -19,12 +19,14 @@ from up2b.up2b_lib.custom_types import (
     ImagePath,
     ImgtuResponse,
     UploadErrorResponse,
+    OptimizePolicy,
 )
 from up2b.up2b_lib.errors import MissingAuth
 from up2b.up2b_lib.file import File
-from up2b.up2b_lib.http import upload_with_progress_bar
+from up2b.up2b_lib.http import dump_cookies, parse_cookie, upload_with_progress_bar
 from up2b.up2b_lib.up2b_api import Base
 from up2b.up2b_lib.log import child_logger
+from up2b.up2b_lib.retry import AUTH
 from up2b.up2b_lib.constants import IMAGE_BEDS_NAME, ImageBedCode
 
 logger = child_logger(__name__)
@@ -40,6 +42,9 @@ class Imgtg(Base):
         "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:102.0) Gecko/20100101 Firefox/102.0",
     }
 
+    # 页面中的 auth_token 随登录会话过期
+    token_max_age = 60 * 60
+
     def __init__(
         self,
         auto_compress: bool = False,
@@ -48,9 +53,24 @@ class Imgtg(Base):
         conf: Optional[Config] = None,
         timeout: Optional[float] = None,
         quiet: bool = False,
+        processes: int = 0,
+        similar: bool = False,
+        best_format: bool = False,
+        optimize: Optional[OptimizePolicy] = None,
+        min_saving: Optional[float] = None,
     ):
         super().__init__(
-            auto_compress, add_watermark, ignore_cache, conf, timeout, quiet
+            auto_compress,
+            add_watermark,
+            ignore_cache,
+            conf,
+            timeout,
+            quiet,
+            processes,
+            similar,
+            best_format,
+            optimize,
+            min_saving,
         )
 
         self.cookie: Optional[str] = None
@@ -59,7 +79,7 @@ class Imgtg(Base):
             self.cookie = self.auth_info["cookie"]
             self.token = self.auth_info["token"]
             self.username = self.auth_info["username"]
-            self.__headers["Cookie"] = self.cookie
+            self._load_cookie(self.cookie)
 
     def login(self, username: str, password: str) -> bool:
         url = self._url("login")
@@ -68,26 +88,21 @@ class Imgtg(Base):
         if not auth_token or not cookie:
             raise MissingAuth("auth token or cookie is None")
 
-        headers = self.__headers.copy()
-        headers["Cookie"] = cookie
-
         data = {
             "login-subject": username,
             "password": password,
             "auth_token": auth_token,
         }
 
-        resp = requests.post(
-            url, headers=headers, data=data, allow_redirects=False, timeout=self.timeout
+        # 登录页响应的 cookie 已保存在会话的 cookie jar 中
+        resp = self._request(
+            "post", url, headers=self.__headers, data=data, allow_redirects=False
         )
         if resp.status_code == 301:
             # If there is a KEEPLOGIN field in the cookie,
-            # pictures will be uploaded as a normal user
-            self.cookie = cookie + "; " + resp.headers["Set-Cookie"].split("; ")[0]
-
-            # If there is no KEEPLOGIN field in the cookie,
-            # pictures will be uploaded as a tourist
-            # self.cookie = cookie
+            # pictures will be uploaded as a normal user,
+            # otherwise pictures will be uploaded as a tourist
+            self.cookie = dump_cookies(self.session.cookies)
 
             auth_info = {
                 "token": auth_token,
@@ -102,33 +117,34 @@ class Imgtg(Base):
 
     def _parse_auth_token(self) -> Tuple[Optional[str], Optional[str]]:
         url = self._url("login")
-        resp = requests.get(url, headers=self.__headers, timeout=self.timeout)
+        # 重新登录时丢弃旧的会话 cookie
+        self.session.cookies.clear()
+        resp = self._request("get", url, headers=self.__headers)
         if resp.status_code == 200:
             auth_token = re.search(
                 r'PF.obj.config.auth_token = "([a-f0-9]{40})"', resp.text
             )
             if not auth_token:
                 return None, None
-            resp_set_cookie = resp.headers["Set-Cookie"].split("; ")[0]
-            return auth_token.group(1), resp_set_cookie
+            return auth_token.group(1), dump_cookies(resp.cookies)
         else:
             logger.error("response error", status_code=resp.status_code)
             return None, None
 
+    def _load_cookie(self, cookie: str):
+        domain = parse.urlparse(self.base_url).hostname
+        for name, value in parse_cookie(cookie).items():
+            self.session.cookies.set(name, value, domain=domain)
+
     @property
     def headers(self):
+        # cookie 由会话的 cookie jar 携带
         assert self.cookie != None
 
-        headers = self.__headers.copy()
-        headers.update(
-            {
-                "Cookie": self.cookie,
-            }
-        )
-        return headers
+        return self.__headers.copy()
 
     def _update_auth_token(self):
-        resp = requests.get(self.base_url, headers=self.headers, timeout=self.timeout)
+        resp = self._request("get", self.base_url, headers=self.headers)
         auth_token = re.search(
             r'PF.obj.config.auth_token = "([a-f0-9]{40})"', resp.text
         )
@@ -149,23 +165,21 @@ class Imgtg(Base):
 
         return UploadErrorResponse(status_code, text, str(image))
 
-    def __upload(
-        self, image: ImageType, retries: int = 0
-    ) -> Union[str, UploadErrorResponse]:
-        self.check_login()
+    def _token_rejected(self, resp: requests.Response) -> Optional[str]:
+        try:
+            message = resp.json()["error"]["message"]
+        except (ValueError, KeyError, TypeError):
+            return None
 
-        url, md5, ok = self._check_cache(image)  # type: ignore
+        return AUTH if message == "请求被拒绝 (auth_token)" else None
 
-        if ok and not self.ignore_cache:
-            return url
+    def _upload_prepared(
+        self, image: ImageType, md5: str
+    ) -> Union[str, UploadErrorResponse]:
+        self.check_login()
 
         logger.debug("uploading", image_path=image)
 
-        image = self._compress_image(image)
-
-        if isinstance(image, Path):
-            image = self._add_watermark(image)
-
         url = self._url("json")
         filename_with_suffix = os.path.basename(str(image))
         filename_without_suffix, suffix = os.path.splitext(filename_with_suffix)
@@ -178,31 +192,33 @@ class Imgtg(Base):
 
         file = File("source", image, filename=filename)
 
-        timestamp = int(time.time() * 1000)
-
-        data = {
-            "type": "file",
-            "action": "upload",
-            "timestamp": str(timestamp),
-            "auth_token": self.token,
-            "nsfw": "0",
-        }
-
         logger.debug("请求头", header=dict(self.headers))
 
-        try:
+        def send() -> requests.Response:
+            # 刷新 token 后重试时需要使用新的 token
+            data = {
+                "type": "file",
+                "action": "upload",
+                "timestamp": str(int(time.time() * 1000)),
+                "auth_token": self.token,
+                "nsfw": "0",
+            }
+
             if not self.quiet:
-                resp = upload_with_progress_bar(
-                    url, file, self.timeout, data, self.headers
-                )
-            else:
-                resp = requests.post(
-                    url,
-                    headers=self.headers,
-                    data=data,
-                    files=file.to_dict(),
-                    timeout=self.timeout,
+                return upload_with_progress_bar(
+                    url, file, self.timeout, data, self.headers, self.session
                 )
+
+            return self.session.post(
+                url,
+                headers=self.headers,
+                data=data,
+                files=file.to_dict(),  # type: ignore
+                timeout=self.timeout,
+            )
+
+        try:
+            resp = self._send_authorized(send, self._token_rejected)
         except requests.exceptions.ConnectionError as e:
             return UploadErrorResponse(400, str(e), str(image))
 
@@ -233,46 +249,22 @@ class Imgtg(Base):
             return uploaded_url
         except KeyError:
             logger.debug("错误响应", body=resp.text)
-            if json_resp["error"]["message"] == "请求被拒绝 (auth_token)":
-                if retries >= 3:
-                    return UploadErrorResponse(
-                        resp.status_code, resp.json()["error"]["message"], str(image)
-                    )
-
-                logger.warn(
-                    "`auth_token` has expired, the program will try to update `auth_token` automatically, number of retries: %d",
-                    retries + 1,
-                )
-                self._update_auth_token()
-
-                return self.__upload(image, retries + 1)
-            else:
-                logger.debug("上传出错", error=resp.json())
+            if not self._token_rejected(resp):
                 logger.error("imgtg 禁止上传重复图片，请检查你之前是否已上传过此图片", image=image)
-                return UploadErrorResponse(
-                    resp.status_code, resp.json()["error"]["message"], str(image)
-                )
-
-    def upload_image(self, image_path: ImagePath) -> Union[str, UploadErrorResponse]:
-        image_path = self._add_watermark(image_path)
 
-        if self.compressor:
-            # 输入的是路径，返回的也必然是路径，忽略 pyright 的错误提示
-            image_path = self._compress_image(image_path)  # type: ignore
+            return UploadErrorResponse(
+                resp.status_code, json_resp["error"]["message"], str(image)
+            )
 
-        return self.__upload(image_path)
+    def upload_image(self, image_path: ImagePath) -> Union[str, UploadErrorResponse]:
+        return self._upload_image(image_path)
 
     def upload_image_stream(
         self, image: ImageStream
     ) -> Union[str, UploadErrorResponse]:
         logger.debug("uploading", filename=image.filename)
 
-        if self.compressor:
-            new_image = self._compress_image(image)
-        else:
-            new_image = image
-
-        return self.__upload(new_image)
+        return self._upload_image(image)
 
     def get_all_images(self) -> Union[List[ImgtuResponse], ErrorResponse]:
         self.check_login()
@@ -283,7 +275,7 @@ class Imgtg(Base):
         images: Set[Tuple[str, ...]] = set()
 
         def visit_next_page(url: str):
-            resp = requests.get(url, headers=self.__headers, timeout=self.timeout)
+            resp = self._request("get", url, headers=self.__headers)
             resp.encoding = "utf-8"
 
             if resp.status_code != 200:
@@ -336,10 +328,10 @@ class Imgtg(Base):
 
         return result
 
-    def delete_image(self, img_id: str, retries: int = 0):
+    def delete_image(self, img_id: str):
         logger.fatal("不支持删除图片", image_bed=self)
 
-    def delete_images(self, imgs_id: List[str], retries: int = 0):
+    def delete_images(self, imgs_id: List[str]):
         logger.fatal("不支持删除图片", image_bed=self)
 
     def _url(self, path: str) -> str:
@@ -20,13 +20,15 @@ from up2b.up2b_lib.custom_types import (
     ImgtuResponse,
     UploadErrorResponse,
     CompressedFormat,
+    OptimizePolicy,
 )
 from up2b.up2b_lib.errors import MissingAuth
 from up2b.up2b_lib.file import File
-from up2b.up2b_lib.http import upload_with_progress_bar
+from up2b.up2b_lib.http import dump_cookies, parse_cookie, upload_with_progress_bar
 from up2b.up2b_lib.up2b_api import Base
 from up2b.up2b_lib.constants import IMAGE_BEDS_NAME, ImageBedCode
 from up2b.up2b_lib.log import child_logger
+from up2b.up2b_lib.retry import AUTH
 
 logger = child_logger(__name__)
 
@@ -42,6 +44,10 @@ class Imgtu(Base):
     }
 
     compressed_format: CompressedFormat = CompressedFormat.JPEG
+    allowed_formats = (CompressedFormat.JPEG, CompressedFormat.PNG)
+
+    # 页面中的 auth_token 随登录会话过期
+    token_max_age = 60 * 60
 
     def __init__(
         self,
@@ -51,9 +57,24 @@ class Imgtu(Base):
         conf: Optional[Config] = None,
         timeout: Optional[float] = None,
         quiet: bool = False,
+        processes: int = 0,
+        similar: bool = False,
+        best_format: bool = False,
+        optimize: Optional[OptimizePolicy] = None,
+        min_saving: Optional[float] = None,
     ):
         super().__init__(
-            auto_compress, add_watermark, ignore_cache, conf, timeout, quiet
+            auto_compress,
+            add_watermark,
+            ignore_cache,
+            conf,
+            timeout,
+            quiet,
+            processes,
+            similar,
+            best_format,
+            optimize,
+            min_saving,
         )
 
         self.cookie: Optional[str] = None
@@ -62,7 +83,7 @@ class Imgtu(Base):
             self.cookie = self.auth_info["cookie"]
             self.token = self.auth_info["token"]
             self.username = self.auth_info["username"]
-            self.__headers["Cookie"] = self.cookie
+            self._load_cookie(self.cookie)
 
     def login(self, username: str, password: str) -> bool:
         url = self._url("login")
@@ -71,26 +92,21 @@ class Imgtu(Base):
         if not auth_token or not cookie:
             raise MissingAuth("auth token or cookie is None")
 
-        headers = self.__headers.copy()
-        headers["Cookie"] = cookie
-
         data = {
             "login-subject": username,
             "password": password,
             "auth_token": auth_token,
         }
 
-        resp = requests.post(
-            url, headers=headers, data=data, allow_redirects=False, timeout=self.timeout
+        # 登录页响应的 cookie 已保存在会话的 cookie jar 中
+        resp = self._request(
+            "post", url, headers=self.__headers, data=data, allow_redirects=False
         )
         if resp.status_code == 301:
             # If there is a KEEPLOGIN field in the cookie,
-            # pictures will be uploaded as a normal user
-            self.cookie = cookie + "; " + resp.headers["Set-Cookie"].split("; ")[0]
-
-            # If there is no KEEPLOGIN field in the cookie,
-            # pictures will be uploaded as a tourist
-            # self.cookie = cookie
+            # pictures will be uploaded as a normal user,
+            # otherwise pictures will be uploaded as a tourist
+            self.cookie = dump_cookies(self.session.cookies)
 
             auth_info = {
                 "token": auth_token,
@@ -105,33 +121,34 @@ class Imgtu(Base):
 
     def _parse_auth_token(self) -> Tuple[Optional[str], Optional[str]]:
         url = self._url("login")
-        resp = requests.get(url, headers=self.__headers, timeout=self.timeout)
+        # 重新登录时丢弃旧的会话 cookie
+        self.session.cookies.clear()
+        resp = self._request("get", url, headers=self.__headers)
         if resp.status_code == 200:
             auth_token = re.search(
                 r'PF.obj.config.auth_token = "([a-f0-9]{40})"', resp.text
             )
             if not auth_token:
                 return None, None
-            resp_set_cookie = resp.headers["Set-Cookie"].split("; ")[0]
-            return auth_token.group(1), resp_set_cookie
+            return auth_token.group(1), dump_cookies(resp.cookies)
         else:
             logger.error("response error", status_code=resp.status_code)
             return None, None
 
+    def _load_cookie(self, cookie: str):
+        domain = parse.urlparse(self.base_url).hostname
+        for name, value in parse_cookie(cookie).items():
+            self.session.cookies.set(name, value, domain=domain)
+
     @property
     def headers(self):
+        # cookie 由会话的 cookie jar 携带
         assert self.cookie != None
 
-        headers = self.__headers.copy()
-        headers.update(
-            {
-                "Cookie": self.cookie,
-            }
-        )
-        return headers
+        return self.__headers.copy()
 
     def _update_auth_token(self):
-        resp = requests.get(self.base_url, headers=self.headers, timeout=self.timeout)
+        resp = self._request("get", self.base_url, headers=self.headers)
         auth_token = re.search(
             r'PF.obj.config.auth_token = "([a-f0-9]{40})"', resp.text
         )
@@ -145,21 +162,19 @@ class Imgtu(Base):
         self.auth_info["token"] = self.token = auth_token
         self._save_auth_info(self.auth_info)
 
-    def __upload(
-        self, image: ImageType, retries: int = 0
-    ) -> Union[str, UploadErrorResponse]:
-        url, md5, ok = self._check_cache(image)  # type: ignore
+    def _token_rejected(self, resp: requests.Response) -> Optional[str]:
+        try:
+            message = resp.json()["error"]["message"]
+        except (ValueError, KeyError, TypeError):
+            return None
 
-        if ok and not self.ignore_cache:
-            return url
+        return AUTH if message == "请求被拒绝 (auth_token)" else None
 
+    def _upload_prepared(
+        self, image: ImageType, md5: str
+    ) -> Union[str, UploadErrorResponse]:
         self.check_login()
 
-        image = self._compress_image(image)
-
-        if isinstance(image, Path):
-            image = self._add_watermark(image)
-
         logger.debug("uploading", image_path=image)
 
         url = self._url("json")
@@ -174,29 +189,31 @@ class Imgtu(Base):
 
         file = File("source", image, filename=filename)
 
-        timestamp = int(time.time() * 1000)
-
-        data = {
-            "type": "file",
-            "action": "upload",
-            "timestamp": str(timestamp),
-            "auth_token": self.token,
-            "nsfw": "0",
-        }
+        def send() -> requests.Response:
+            # 刷新 token 后重试时需要使用新的 token
+            data = {
+                "type": "file",
+                "action": "upload",
+                "timestamp": str(int(time.time() * 1000)),
+                "auth_token": self.token,
+                "nsfw": "0",
+            }
 
-        try:
             if not self.quiet:
-                resp = upload_with_progress_bar(
-                    url, file, self.timeout, data, self.headers
-                )
-            else:
-                resp = requests.post(
-                    url,
-                    headers=self.headers,
-                    data=data,
-                    files=file.to_dict(),
-                    timeout=self.timeout,
+                return upload_with_progress_bar(
+                    url, file, self.timeout, data, self.headers, self.session
                 )
+
+            return self.session.post(
+                url,
+                headers=self.headers,
+                data=data,
+                files=file.to_dict(),  # type: ignore
+                timeout=self.timeout,
+            )
+
+        try:
+            resp = self._send_authorized(send, self._token_rejected)
         except requests.exceptions.ConnectionError as e:
             return UploadErrorResponse(400, str(e), str(image))
 
@@ -224,31 +241,17 @@ class Imgtu(Base):
 
             return uploaded_url
         except KeyError:
-            if json_resp["error"]["message"] == "请求被拒绝 (auth_token)":
-                if retries >= 3:
-                    return UploadErrorResponse(
-                        resp.status_code, resp.json()["error"]["message"], str(image)
-                    )
-
-                logger.warning(
-                    "`auth_token` has expired, the program will try to update `auth_token` automatically, number of retries",
-                    retries=retries + 1,
-                )
-                self._update_auth_token()
-
-                return self.__upload(image, retries + 1)
-            else:
-                return UploadErrorResponse(
-                    resp.status_code, resp.json()["error"]["message"], str(image)
-                )
+            return UploadErrorResponse(
+                resp.status_code, json_resp["error"]["message"], str(image)
+            )
 
     def upload_image(self, image_path: ImagePath) -> Union[str, UploadErrorResponse]:
-        return self.__upload(image_path)
+        return self._upload_image(image_path)
 
     def upload_image_stream(
         self, image: ImageStream
     ) -> Union[str, UploadErrorResponse]:
-        return self.__upload(image)
+        return self._upload_image(image)
 
     def get_all_images(self) -> Union[List[ImgtuResponse], ErrorResponse]:
         self.check_login()
@@ -259,7 +262,7 @@ class Imgtu(Base):
         images: Set[Tuple[str, ...]] = set()
 
         def visit_next_page(url: str):
-            resp = requests.get(url, headers=self.__headers, timeout=self.timeout)
+            resp = self._request("get", url, headers=self.__headers)
             resp.encoding = "utf-8"
 
             if resp.status_code != 200:
@@ -312,72 +315,58 @@ class Imgtu(Base):
 
         return result
 
-    def delete_image(self, img_id: str, retries: int = 0) -> Optional[ErrorResponse]:
+    def delete_image(self, img_id: str) -> Optional[ErrorResponse]:
         self.check_login()
 
         url = self._url("json")
-        data = {
-            "auth_token": self.token,
-            "action": "delete",
-            "single": "true",
-            "delete": "image",
-            "deleting[id]": img_id,
-        }
-        resp = requests.post(
-            url, headers=self.__headers, data=data, timeout=self.timeout
-        )
-        if resp.status_code == 400:
-            if resp.json()["error"]["message"] == "请求被拒绝 (auth_token)":
-                if retries >= 3:
-                    return ErrorResponse(
-                        resp.status_code, resp.json()["error"]["message"]
-                    )
 
-                logger.warn(
-                    "`auth_token` has expired, the program will try to update `auth_token` automatically, number of retries: %d",
-                    retries + 1,
-                )
-                self._update_auth_token()
-                return self.delete_image(img_id, retries + 1)
+        def send() -> requests.Response:
+            data = {
+                "auth_token": self.token,
+                "action": "delete",
+                "single": "true",
+                "delete": "image",
+                "deleting[id]": img_id,
+            }
+            # 重试与限速由 _send_authorized 负责
+            return self.session.post(
+                url, headers=self.__headers, data=data, timeout=self.timeout
+            )
 
+        resp = self._send_authorized(send, self._token_rejected)
         if resp.status_code == 200:
             return None
 
         return ErrorResponse(resp.status_code, resp.json()["error"]["message"])
 
-    def delete_images(
-        self, imgs_id: List[str], retries: int = 0
-    ) -> Dict[str, ErrorResponse]:
+    def delete_images(self, imgs_id: List[str]) -> Dict[str, ErrorResponse]:
         self.check_login()
 
         url = self._url("json")
-        data = {
-            "auth_token": self.token,
-            "action": "delete",
-            "from": "list",
-            "multiple": "true",
-            "delete": "images",
-            "deleting[ids][]": imgs_id,
-        }
-        resp = requests.post(
-            url, headers=self.__headers, data=data, timeout=self.timeout
-        )
+
+        def send() -> requests.Response:
+            data = {
+                "auth_token": self.token,
+                "action": "delete",
+                "from": "list",
+                "multiple": "true",
+                "delete": "images",
+                "deleting[ids][]": imgs_id,
+            }
+            # 重试与限速由 _send_authorized 负责
+            return self.session.post(
+                url, headers=self.__headers, data=data, timeout=self.timeout
+            )
+
+        resp = self._send_authorized(send, self._token_rejected)
         json_resp = resp.json()
         if resp.status_code == 400:
-            if json_resp["error"]["message"] == "请求被拒绝 (auth_token)":
-                if retries >= 3:
-                    # 删除多张图片时如果重试3次仍无法成功响应则退出程序
-                    logger.fatal(
-                        "authentication information is invalid",
-                        error=resp.json()["error"]["message"],
-                    )
-
-                logger.warn(
-                    "`auth_token` has expired, the program will try to update `auth_token` automatically, number of retries: %d",
-                    retries + 1,
+            if self._token_rejected(resp):
+                # 删除多张图片时如果重试多次仍无法成功响应则退出程序
+                logger.fatal(
+                    "authentication information is invalid",
+                    error=json_resp["error"]["message"],
                 )
-                self._update_auth_token()
-                return self.delete_images(imgs_id, retries + 1)
             elif json_resp["error"]["code"] == 106:
                 # imgtu 只有删除的所有 id 都无效时才会返回这个错误
                 # 只要有一个有效 id，就会返回 200
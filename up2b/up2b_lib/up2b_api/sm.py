@@ -5,7 +5,6 @@ import re
 import requests
 
 from typing import List, Optional, Dict, Any, Union
-from pathlib import Path
 from up2b.up2b_lib.custom_types import (
     Config,
     ErrorResponse,
@@ -15,11 +14,13 @@ from up2b.up2b_lib.custom_types import (
     ImageType,
     SMMSResponse,
     UploadErrorResponse,
+    OptimizePolicy,
 )
 from up2b.up2b_lib.file import File
 from up2b.up2b_lib.up2b_api import Base
 from up2b.up2b_lib.constants import IMAGE_BEDS_NAME, ImageBedCode
 from up2b.up2b_lib.log import child_logger
+from up2b.up2b_lib.retry import AUTH
 from up2b.up2b_lib.http import upload_with_progress_bar
 
 logger = child_logger(__name__)
@@ -39,9 +40,24 @@ class SM(Base):
         conf: Optional[Config] = None,
         timeout: Optional[float] = None,
         quiet: bool = False,
+        processes: int = 0,
+        similar: bool = False,
+        best_format: bool = False,
+        optimize: Optional[OptimizePolicy] = None,
+        min_saving: Optional[float] = None,
     ):
         super().__init__(
-            auto_compress, add_watermark, ignore_cache, conf, timeout, quiet
+            auto_compress,
+            add_watermark,
+            ignore_cache,
+            conf,
+            timeout,
+            quiet,
+            processes,
+            similar,
+            best_format,
+            optimize,
+            min_saving,
         )
 
         if self.auth_info:
@@ -76,12 +92,12 @@ class SM(Base):
     def _get_api_token(self, username: str, password: str) -> str:
         url = self._url("token")
         data = {"username": username, "password": password}
-        resp = requests.post(url, data=data, timeout=self.timeout).json()
+        resp = self._request("post", url, data=data).json()
         return resp["data"]["token"]
 
     def _get_user_profile(self) -> Optional[Dict[str, str]]:
         url = self._url("profile")
-        resp = requests.post(url, headers=self.headers, timeout=self.timeout).json()
+        resp = self._request("post", url, headers=self.headers).json()
         if resp["success"]:
             return resp["data"]
         else:
@@ -90,32 +106,44 @@ class SM(Base):
                 self.token = self.auth_info["token"]  # type: ignore
         return None
 
-    def __upload(self, image: ImageType, retries=0) -> Union[str, UploadErrorResponse]:
-        self.check_login()
+    def _update_auth_token(self):
+        self._auto_login()
+        assert self.auth_info is not None
+        self.token = self.auth_info["token"]
+        self.headers["Authorization"] = self.token
 
-        url, md5, ok = self._check_cache(image)  # type: ignore
+    def _token_expired(self, res: requests.Response) -> Optional[str]:
+        try:
+            return AUTH if self._login_expired(res.json()) else None
+        except ValueError:
+            return None
 
-        if ok and not self.ignore_cache:
-            return url
+    def _upload_prepared(
+        self, image: ImageType, md5: str
+    ) -> Union[str, UploadErrorResponse]:
+        self.check_login()
 
         logger.debug("uploading", image=image)
 
-        image = self._compress_image(image)
-
-        if isinstance(image, Path):
-            image = self._add_watermark(image)
-
         # sm.ms不管出不出错，返回的状态码都是200
         url = self._url("upload")
 
         file = File("smfile", image)
 
-        if self.quiet:
-            res = requests.post(
-                url, headers=self.headers, files=file.to_dict(), timeout=self.timeout  # type: ignore
+        def send() -> requests.Response:
+            if self.quiet:
+                return self.session.post(
+                    url,
+                    headers=self.headers,
+                    files=file.to_dict(),  # type: ignore
+                    timeout=self.timeout,
+                )
+
+            return upload_with_progress_bar(
+                url, file, self.timeout, None, self.headers, self.session
             )
-        else:
-            res = upload_with_progress_bar(url, file, self.timeout, None, self.headers)
+
+        res = self._send_authorized(send, self._token_expired)
 
         logger.debug("响应", status=res.status_code, body=res.text)
 
@@ -143,21 +171,8 @@ class SM(Base):
                 image_url: str = resp["images"]
                 return image_url
             elif self._login_expired(resp):
-                assert self.auth_info is not None
-
-                if retries >= 3:
-                    return UploadErrorResponse(401, "认证信息无效", str(image))
-
-                logger.warn(
-                    "`auth_token` has expired, the program will try to update `auth_token` automatically, number of retries: %d",
-                    retries + 1,
-                )
-
-                self._auto_login()
-                assert self.auth_info is not None
-                self.token = self.auth_info["token"]
-
-                return self.__upload(image, retries + 1)
+                # 多次刷新 token 后仍然无效
+                return UploadErrorResponse(401, "认证信息无效", str(image))
             else:
                 error = resp["message"]
                 logger.error(
@@ -168,10 +183,10 @@ class SM(Base):
                 return UploadErrorResponse(400, error, str(image))
 
     def upload_image(self, image_path: ImagePath):
-        return self.__upload(image_path)
+        return self._upload_image(image_path)
 
     def upload_image_stream(self, image: ImageStream):
-        return self.__upload(image)
+        return self._upload_image(image)
 
     def history(self) -> Dict[str, Any]:
         """
@@ -180,7 +195,7 @@ class SM(Base):
         self.check_login()
 
         url = self._url("history")
-        resp = requests.get(url, headers=self.headers, timeout=self.timeout)
+        resp = self._request("get", url, headers=self.headers)
         return resp.json()
 
     def clear(self) -> Dict[str, Any]:
@@ -190,14 +205,14 @@ class SM(Base):
         self.check_login()
 
         url = self._url("clear")
-        resp = requests.get(url, headers=self.headers, timeout=self.timeout)
+        resp = self._request("get", url, headers=self.headers)
         return resp.json()
 
     def upload_history(self) -> Union[ErrorResponse, List[Dict[str, Any]]]:
         self.check_login()
 
         url = self._url("upload_history")
-        resp = requests.get(url, headers=self.headers, timeout=self.timeout).json()
+        resp = self._request("get", url, headers=self.headers).json()
         if resp["code"] != "success":
             if resp["code"] == "unauthorized":
                 return ErrorResponse(401, resp["message"])
@@ -228,7 +243,7 @@ class SM(Base):
     def delete_image(self, delete_url: str) -> Optional[ErrorResponse]:
         self.check_login()
 
-        resp = requests.get(delete_url, timeout=self.timeout)
+        resp = self._request("get", delete_url)
 
         re_res = re.search(r'<div class="card-body">\n\s+(.*?)\n', resp.text)
         if not re_res:
@@ -4,9 +4,23 @@
 import json
 import os
 import locale
+import shutil
+import tempfile
 import requests
 
-from typing import List, Sequence, Tuple, Union
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import (
+    Any,
+    Callable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
 from functools import wraps, partial
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -14,7 +28,10 @@ from urllib.parse import urlparse
 
 from up2b.up2b_lib.constants import (
     CONFIG_FILE,
+    DEFAULT_HASH_ALGORITHM,
+    DEFAULT_POOL_SIZE,
     DEFAULT_TIMEOUT,
+    HASH_ALGORITHMS,
     IS_MACOS,
     PYTHON_VERSION,
     CACHE_PATH,
@@ -24,6 +41,7 @@ from up2b.up2b_lib.custom_types import (
     Config,
     DownloadErrorResponse,
     ImageType,
+    RateLimitConfig,
     WaterMarkConfig,
 )
 from up2b.up2b_lib.log import child_logger
@@ -31,6 +49,11 @@ from up2b.up2b_lib.log import child_logger
 
 logger = child_logger(__name__)
 
+T = TypeVar("T")
+
+# 当前批次的临时目录，处理后的图片都写入其中，批次结束后只删除这个目录
+_work_dir: ContextVar[Optional[Path]] = ContextVar("up2b_work_dir", default=None)
+
 
 def timeout_in_env() -> float:
     t = os.getenv("UP2B_TIMEOUT")
@@ -43,6 +66,85 @@ def timeout_in_env() -> float:
         return DEFAULT_TIMEOUT
 
 
+def pool_size_in_env() -> int:
+    size = os.getenv("UP2B_POOL_SIZE")
+    if not size:
+        return DEFAULT_POOL_SIZE
+
+    try:
+        return max(1, int(size))
+    except ValueError:
+        return DEFAULT_POOL_SIZE
+
+
+def hash_algorithm_in_env() -> str:
+    algorithm = os.getenv("UP2B_HASH_ALGORITHM")
+    if not algorithm:
+        return DEFAULT_HASH_ALGORITHM
+
+    algorithm = algorithm.lower()
+    if algorithm not in HASH_ALGORITHMS:
+        logger.warning(
+            "unsupported hash algorithm, use the default algorithm",
+            algorithm=algorithm,
+            default=DEFAULT_HASH_ALGORITHM,
+        )
+        return DEFAULT_HASH_ALGORITHM
+
+    return algorithm
+
+
+def work_dir() -> Path:
+    """当前批次的临时目录，不在批次中时为 ``CACHE_PATH``。"""
+    path = _work_dir.get() or CACHE_PATH
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def output_path(filename: str) -> Path:
+    """在当前批次的临时目录中为输出文件创建单独的目录。
+
+    不同目录中的同名图片在多个线程或进程中同时处理时，输出文件不会互相覆盖。
+    """
+    return Path(tempfile.mkdtemp(dir=work_dir())) / filename
+
+
+@contextmanager
+def use_work_dir(path: Path) -> Iterator[Path]:
+    token = _work_dir.set(path)
+    try:
+        yield path
+    finally:
+        _work_dir.reset(token)
+
+
+@contextmanager
+def batch_work_dir() -> Iterator[Path]:
+    """为一个批次创建单独的临时目录，批次结束后删除。
+
+    多个批次可以同时上传，一个批次结束时不会删除其他批次还未上传的图片。
+    """
+    path = Path(tempfile.mkdtemp(dir=work_dir(), prefix="batch-"))
+    try:
+        with use_work_dir(path):
+            yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+        logger.debug("batch work dir has been removed", path=path)
+
+
+def in_context(func: Callable[..., T]) -> Callable[..., T]:
+    """在其他线程中执行 ``func`` 时使用当前线程的上下文，如当前批次的临时目录。"""
+    ctx = copy_context()
+
+    @wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        # 同一个上下文不能在多个线程中同时进入，每次调用使用副本
+        return ctx.copy().run(func, *args, **kwargs)
+
+    return wrapper
+
+
 def check_image_exists(images: Tuple[Union[ImageType, DownloadErrorResponse], ...]):
     for image in images:
         if isinstance(image, Path) and not image.exists():
@@ -75,10 +177,16 @@ def read_conf() -> Config:
 
         watermark = conf.get("watermark")
 
+        rate_limits = {
+            ImageBedCode(int(k)): RateLimitConfig.from_dict(v)
+            for k, v in conf.get("rate_limits", {}).items()
+        }
+
         return Config(
             ImageBedCode(conf.get("image_bed")),
             auth_data,
             WaterMarkConfig.from_dict(watermark) if watermark else None,
+            rate_limits,
         )
 
 
@@ -151,10 +259,7 @@ def download_online_image(url: str):
 
     filename = os.path.basename(url)
 
-    if not CACHE_PATH.exists():
-        CACHE_PATH.mkdir()
-
-    cache_path = CACHE_PATH / filename
+    cache_path = output_path(filename)
 
     with cache_path.open("wb") as fb:
         fb.write(resp.content)
@@ -182,7 +287,8 @@ def check_paths(paths: Union[Sequence[str], Sequence[Path]]):
     logger.info("使用线程池下载多张图片...")
     with ThreadPoolExecutor(4) as pool:
         futures = {
-            pool.submit(check_path, Path(paths[i])): i for i in range(len(paths))
+            pool.submit(in_context(check_path), Path(paths[i])): i
+            for i in range(len(paths))
         }
 
         for future in as_completed(futures):
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from tqdm import tqdm
+from up2b.up2b_lib.cache import Cache
+from up2b.up2b_lib.constants import CACHE_VERIFY_BATCH, CACHE_VERIFY_JOBS
+from up2b.up2b_lib.custom_types import CacheVerifyResult
+from up2b.up2b_lib.http import new_session
+from up2b.up2b_lib.log import child_logger
+from up2b.up2b_lib.utils import timeout_in_env
+
+logger = child_logger(__name__)
+
+# 只有这些状态码表示图片确实已被删除，其他错误可能只是暂时的
+DEAD_STATUS_CODES = (404, 410)
+
+
+def check_url(session: requests.Session, url: str, timeout: float) -> Optional[bool]:
+    """检查图片链接是否仍可访问。
+
+    :returns: 可访问时为 True，已失效时为 False，无法确定时为 None
+    """
+    try:
+        resp = session.head(url, timeout=timeout, allow_redirects=True)
+        if resp.status_code in (405, 501):
+            # 不支持 HEAD 请求的服务器，只读取响应头
+            with session.get(url, timeout=timeout, stream=True) as resp:
+                pass
+    except requests.RequestException as e:
+        logger.debug("failed to check url", url=url, error=e)
+        return None
+
+    if resp.status_code in DEAD_STATUS_CODES:
+        return False
+
+    if resp.status_code < 400:
+        return True
+
+    logger.debug("unexpected status code", url=url, status_code=resp.status_code)
+    return None
+
+
+def verify_cache(
+    cache: Cache,
+    jobs: int = CACHE_VERIFY_JOBS,
+    timeout: Optional[float] = None,
+    prune: bool = True,
+    quiet: bool = False,
+) -> CacheVerifyResult:
+    """并发检查所有缓存的图片链接，删除已失效的记录后重建数据库。
+
+    所有请求共用一个连接池大小为 ``jobs`` 的会话，同一图床的链接复用连接。
+
+    :param cache: 要检查的缓存
+    :param jobs: 同时检查的链接数量
+    :param timeout: 每个请求的超时时间，默认读取环境变量 UP2B_TIMEOUT
+    :param prune: 为 False 时只列出失效的链接，不修改数据库
+    :param quiet: 不显示进度条
+    """
+    timeout = timeout_in_env() if timeout is None else timeout
+    session = new_session(jobs)
+
+    result = CacheVerifyResult()
+    dead_ids: List[int] = []
+
+    def check(row: Tuple[int, str]) -> Tuple[int, str, Optional[bool]]:
+        return row[0], row[1], check_url(session, row[1], timeout)
+
+    try:
+        with ThreadPoolExecutor(jobs) as executor, tqdm(
+            total=cache.count(), unit="url", disable=quiet
+        ) as bar:
+            # 分批读取，大量记录时不必一次载入内存
+            for rows in cache.iter_urls(CACHE_VERIFY_BATCH):
+                for id, url, alive in executor.map(check, rows):
+                    result.total += 1
+                    if alive:
+                        result.alive += 1
+                    elif alive is None:
+                        result.unknown.append(url)
+                    else:
+                        result.dead.append(url)
+                        dead_ids.append(id)
+
+                bar.update(len(rows))
+    finally:
+        session.close()
+
+    logger.info(
+        "缓存检查完成",
+        total=result.total,
+        alive=result.alive,
+        dead=len(result.dead),
+        unknown=len(result.unknown),
+    )
+
+    if prune and dead_ids:
+        result.pruned = cache.delete(dead_ids)
+        cache.vacuum()
+
+        logger.info("已删除失效的缓存记录", count=result.pruned)
+
+    return result
@@ -20,8 +20,7 @@ except ModuleNotFoundError:
 from typing import List, Tuple
 from collections import namedtuple
 
-from up2b.up2b_lib.constants import CACHE_PATH
-from up2b.up2b_lib.utils import is_ascii
+from up2b.up2b_lib.utils import is_ascii, output_path
 
 TypeFont = namedtuple("TypeFont", ["text", "size", "font_path", "color"])
 
@@ -164,10 +163,7 @@ class AddWatermark:
         combined = combined.convert("RGB")
         filename = os.path.splitext(os.path.basename(image_path))[0] + ".jpg"
 
-        if not CACHE_PATH.exists():
-            CACHE_PATH.mkdir()
-
-        new_path = CACHE_PATH / filename
+        new_path = output_path(filename)
 
         combined.save(new_path)
 
@@ -207,4 +203,4 @@ class AddWatermark:
         combined = combined.convert("RGB")
         filename = os.path.splitext(os.path.basename(image_path))[0] + ".jpg"
 
-        combined.save(os.path.join(CACHE_PATH, filename))
+        combined.save(output_path(filename))